@@ -0,0 +1,240 @@
+# achievements.py
+import hashlib
+import json
+import sys
+import time
+from bisect import bisect_right
+
+from xp_ledger import period_keys
+
+XP_LEVELS = [0, 50, 120, 250, 500, 1000, 2000] # XP required to *reach* the next level (level 0 needs 0, level 1 needs 50, etc.)
+BACKFILL_CHUNK_SIZE = 10000 # Users (by rowid) evaluated per backfill transaction
+
+# Single source of truth: the app evaluates these and init_db() upserts them into the achievements table whenever they change
+ALL_ACHIEVEMENTS = {
+    # Key: Unique Identifier
+    # Value: Dictionary with achievement details
+    'STREAK_3': {
+        'name': 'On Fire!', 'description': 'Maintain a 3-day streak.', 'icon': 'fas fa-fire',
+        'criteria_type': 'streak', 'criteria_value': 3,
+        'reward_gems': 10, 'reward_xp': 20
+    },
+    'STREAK_7': {
+        'name': 'Week Streak', 'description': 'Maintain a 7-day streak.', 'icon': 'fas fa-calendar-week',
+        'criteria_type': 'streak', 'criteria_value': 7,
+        'reward_gems': 25, 'reward_xp': 50
+    },
+    'LEVEL_5': {
+        'name': 'Level 5 Reached', 'description': 'Reach Level 5.', 'icon': 'fas fa-star',
+        'criteria_type': 'level', 'criteria_value': 5,
+        'reward_gems': 15, 'reward_xp': 30
+    },
+    'LESSONS_1': {
+        'name': 'First Steps', 'description': 'Complete your first lesson.', 'icon': 'fas fa-shoe-prints',
+        'criteria_type': 'lessons_total', 'criteria_value': 1,
+        'reward_gems': 5, 'reward_xp': 10
+    },
+    'LESSONS_10':{
+        'name': 'Getting Started', 'description': 'Complete 10 lessons (total).', 'icon': 'fas fa-seedling',
+        'criteria_type': 'lessons_total', 'criteria_value': 10,
+        'reward_gems': 20, 'reward_xp': 40
+    },
+    # Add more achievements:
+}
+
+
+class AchievementEngine:
+    """
+    Achievement definitions indexed by criteria for event-driven evaluation.
+    Each (criteria_type, criteria_extra) pair has a "ladder" of thresholds sorted
+    ascending, so a counter moving from old_value to new_value only has to look at
+    the thresholds it crossed - found by bisection, independent of how many
+    achievements are defined.
+    """
+
+    def __init__(self, definitions):
+        ladders = {}
+        for key, achievement in definitions.items():
+            ladder_key = (achievement['criteria_type'], achievement.get('criteria_extra'))
+            ladders.setdefault(ladder_key, []).append((achievement['criteria_value'], key, achievement))
+
+        self._thresholds = {}  # (criteria_type, criteria_extra) -> sorted thresholds
+        self._entries = {}     # (criteria_type, criteria_extra) -> [(key, achievement)] in the same order
+        for ladder_key, ladder in ladders.items():
+            ladder.sort(key=lambda item: (item[0], item[1]))
+            self._thresholds[ladder_key] = [value for value, _, _ in ladder]
+            self._entries[ladder_key] = [(key, achievement) for _, key, achievement in ladder]
+
+    def crossed(self, criteria_type, old_value, new_value, criteria_extra=None):
+        """Achievements whose threshold lies in (old_value, new_value], lowest first."""
+        ladder_key = (criteria_type, criteria_extra)
+        thresholds = self._thresholds.get(ladder_key)
+        if not thresholds or new_value <= old_value:
+            return []
+        start = bisect_right(thresholds, old_value)
+        stop = bisect_right(thresholds, new_value)
+        return self._entries[ladder_key][start:stop]
+
+
+def sync_achievement_definitions(conn, definitions=ALL_ACHIEVEMENTS):
+    """Upserts `definitions` into the achievements table (caller commits). Returns how many were written."""
+    conn.executemany(
+        """INSERT INTO achievements (achievement_key, name, description, icon, reward_xp, reward_gems, criteria_type, criteria_value)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(achievement_key) DO UPDATE SET
+               name=excluded.name, description=excluded.description, icon=excluded.icon,
+               reward_xp=excluded.reward_xp, reward_gems=excluded.reward_gems,
+               criteria_type=excluded.criteria_type, criteria_value=excluded.criteria_value""",
+        [(key, achievement['name'], achievement['description'], achievement.get('icon'),
+          achievement.get('reward_xp', 0), achievement.get('reward_gems', 0),
+          achievement['criteria_type'], achievement['criteria_value'])
+         for key, achievement in definitions.items()]
+    )
+    return len(definitions)
+
+
+def definitions_digest(definitions=ALL_ACHIEVEMENTS):
+    return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode()).hexdigest()
+
+
+def sync_changed_achievement_definitions(conn, definitions=ALL_ACHIEVEMENTS):
+    """
+    Syncs `definitions` when their digest differs from the one recorded by the last sync (caller commits).
+    Returns how many were written: 0 when nothing changed, which costs one primary-key read.
+    """
+    digest = definitions_digest(definitions)
+    row = conn.execute("SELECT digest FROM definition_digests WHERE name = 'achievements'").fetchone()
+    if row is not None and row[0] == digest:
+        return 0
+    synced = sync_achievement_definitions(conn, definitions)
+    conn.execute("""INSERT INTO definition_digests (name, digest) VALUES ('achievements', ?)
+                    ON CONFLICT(name) DO UPDATE SET digest = excluded.digest""", (digest,))
+    return synced
+
+
+def _criteria_fingerprint(achievement):
+    return f"{achievement['criteria_type']}|{achievement.get('criteria_extra') or ''}|{achievement['criteria_value']}"
+
+
+def qualifying_users_sql(achievement, xp_levels=XP_LEVELS):
+    """
+    SELECT of the emails in users.rowid range [:start, :stop] that meet an achievement's criteria,
+    plus its extra named parameters. None if the criteria can never be met.
+    """
+    criteria_type = achievement['criteria_type']
+    value = achievement['criteria_value']
+    if criteria_type == 'streak':
+        return "SELECT u.email FROM users u WHERE u.rowid BETWEEN :start AND :stop AND u.streak >= :threshold", {"threshold": value}
+    if criteria_type == 'level':
+        if value > len(xp_levels):
+            return None
+        # Level N starts at XP_LEVELS[N-1] (see calculate_level_xp)
+        return ("SELECT u.email FROM users u WHERE u.rowid BETWEEN :start AND :stop AND u.xp >= :threshold",
+                {"threshold": xp_levels[max(value, 1) - 1]})
+    if criteria_type == 'lessons_total':
+        return ("""SELECT u.email FROM users u JOIN user_stats s ON s.user_email = u.email
+                   WHERE u.rowid BETWEEN :start AND :stop AND s.lessons_completed >= :threshold""",
+                {"threshold": value})
+    if criteria_type == 'lessons_language':
+        return ("""SELECT u.email FROM users u JOIN user_language_stats s ON s.user_email = u.email AND s.language = :language
+                   WHERE u.rowid BETWEEN :start AND :stop AND s.lessons_completed >= :threshold""",
+                {"threshold": value, "language": achievement.get('criteria_extra')})
+    return None
+
+
+def _award_chunk(conn, key, achievement, select_sql, params, timestamp):
+    """Awards one rowid range in a single short write transaction; returns the number of users awarded."""
+    reward_xp = achievement.get('reward_xp', 0)
+    reward_gems = achievement.get('reward_gems', 0)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM temp.backfill_awards")
+        awarded = conn.execute(
+            f"""INSERT INTO temp.backfill_awards (user_email)
+                SELECT q.email FROM ({select_sql}) q
+                WHERE NOT EXISTS (SELECT 1 FROM user_achievements ua WHERE ua.user_email = q.email AND ua.achievement_key = :key)""",
+            {**params, "key": key}
+        ).rowcount
+        if awarded:
+            conn.execute("INSERT INTO user_achievements (user_email, achievement_key) SELECT user_email, ? FROM temp.backfill_awards", (key,))
+            if reward_xp or reward_gems:
+                conn.execute("UPDATE users SET xp = xp + ?, gems = gems + ? WHERE email IN (SELECT user_email FROM temp.backfill_awards)",
+                             (reward_xp, reward_gems))
+            if reward_xp: # Same bookkeeping as xp_ledger.record_xp_event, set-wise
+                conn.execute("""INSERT INTO xp_events (user_email, amount, source, created_at)
+                                SELECT user_email, ?, ?, ? FROM temp.backfill_awards""",
+                             (reward_xp, f"achievement:{key}", timestamp))
+                for period_key in period_keys(timestamp).values():
+                    conn.execute(
+                        """INSERT INTO xp_period_totals (period, user_email, xp)
+                           SELECT ?, user_email, ? FROM temp.backfill_awards WHERE true
+                           ON CONFLICT(period, user_email) DO UPDATE SET xp = xp + excluded.xp""",
+                        (period_key, reward_xp)
+                    )
+        conn.execute(
+            """INSERT INTO achievement_backfill_progress (achievement_key, criteria, last_user_id) VALUES (?, ?, ?)
+               ON CONFLICT(achievement_key) DO UPDATE SET criteria = excluded.criteria, last_user_id = excluded.last_user_id""",
+            (key, _criteria_fingerprint(achievement), params["stop"])
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return awarded
+
+
+def backfill_achievements(conn, definitions=ALL_ACHIEVEMENTS, chunk_size=BACKFILL_CHUNK_SIZE, report=print):
+    """
+    Awards every user who currently meets an achievement but doesn't have it yet (e.g. after a new
+    or lowered threshold), with set-wise INSERT ... SELECT statements over users.rowid ranges.
+    Each range is one short transaction that also records a checkpoint, so an interrupted run
+    resumes where it stopped; changing an achievement's criteria restarts its scan.
+    Level achievements run last so they see XP granted by the other rewards.
+    Running app workers pick the XP changes up on their next leaderboard refresh.
+    Returns {achievement_key: users awarded}.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS backfill_awards (user_email TEXT PRIMARY KEY)")
+    max_user_id = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM users").fetchone()[0]
+    checkpoints = {row[0]: (row[1], row[2]) for row in
+                   conn.execute("SELECT achievement_key, criteria, last_user_id FROM achievement_backfill_progress")}
+    ordered = sorted(definitions.items(),
+                     key=lambda item: (item[1]['criteria_type'] == 'level', item[1]['criteria_value'], item[0]))
+
+    awarded_counts = {}
+    xp_granted = False
+    for key, achievement in ordered:
+        query = qualifying_users_sql(achievement)
+        if query is None:
+            report(f"⚠️ Skipping {key}: criteria '{achievement['criteria_type']}' can't be evaluated in bulk.")
+            continue
+        select_sql, params = query
+        start = 1
+        checkpoint = checkpoints.get(key)
+        if checkpoint and checkpoint[0] == _criteria_fingerprint(achievement):
+            start = checkpoint[1] + 1
+        if achievement['criteria_type'] == 'level' and xp_granted:
+            start = 1 # Rewards granted above may have pushed already-scanned users over the threshold
+
+        awarded_counts[key] = 0
+        while start <= max_user_id:
+            stop = min(start + chunk_size - 1, max_user_id)
+            awarded_counts[key] += _award_chunk(conn, key, achievement, select_sql,
+                                                {**params, "start": start, "stop": stop}, int(time.time()))
+            report(f"  {key}: users {stop}/{max_user_id} ({stop * 100 // max_user_id}%), {awarded_counts[key]} awarded")
+            start = stop + 1
+        if awarded_counts[key] and achievement.get('reward_xp', 0):
+            xp_granted = True
+    return awarded_counts
+
+
+if __name__ == "__main__":
+    # Backfill command (after changing ALL_ACHIEVEMENTS): python achievements.py [chunk_size]
+    from database import DATABASE, init_db
+    from db_pool import create_connection
+
+    init_db() # Also syncs the definitions, so new keys exist before they're awarded
+    chunk = int(sys.argv[1]) if len(sys.argv) > 1 else BACKFILL_CHUNK_SIZE
+    connection = create_connection(DATABASE)
+    results = backfill_achievements(connection, chunk_size=chunk)
+    connection.close()
+    print(f"✅ Backfill complete: {sum(results.values())} achievements awarded ({results}).")
@@ -0,0 +1,93 @@
+# app_logging.py
+# Structured, non-blocking logging for request handlers.
+# Handlers only put the LogRecord on an in-memory queue; a QueueListener thread does the
+# formatting and the stdout write, so a slow or contended log pipe never stalls a request.
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()             # DEBUG enables the per-request traces
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))    # Fraction of high-frequency events kept
+
+logger = logging.getLogger("lingualearn")
+_handler = None  # Queue handler on `logger`, once set up
+_output = None   # Stream handler the listener writes to
+_listener = None # This process's listener thread
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Renders records as `ts=... level=... event=... key=value ...` lines."""
+
+    @staticmethod
+    def _value(value):
+        text = str(value)
+        if text == "" or any(char in text for char in ' ="\n'):
+            return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        return text
+
+    def format(self, record):
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        parts = [f"ts={timestamp}.{int(record.msecs):03d}", f"level={record.levelname.lower()}", f"event={record.getMessage()}"]
+        parts += [f"{key}={self._value(value)}" for key, value in getattr(record, "fields", {}).items()]
+        if record.exc_info:
+            parts.append(f"exc={self._value(self.formatException(record.exc_info))}")
+        return " ".join(parts)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread (the stock one formats in the caller)."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """Installs the queue handler on the app logger and starts the listener thread (idempotent)."""
+    global _handler, _output
+    if _handler is not None:
+        return logger
+    _output = logging.StreamHandler(stream or sys.stdout)
+    _output.setFormatter(KeyValueFormatter())
+    _handler = _DeferredQueueHandler(queue.SimpleQueue())
+    _start_listener()
+    atexit.register(_stop_listener) # Flushes queued records on shutdown
+    # Threads don't survive a fork: a preforked worker gets its own queue and listener
+    os.register_at_fork(after_in_child=_start_listener)
+
+    logger.addHandler(_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def _start_listener():
+    """Points the handler at a fresh queue drained by a new listener thread in this process."""
+    global _listener
+    log_queue = queue.SimpleQueue() # Records the parent queued before a fork are the parent's to write
+    _handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, _output, respect_handler_level=False)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def log_event(event, level=logging.INFO, sampled=False, exc_info=None, **fields):
+    """
+    Logs a structured event. Disabled levels cost one level check; `sampled=True` keeps only
+    LOG_SAMPLE_RATE of the calls (for per-request events) and records the rate in the line.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sampled:
+        if random.random() >= LOG_SAMPLE_RATE:
+            return
+        fields["sample_rate"] = LOG_SAMPLE_RATE
+    logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
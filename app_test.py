@@ -1,180 +1,224 @@
 import sqlite3
+import logging
 import json
 import os
 import math # Needed for ceil, floor
 import hashlib # For profile color generation
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
+import hmac
+import mimetypes
+import time
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, g, abort, has_app_context, send_from_directory, get_template_attribute
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, date # Import date
+from app_logging import setup_logging, log_event
+from assets import AssetManifest
+from database import init_db
+from db_pool import ConnectionPool
+from fragment_cache import FragmentCache
+from user_cache import UserCache, UserChangeFeed
+from write_behind import WriteBehindQueue
+from password_hasher import HasherBusy, PasswordHasher
+from metrics import QueryStats, RequestMetrics, TracedConnection
+from lesson_catalog import CatalogLoader
+from grading import client_lesson
+from leaderboard import Leaderboard, rank_from_sql, top_from_sql
+from achievements import ALL_ACHIEVEMENTS, XP_LEVELS, AchievementEngine
+from user_stats import increment_lesson_counts, get_lessons_completed
+from xp_ledger import last_xp_event_id, record_xp_event, windowed_leaderboard, windowed_rank, PERIODS
 
 load_dotenv()
+setup_logging() # Queue-backed; LOG_LEVEL=DEBUG enables per-request traces, LOG_SAMPLE_RATE thins routine events
 
 HEART_REGEN_TIME_SECONDS = 120 # Example: 2 minutes (120 seconds) per heart
 MAX_HEARTS = 5
-XP_LEVELS = [0, 50, 120, 250, 500, 1000, 2000] # XP required to *reach* the next level (level 0 needs 0, level 1 needs 50, etc.)
 LEADERBOARD_LIMIT = 30 # How many users to show on the leaderboard
 HEART_REFILL_COST_GEMS = 50
 LESSON_GEM_REWARD = 1       # Gems awarded per lesson completion
 LEVEL_UP_GEM_REWARD = 50  
-ALL_ACHIEVEMENTS = {
-    # Key: Unique Identifier
-    # Value: Dictionary with achievement details
-    'STREAK_3': {
-        'name': 'On Fire!', 'description': 'Maintain a 3-day streak.', 'icon': 'fas fa-fire',
-        'criteria_type': 'streak', 'criteria_value': 3,
-        'reward_gems': 10, 'reward_xp': 20
-    },
-    'STREAK_7': {
-        'name': 'Week Streak', 'description': 'Maintain a 7-day streak.', 'icon': 'fas fa-calendar-week',
-        'criteria_type': 'streak', 'criteria_value': 7,
-        'reward_gems': 25, 'reward_xp': 50
-    },
-    'LEVEL_5': {
-        'name': 'Level 5 Reached', 'description': 'Reach Level 5.', 'icon': 'fas fa-star',
-        'criteria_type': 'level', 'criteria_value': 5,
-        'reward_gems': 15, 'reward_xp': 30
-    },
-    'LESSONS_1': {
-        'name': 'First Steps', 'description': 'Complete your first lesson.', 'icon': 'fas fa-shoe-prints',
-        'criteria_type': 'lessons_total', 'criteria_value': 1,
-        'reward_gems': 5, 'reward_xp': 10
-    },
-    'LESSONS_10':{
-        'name': 'Getting Started', 'description': 'Complete 10 lessons (total).', 'icon': 'fas fa-seedling',
-        'criteria_type': 'lessons_total', 'criteria_value': 10,
-        'reward_gems': 20, 'reward_xp': 40
-    },
-    # Add more achievements:
-}
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "a_default_secret_key_for_dev") # Provide default for dev
 
-# Load lessons.json
-try:
-    with open("lessons.json", "r", encoding="utf-8") as file:
-        lessons_data = json.load(file)
-except (FileNotFoundError, json.JSONDecodeError) as e:
-    print(f"Error loading lessons.json: {e}")
-    lessons_data = {} # Default to empty if error
+# Load lessons.json (indexed and pre-serialized, see lesson_catalog.py)
+# The file is re-read when its mtime changes, on SIGHUP, or via /admin/reload_lessons;
+# a file that fails to parse/validate is reported and the current catalog is kept.
+LESSONS_FILE = os.getenv("LESSONS_FILE", "lessons.json") # Or a compiled lessons.bin (python lesson_catalog.py)
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "2")) # 0 disables mtime polling
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # Admin endpoints are disabled unless set
 
-# --- Database Setup ---
-DATABASE = "database.db"
+catalog_loader = CatalogLoader(LESSONS_FILE, poll_interval=CATALOG_POLL_SECONDS)
+catalog_loader.reload(force=True) # Empty catalog if this fails
+catalog_loader.install_signal_handler()
+
+def get_catalog():
+    """Returns the lesson catalog for the current request, pinned so a reload mid-request can't mix versions."""
+    if "catalog" not in g:
+        g.catalog = catalog_loader.catalog
+    return g.catalog
 
-# Make sure the database is initialized by running database.py first
-# Or include the init_db logic here if preferred.
+@app.before_request
+def start_catalog_watcher():
+    catalog_loader.ensure_watching() # Cheap pid check; starts the poller once per worker process
+
+# --- Database Setup ---
+DATABASE = os.getenv("DATABASE", "database.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
+# Schema check: one PRAGMA user_version read when current; pending migrations are applied first (see migrations.py)
+init_db(DATABASE)
+
+# Connections are opened once (WAL, tuned caches) and reused across requests
+db_pool = ConnectionPool(DATABASE, max_size=DB_POOL_SIZE, factory=TracedConnection)
+
+# --- User Row Cache ---
+# users rows memoized per request (g.user_rows) and cached across requests (see user_cache.py, get_user_data)
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "5"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+user_cache = UserCache(max_entries=USER_CACHE_MAX_ENTRIES, ttl_seconds=USER_CACHE_TTL_SECONDS)
+# Other workers' (and scripts') writes to users, logged by triggers; polled before cache lookups,
+# at most every USER_CHANGE_POLL_MS (how long another process's write may be served stale)
+USER_CHANGE_POLL_MS = int(os.getenv("USER_CHANGE_POLL_MS", "50"))
+user_changes = UserChangeFeed(DATABASE, user_cache, min_interval=USER_CHANGE_POLL_MS / 1000)
+
+def invalidate_user_rows(*emails):
+    """Drops cached rows of `emails`; every write to `users` calls this once it has committed."""
+    user_cache.invalidate(*emails)
+    memo = g.get("user_rows") if has_app_context() else None
+    if memo:
+        for email in emails:
+            memo.pop(email, None)
+
+# Optional write-behind for derived user state (daily reset, streak decay); see write_behind.py
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "250"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500")) # Flush early once this many users wait
+write_behind = WriteBehindQueue(db_pool, flush_interval=WRITE_BEHIND_FLUSH_MS / 1000,
+                                max_pending=WRITE_BEHIND_MAX_PENDING,
+                                on_flush=lambda emails: user_cache.invalidate(*emails)) if WRITE_BEHIND else None
+
+# --- Password Hashing ---
+# Runs in a bounded process pool (see password_hasher.py): a login spike can't starve other routes,
+# and once the queue is full sign-ins are answered with a fast 503 instead of waiting behind it
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt") # Werkzeug method[:cost], e.g. pbkdf2:sha256:1000000
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))) # 0 hashes inline
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 2
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE)
 
 # Database Connection Helper
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON") # Ensure foreign key constraints are enforced
-    return conn
-
-# Available languages (Consider deriving from lessons_data keys)
-AVAILABLE_LANGUAGES = list(set(k.split('-')[0] for k in lessons_data.keys())) or ["Spanish", "French", "German", "Japanese"] # Derive from keys or fallback
+    """Returns the connection for the current request, checking one out of the pool on first use."""
+    if "db" not in g:
+        g.db = db_pool.acquire()
+        g.db.query_stats = g.get("query_stats") # SQL counts/time go to this request's metrics
+    return g.db
+
+def return_db_connection():
+    """Hands the request's connection back to the pool early; a later get_db_connection() checks out another."""
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.query_stats = None
+        db_pool.release(conn)
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Hands the request's connection back to the pool (uncommitted work is rolled back)."""
+    return_db_connection()
+
+# --- Metrics ---
+# Per-endpoint latency histograms, status codes and SQL work, scraped from /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # Scrapers send "Authorization: Bearer <token>"; /metrics is disabled unless set
+request_metrics = RequestMetrics()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.query_stats = QueryStats()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        request_metrics.observe(request.endpoint or "unmatched", response.status_code,
+                                time.perf_counter() - started, g.get("query_stats"))
+    return response
+
+# --- Static Assets ---
+# Built by `python assets.py` (minified, fingerprinted, precompressed); see asset_url()
+ASSET_BUILD_DIR = os.path.join(app.static_folder, "dist")
+ASSET_MAX_AGE = 365 * 24 * 3600 # Fingerprinted names change with content, so they never need revalidation
+asset_manifest = AssetManifest.load(os.path.join(ASSET_BUILD_DIR, "manifest.json"))
+
+@app.template_global()
+def asset_url(filename):
+    """Like url_for('static', filename=...), but points at the fingerprinted build when there is one."""
+    fingerprinted = asset_manifest.fingerprinted(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('fingerprinted_asset', filename=fingerprinted)
+
+# Available languages come from the current catalog's keys (in file order); this is the fallback
+DEFAULT_LANGUAGES = ["Spanish", "French", "German", "Japanese"]
+
+def get_available_languages(catalog):
+    return catalog.languages or DEFAULT_LANGUAGES
 
 # --- Helper Functions ---
-def get_user_data(email):
-    """Fetches all relevant user data."""
-    conn = get_db_connection()
-    user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-    conn.close()
-    return user
-
-def update_hearts(user_email):
-    """Checks and updates regenerated hearts, returns current hearts and time left."""
-    conn = get_db_connection()
-    user = conn.execute("SELECT hearts, last_heart_time FROM users WHERE email = ?", (user_email,)).fetchone()
-
-    if not user:
-        conn.close()
-        return None, None # Indicate user not found
-
-    current_hearts = user["hearts"]
-    time_left_seconds = 0
-    updated_last_heart_time_str = user["last_heart_time"] # Keep original if no change
-
-    if current_hearts < MAX_HEARTS:
-        try:
-            # Ensure last_heart_time is parsed correctly, handle potential None or format issues
-            last_heart_time_str = user["last_heart_time"]
-            if last_heart_time_str:
-                 # Adjust parsing based on how TIMESTAMP DEFAULT CURRENT_TIMESTAMP stores it
-                 # It might be 'YYYY-MM-DD HH:MM:SS' or include fractions of seconds
-                 try:
-                      last_heart_time = datetime.strptime(last_heart_time_str.split('.')[0], "%Y-%m-%d %H:%M:%S")
-                 except ValueError:
-                      # Fallback or log error if format is unexpected
-                      print(f"Warning: Could not parse last_heart_time '{last_heart_time_str}' for user {user_email}. Using current time.")
-                      last_heart_time = datetime.now() # Or handle differently
-
-            else: # If null for some reason, treat as if regeneration starts now
-                 last_heart_time = datetime.now()
-                 updated_last_heart_time_str = last_heart_time.strftime("%Y-%m-%d %H:%M:%S")
-
-
-            now = datetime.now()
-            time_diff_seconds = (now - last_heart_time).total_seconds()
-
-            if time_diff_seconds >= HEART_REGEN_TIME_SECONDS:
-                hearts_to_regen = math.floor(time_diff_seconds / HEART_REGEN_TIME_SECONDS)
-                potential_new_hearts = current_hearts + hearts_to_regen
-                actual_new_hearts = min(potential_new_hearts, MAX_HEARTS)
-                gained_hearts = actual_new_hearts - current_hearts
-
-                if gained_hearts > 0:
-                    # Calculate the time when the *last* heart needed for regen was gained
-                    seconds_for_gained_hearts = gained_hearts * HEART_REGEN_TIME_SECONDS
-                    # Important: The new 'last_heart_time' should reflect the start of the timer for the *next* heart
-                    # If we gained multiple hearts, the timer starts from when the last one was gained.
-                    effective_last_regen_time = last_heart_time + timedelta(seconds=(hearts_to_regen * HEART_REGEN_TIME_SECONDS))
-
-                    # Ensure effective time is not in the future if calculation is slightly off
-                    effective_last_regen_time = min(effective_last_regen_time, now)
-
-                    updated_last_heart_time_str = effective_last_regen_time.strftime("%Y-%m-%d %H:%M:%S")
-
-                    conn.execute("UPDATE users SET hearts = ?, last_heart_time = ? WHERE email = ?",
-                                 (actual_new_hearts, updated_last_heart_time_str, user_email))
-                    conn.commit()
-                    current_hearts = actual_new_hearts
-                    print(f"User {user_email}: Regenerated {gained_hearts} hearts. New count: {current_hearts}. New last_heart_time: {updated_last_heart_time_str}")
-
-
-            # Calculate time left for the *next* heart after potential regeneration
-            if current_hearts < MAX_HEARTS:
-                 # Use the potentially updated last_heart_time
-                 last_time = datetime.strptime(updated_last_heart_time_str.split('.')[0], "%Y-%m-%d %H:%M:%S")
-                 time_since_last = (datetime.now() - last_time).total_seconds()
-                 time_left_seconds = max(0, math.ceil(HEART_REGEN_TIME_SECONDS - time_since_last))
-
-        except Exception as e:
-            print(f"Error during heart regeneration for {user_email}: {e}")
-            # Keep current_hearts and time_left_seconds as 0 in case of error
-
-    conn.close()
-    # print(f"User {user_email}: Hearts={current_hearts}, Time Left={time_left_seconds}s")
-    return current_hearts, int(time_left_seconds)
+def get_user_data(email, conn, fresh=False):
+    """
+    The user's row (None if there is none): from this request's memo, else the shared user cache,
+    else the database. fresh=True always reads the database (credential checks).
+    """
+    memo = g.setdefault("user_rows", {}) if has_app_context() else None # None outside a request (scripts)
+    if not fresh:
+        row = memo.get(email) if memo is not None else None
+        if row is None:
+            user_changes.poll() # Rate-limited; one PRAGMA read unless another connection committed since the last poll
+            row = user_cache.get(email)
+        if row is not None:
+            if memo is not None:
+                memo[email] = row
+            return row
+
+    token = user_cache.token()
+    row = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+    if row is not None and not conn.in_transaction: # Never cache what a write in progress may still change
+        user_cache.put(email, row, token)
+        if memo is not None:
+            memo[email] = row
+    return row
+
+def compute_hearts(hearts, heart_anchor, now_ts):
+    """
+    Hearts are stored as an anchor: `hearts` as of epoch second `heart_anchor`.
+    Returns (current_hearts, time_left_seconds) as of `now_ts`. Pure function, no DB access.
+    """
+    if hearts >= MAX_HEARTS:
+        return hearts, 0
 
+    elapsed = max(0, now_ts - (heart_anchor or 0)) # Unknown anchor: treat as fully regenerated
+    regenerated, into_next_heart = divmod(elapsed, HEART_REGEN_TIME_SECONDS)
+    current_hearts = min(MAX_HEARTS, hearts + regenerated)
+    if current_hearts >= MAX_HEARTS:
+        return MAX_HEARTS, 0
+    return current_hearts, HEART_REGEN_TIME_SECONDS - into_next_heart
 
-def check_daily_reset_and_streak(user_email):
-    """Handles daily progress reset and streak logic. Returns updated streak."""
-    conn = get_db_connection()
-    user = conn.execute(
-        "SELECT streak, last_streak_update, daily_progress, last_daily_reset FROM users WHERE email = ?",
-        (user_email,)
-    ).fetchone()
 
+def get_heart_state(user_email, conn):
+    """Returns (current hearts, time left) for one user, or (None, None) if not found. Never writes."""
+    user = get_user_data(user_email, conn) # Usually cached: /get_hearts is polled
     if not user:
-        conn.close()
-        return 0 # Or raise error
+        return None, None
+    return compute_hearts(user["hearts"], user["heart_anchor"], int(time.time()))
 
-    today = date.today()
-    current_streak = user["streak"]
-    updated_streak = current_streak # Assume no change initially
-    needs_update = False
+
+def daily_reset_and_streak_changes(user, today, user_email=None):
+    """
+    Pure daily goal reset / streak decay check (no DB access).
+    `user` needs streak, last_streak_update and last_daily_reset.
+    Returns a dict of column -> new value (empty if nothing changed).
+    """
+    changes = {}
 
     # --- Daily Goal Reset ---
     last_reset_str = user["last_daily_reset"]
@@ -183,42 +227,144 @@ def check_daily_reset_and_streak(user_email):
         try:
             last_reset_date = date.fromisoformat(last_reset_str)
         except ValueError:
-             print(f"Warning: Could not parse last_daily_reset date '{last_reset_str}' for user {user_email}.")
+             log_event("unparseable_date", logging.WARNING, user=user_email, column="last_daily_reset", value=last_reset_str)
 
     if last_reset_date is None or last_reset_date < today:
-        print(f"User {user_email}: Resetting daily progress for {today}.")
-        conn.execute("UPDATE users SET daily_progress = 0, last_daily_reset = ? WHERE email = ?",
-                     (today.isoformat(), user_email))
-        needs_update = True
+        log_event("daily_progress_reset", logging.DEBUG, user=user_email, day=today)
+        changes["daily_progress"] = 0
+        changes["last_daily_reset"] = today.isoformat()
 
-    # --- Streak Check (only if daily reset happened or first login of day) ---
+    # --- Streak Check ---
     last_streak_update_str = user["last_streak_update"]
     last_streak_date = None
     if last_streak_update_str:
          try:
              last_streak_date = date.fromisoformat(last_streak_update_str)
          except ValueError:
-             print(f"Warning: Could not parse last_streak_update date '{last_streak_update_str}' for user {user_email}.")
-
-
-    if last_streak_date is None:
-         # No previous activity, streak remains 0 until first completion
-         updated_streak = 0
-    elif last_streak_date < (today - timedelta(days=1)):
-         # Missed more than a day
-         if current_streak > 0:
-              print(f"User {user_email}: Streak reset from {current_streak} to 0.")
-              updated_streak = 0
-              # Update streak in DB immediately if it resets *before* activity
-              conn.execute("UPDATE users SET streak = 0 WHERE email = ?", (user_email,))
-              needs_update = True # Ensure commit happens
-    # else: streak is maintained (either updated yesterday or will be updated today by complete_lesson)
-
-    if needs_update:
+             log_event("unparseable_date", logging.WARNING, user=user_email, column="last_streak_update", value=last_streak_update_str)
+
+    # Missed more than a day: reset *before* activity
+    # (otherwise the streak is maintained, or will be updated today by a lesson completion)
+    if last_streak_date is not None and last_streak_date < (today - timedelta(days=1)) and user["streak"] > 0:
+        log_event("streak_reset", sampled=True, user=user_email, old_streak=user["streak"])
+        changes["streak"] = 0
+
+    return changes
+
+
+def derived_state_guards(user, changes):
+    """The columns `changes` were derived from, with the values they were derived from (see write_behind.py)."""
+    guards = {}
+    if "last_daily_reset" in changes:
+        guards["last_daily_reset"] = user["last_daily_reset"]
+    if "streak" in changes:
+        guards["last_streak_update"] = user["last_streak_update"]
+    return guards
+
+
+def save_derived_state(user_email, user, changes, conn):
+    """
+    Persists daily reset / streak decay changes: queued when write-behind is enabled (returns True),
+    otherwise as one UPDATE in the caller's transaction, left for the caller to commit (returns False).
+    """
+    if write_behind is not None:
+        write_behind.enqueue(user_email, changes, derived_state_guards(user, changes))
+        return True
+    assignments = ", ".join(f"{column} = ?" for column in changes)
+    conn.execute(f"UPDATE users SET {assignments} WHERE email = ?", (*changes.values(), user_email))
+    return False
+
+
+def check_daily_reset_and_streak(user_email, conn):
+    """Handles daily progress reset and streak logic. Returns updated streak."""
+    user = conn.execute(
+        "SELECT streak, last_streak_update, daily_progress, last_daily_reset FROM users WHERE email = ?",
+        (user_email,)
+    ).fetchone()
+
+    if not user:
+        return 0 # Or raise error
+
+    changes = daily_reset_and_streak_changes(user, date.today(), user_email)
+    if changes and not save_derived_state(user_email, user, changes, conn):
+        conn.commit()
+        invalidate_user_rows(user_email)
+
+    return changes.get("streak", user["streak"]) # Return the potentially reset streak
+
+
+def load_user_state(user_email, lang, conn):
+    """
+    Single-round-trip snapshot of a user's state for page/API routes.
+    Reads the user row (and completed lesson ids for `lang`, if given) in one transaction,
+    applies the daily reset and streak decay in Python, and writes back at most one
+    combined UPDATE - only when something actually changed. Hearts are computed on read.
+    Returns a dict (user, hearts, time_left, completed_lessons) or None if the user doesn't exist.
+    """
+    now = datetime.now()
+    if not conn.in_transaction:
+        conn.execute("BEGIN") # Both reads see the same snapshot
+    try:
+        user = conn.execute("SELECT * FROM users WHERE email = ?", (user_email,)).fetchone()
+        if not user:
+            conn.rollback()
+            return None
+
+        completed_lessons = []
+        if lang is not None:
+            completed_lessons = [row["lesson_id"] for row in conn.execute(
+                "SELECT lesson_id FROM progress WHERE user_email = ? AND language = ? AND completed = 1",
+                (user_email, lang)
+            )]
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+    changes = daily_reset_and_streak_changes(user, now.date(), user_email)
+    # Hearts are computed on read, never written back here
+    hearts, time_left_seconds = compute_hearts(user["hearts"], user["heart_anchor"], int(now.timestamp()))
+
+    try:
+        written = bool(changes) and not save_derived_state(user_email, user, changes, conn)
         conn.commit()
+        if written:
+            invalidate_user_rows(user_email)
+    except sqlite3.OperationalError as e:
+        # All derived state is a function of (row, now), so a failed write-back (e.g. a busy
+        # writer lock) is harmless: serve the computed values and let the next read persist them.
+        conn.rollback()
+        log_event("user_state_write_back_failed", logging.WARNING, user=user_email, error=e)
+
+    return {
+        "user": {**dict(user), **changes, "hearts": hearts},
+        "hearts": hearts,
+        "time_left": time_left_seconds,
+        "completed_lessons": completed_lessons,
+    }
+
+
+def lose_heart(conn, user_email):
+    """Takes one heart (if any are left) and commits. Returns (hearts, time_left), or None if the user doesn't exist."""
+    now_ts = int(time.time())
+    conn.execute("BEGIN IMMEDIATE") # Take the write lock before reading so concurrent losses don't overwrite each other
+    user = conn.execute("SELECT hearts, heart_anchor FROM users WHERE email = ?", (user_email,)).fetchone()
+
+    if not user:
+        conn.rollback()
+        return None
+
+    new_hearts, time_left = compute_hearts(user["hearts"], user["heart_anchor"], now_ts)
 
-    conn.close()
-    return updated_streak # Return the potentially reset streak
+    if new_hearts > 0:
+        new_hearts -= 1
+        # Re-anchor at the new count; losing a heart restarts the regeneration timer
+        conn.execute("UPDATE users SET hearts = ?, heart_anchor = ? WHERE email = ?",
+                     (new_hearts, now_ts, user_email))
+        log_event("heart_lost", sampled=True, user=user_email, hearts=new_hearts)
+        time_left = compute_hearts(new_hearts, now_ts, now_ts)[1]
+    conn.commit()
+    invalidate_user_rows(user_email)
+    return new_hearts, time_left
 
 
 def calculate_level_xp(current_xp):
@@ -265,67 +411,101 @@ def get_profile_color(text):
     b = min(200, max(50, b))
     return f"#{r:02x}{g:02x}{b:02x}"
 
-def check_and_award_achievements(user_email, conn):
+# --- Leaderboard ---
+# Ranking kept in memory (see leaderboard.py); routes that change XP or names update it after commit.
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "60")) # Catch up with other workers' XP this often
+LEADERBOARD_REBUILD_SECONDS = float(os.getenv("LEADERBOARD_REBUILD_SECONDS", "3600")) # Full rebuild (their renames/deletions) this often
+leaderboard_service = Leaderboard(get_profile_color, db_pool, refresh_seconds=LEADERBOARD_REFRESH_SECONDS,
+                                  rebuild_seconds=LEADERBOARD_REBUILD_SECONDS)
+
+@app.before_request
+def start_leaderboard_refresher():
+    leaderboard_service.ensure_refreshing() # Cheap pid check; the first build runs in the background
+
+# --- Fragment Cache ---
+# Viewer-independent HTML (leaderboard rows, landing page) rendered once and shared; see fragment_cache.py
+FRAGMENT_CACHE_TTL_SECONDS = float(os.getenv("FRAGMENT_CACHE_TTL_SECONDS", "10")) # Also bounds staleness from other workers' writes
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv("FRAGMENT_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+LANDING_PAGE_TTL_SECONDS = 300 # Only changes on deploy
+fragment_cache = FragmentCache(max_bytes=FRAGMENT_CACHE_MAX_BYTES, ttl_seconds=FRAGMENT_CACHE_TTL_SECONDS)
+
+def fetch_leaderboard_entries(conn, period):
+    """The top LEADERBOARD_LIMIT entries of a leaderboard ('all' or a window from PERIODS), ready for row_cells."""
+    if period == "all":
+        # Served from the in-memory ranking (RANK() tie semantics), or by SQL until it is first built
+        if leaderboard_service.ready:
+            entries = leaderboard_service.top(LEADERBOARD_LIMIT)
+        else:
+            entries = top_from_sql(conn, LEADERBOARD_LIMIT)
+            for user_dict in entries:
+                display_name = user_dict['fullname'] or user_dict['email']
+                user_dict['profile_color'] = get_profile_color(display_name)
+                user_dict['initial'] = (display_name[0] if display_name else '?').upper()
+    else:
+        # Indexed top-N read of the incrementally maintained period totals
+        entries = windowed_leaderboard(conn, period, LEADERBOARD_LIMIT)
+        for user_dict in entries:
+            display_name = user_dict['fullname'] or user_dict['email']
+            user_dict['profile_color'] = get_profile_color(display_name)
+            user_dict['initial'] = (display_name[0] if display_name else '?').upper()
+    return entries
+
+def render_leaderboard_rows(entries):
     """
-    Checks user stats against defined achievements and awards if necessary.
+    Leaderboard entries as (email, rendered cells) pairs, without the viewer's highlight, plus
+    the lowest XP shown when the list is full (0 otherwise).
+    """
+    row_cells = get_template_attribute("leaderboard_rows.html", "row_cells")
+    return {
+        "rows": tuple((entry['email'], row_cells(entry)) for entry in entries),
+        "cutoff_xp": entries[-1]['xp'] if len(entries) >= LEADERBOARD_LIMIT else 0,
+    }
+
+def invalidate_leaderboard_fragments(email=None):
+    """
+    After a committed XP change for `email`, drops the cached leaderboards it could now appear in;
+    with no email (renames, deletions) drops them all.
+    """
+    entry = leaderboard_service.around(email, radius=0) if email else None
+    if not entry:
+        fragment_cache.invalidate("leaderboard")
+        return
+    rank, xp = entry[0]['rank'], entry[0]['xp']
+    # Period XP never exceeds total XP, so a user below a period's cutoff in total can't be on it
+    fragment_cache.invalidate(
+        "leaderboard",
+        lambda key, cached: rank <= LEADERBOARD_LIMIT if key[1] == "all" else xp >= cached["cutoff_xp"]
+    )
+
+# Definitions indexed by criteria type and sorted by threshold (see achievements.py)
+achievement_engine = AchievementEngine(ALL_ACHIEVEMENTS)
+
+def check_and_award_achievements(user_email, conn, events, current_xp):
+    """
+    Awards achievements for counters that changed in the caller's transaction.
+    `events` is a list of (criteria_type, old_value, new_value, criteria_extra) tuples
+    built from values the caller already has, e.g. ('streak', 2, 3, None) or
+    ('lessons_language', 4, 5, 'Spanish'). Only thresholds crossed by an event are
+    looked at. `current_xp` is the user's XP after the caller's update; reward XP
+    that causes a level up is fed back in as a 'level' event.
     Requires an active database connection `conn` to be passed in for transaction control.
     Returns a list of newly earned achievement details (dictionaries).
     """
     newly_earned = []
     try:
         cursor = conn.cursor() # Use cursor from the passed connection
+        pending_events = list(events)
 
-        # Get current user stats needed for checks
-        user = cursor.execute("SELECT streak, xp, email FROM users WHERE email = ?", (user_email,)).fetchone()
-        if not user:
-             print(f"ERROR: User {user_email} not found during achievement check.")
-             return [] # Return empty if user not found
-
-        current_level, _, _ = calculate_level_xp(user['xp'])
-
-        # Get total lessons completed (across all languages)
-        total_lessons = cursor.execute(
-            "SELECT COUNT(DISTINCT lesson_id || '-' || language) as count FROM progress WHERE user_email = ? AND completed = 1", (user_email,)
-        ).fetchone()['count'] or 0
-
-        # Get achievements already earned by the user
-        earned_keys = {row['achievement_key'] for row in cursor.execute(
-            "SELECT achievement_key FROM user_achievements WHERE user_email = ?", (user_email,)
-        ).fetchall()}
-
-        # Iterate through defined achievements
-        for key, achievement in ALL_ACHIEVEMENTS.items():
-            if key in earned_keys: continue # Skip if already earned
-
-            criteria_met = False
-            crit_type = achievement['criteria_type']
-            crit_val = achievement['criteria_value']
-            crit_extra = achievement.get('criteria_extra') # For language-specific criteria
-
-            # --- Check Criteria ---
-            if crit_type == 'streak' and user['streak'] >= crit_val:
-                criteria_met = True
-            elif crit_type == 'level' and current_level >= crit_val:
-                criteria_met = True
-            elif crit_type == 'lessons_total' and total_lessons >= crit_val:
-                 criteria_met = True
-            elif crit_type == 'lessons_language' and crit_extra:
-                 # Need to query lessons completed for a specific language
-                 lang_lessons = cursor.execute(
-                     "SELECT COUNT(*) as count FROM progress WHERE user_email = ? AND language = ? AND completed = 1",
-                     (user_email, crit_extra)
-                 ).fetchone()['count'] or 0
-                 if lang_lessons >= crit_val:
-                      criteria_met = True
-            # Add more elif blocks for other criteria_type values ('perfect_lesson', etc.)
-
-            # --- Award if criteria met ---
-            if criteria_met:
-                print(f"User {user_email} potentially earned achievement: {key}")
+        while pending_events:
+            criteria_type, old_value, new_value, criteria_extra = pending_events.pop(0)
+
+            for key, achievement in achievement_engine.crossed(criteria_type, old_value, new_value, criteria_extra):
                 try:
-                    # Insert into user_achievements
-                    cursor.execute("INSERT INTO user_achievements (user_email, achievement_key) VALUES (?, ?)",
+                    # OR IGNORE: a counter can cross a threshold again (e.g. a streak rebuilt after a reset)
+                    cursor.execute("INSERT OR IGNORE INTO user_achievements (user_email, achievement_key) VALUES (?, ?)",
                                  (user_email, key))
+                    if cursor.rowcount == 0:
+                        continue # Already earned earlier
 
                     # Award rewards (if any)
                     reward_xp = achievement.get('reward_xp', 0)
@@ -333,30 +513,31 @@ def check_and_award_achievements(user_email, conn):
                     if reward_xp > 0 or reward_gems > 0:
                         cursor.execute("UPDATE users SET xp = xp + ?, gems = gems + ? WHERE email = ?",
                                      (reward_xp, reward_gems, user_email))
-                        print(f"Awarded: {reward_xp} XP, {reward_gems} Gems for {key}")
+                        record_xp_event(cursor, user_email, reward_xp, f"achievement:{key}")
+                        log_event("achievement_awarded", user=user_email, achievement=key, xp=reward_xp, gems=reward_gems)
+
+                        old_level, _, _ = calculate_level_xp(current_xp)
+                        current_xp += reward_xp
+                        new_level, _, _ = calculate_level_xp(current_xp)
+                        if new_level > old_level:
+                            pending_events.append(('level', old_level, new_level, None))
 
                     # Use **achievement to create a copy and add key if needed
                     earned_detail = {**achievement, 'achievement_key': key}
                     newly_earned.append(earned_detail)
-                    # Add to earned_keys immediately to prevent duplicate checks within this call
-                    earned_keys.add(key)
 
-                except sqlite3.IntegrityError:
-                     # This can happen in rare race conditions or if logic has error. Ignore.
-                     print(f"Info: User {user_email} likely already earned {key} (IntegrityError). Skipping.")
                 except sqlite3.Error as award_err:
-                     print(f"DATABASE ERROR awarding achievement {key} for {user_email}: {award_err}")
+                     log_event("achievement_award_failed", logging.ERROR, user=user_email, achievement=key, error=award_err)
                      # Should we rollback everything? For now, just log and continue checking others.
-                     # conn.rollback() # Careful with rollback inside loop if called from other transactions
 
-        # No commit here - commit is handled by the calling function (e.g., complete_lesson_api)
+        # No commit here - commit is handled by the calling function (e.g., submit_lesson_attempt)
         return newly_earned
 
     except sqlite3.Error as check_err:
-        print(f"DATABASE ERROR checking achievements for {user_email}: {check_err}")
+        log_event("achievement_check_failed", logging.ERROR, user=user_email, error=check_err)
         return [] # Return empty on error
     except Exception as e:
-         print(f"UNEXPECTED ERROR checking achievements for {user_email}: {e}")
+         log_event("achievement_check_failed", logging.ERROR, exc_info=True, user=user_email, error=e)
          return []
 
 
@@ -366,7 +547,8 @@ def check_and_award_achievements(user_email, conn):
 def home():
     if "user" in session:
         return redirect(url_for('dashboard')) # Redirect logged-in users to dashboard
-    return render_template("index.html")
+    return fragment_cache.get_or_render(("page", "index"), lambda: render_template("index.html"),
+                                        ttl_seconds=LANDING_PAGE_TTL_SECONDS)
 
 # Signup Route
 # app.py
@@ -389,7 +571,7 @@ def signup():
             flash("All fields are required!", "danger")
             return render_template("login.html", is_signup=True)
 
-        hashed_password = generate_password_hash(password)
+        hashed_password = password_hasher.hash(password)
         today_iso = date.today().isoformat() # Format as YYYY-MM-DD
 
         try:
@@ -397,12 +579,13 @@ def signup():
             # *** ADD join_date to INSERT statement and VALUES ***
             conn.execute(
                 """INSERT INTO users
-                   (fullname, email, password, last_streak_update, last_daily_reset, join_date)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (fullname, email, hashed_password, today_iso, today_iso, today_iso) # Pass today_iso for join_date
+                   (fullname, email, password, last_streak_update, last_daily_reset, join_date, heart_anchor)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (fullname, email, hashed_password, today_iso, today_iso, today_iso, int(time.time())) # Pass today_iso for join_date
             )
             conn.commit()
-            conn.close()
+            leaderboard_service.add_xp(email, fullname, 0)
+            invalidate_leaderboard_fragments(email)
 
             session['user'] = email
             flash("Account created successfully! Welcome! 🎉", "success")
@@ -432,11 +615,15 @@ def login():
              # --- Pass is_signup=False when re-rendering ---
              return render_template("login.html", is_signup=False)
 
-        user = get_user_data(email)
+        user = get_user_data(email, get_db_connection(), fresh=True)
+        return_db_connection() # Don't hold a pooled connection while waiting for the hasher
 
-        if user and check_password_hash(user["password"], password):
+        if user and password_hasher.verify(user["password"], password):
             session['user'] = user["email"]
-            check_daily_reset_and_streak(user["email"])
+            conn = get_db_connection()
+            if password_hasher.needs_rehash(user["password"]):
+                rehash_password(user["email"], user["password"], password, conn)
+            check_daily_reset_and_streak(user["email"], conn)
             flash("Login successful! Welcome back! ✅", "success")
             return redirect(url_for('dashboard'))
         else:
@@ -447,6 +634,35 @@ def login():
     # --- Handle GET request for /login ---
     return render_template("login.html", is_signup=False) # Pass flag to show login form
 
+def rehash_password(user_email, old_hash, password, conn):
+    """
+    Re-hashes a just-verified password whose stored hash uses an outdated method or cost.
+    Skipped while the hasher is busy (the next login tries again); a password change that
+    landed in the meantime is never overwritten. Commits.
+    """
+    try:
+        new_hash = password_hasher.hash(password)
+    except HasherBusy:
+        return False
+    updated = conn.execute("UPDATE users SET password = ? WHERE email = ? AND password = ?",
+                           (new_hash, user_email, old_hash)).rowcount
+    conn.commit()
+    invalidate_user_rows(user_email)
+    if updated:
+        log_event("password_rehashed", user=user_email, old_method=old_hash.split("$", 1)[0], method=password_hasher.method)
+    return bool(updated)
+
+@app.errorhandler(HasherBusy)
+def password_hashing_busy(error):
+    """The password hashing queue is full: answer right away rather than queue behind a sign-in spike."""
+    log_event("password_hashing_busy", logging.WARNING, endpoint=request.endpoint, error=error)
+    flash("We're handling a lot of sign-ins right now. Please try again in a moment.", "warning")
+    if request.endpoint not in ("signup", "login"):
+        return redirect(url_for('settings')) # Password change / account deletion
+    response = app.make_response((render_template("login.html", is_signup=request.endpoint == "signup"), 503))
+    response.headers["Retry-After"] = str(PASSWORD_HASH_RETRY_AFTER_SECONDS)
+    return response
+
 @app.route('/logout')
 def logout():
     session.pop('user', None)
@@ -461,7 +677,7 @@ def get_hearts_api(): # Renamed to avoid conflict if needed
         return jsonify({"error": "Not logged in"}), 401 # Use 401 Unauthorized
 
     user_email = session["user"]
-    hearts, time_left = update_hearts(user_email) # Use the helper
+    hearts, time_left = get_heart_state(user_email, get_db_connection()) # Pure read, no write lock
 
     if hearts is None:
          return jsonify({"error": "User not found"}), 404
@@ -474,28 +690,11 @@ def lose_heart_api(): # Renamed
         return jsonify({"error": "Not logged in"}), 401
 
     user_email = session["user"]
-    conn = get_db_connection()
-    user = conn.execute("SELECT hearts FROM users WHERE email = ?", (user_email,)).fetchone()
-
-    if not user:
-        conn.close()
+    state = lose_heart(get_db_connection(), user_email)
+    if state is None:
         return jsonify({"error": "User not found"}), 404
 
-    current_hearts = user["hearts"]
-    new_hearts = current_hearts
-
-    if current_hearts > 0:
-        new_hearts = current_hearts - 1
-        # Update last_heart_time when a heart is lost to reset the timer correctly
-        conn.execute("UPDATE users SET hearts = ?, last_heart_time = ? WHERE email = ?",
-                     (new_hearts, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user_email))
-        conn.commit()
-        print(f"User {user_email}: Lost a heart. New count: {new_hearts}")
-
-
-    conn.close()
-    # Fetch time_left after losing heart
-    _, time_left = update_hearts(user_email)
+    new_hearts, time_left = state
     return jsonify({"hearts": new_hearts, "time_left": time_left}) # Return time_left too
 
 @app.route('/shop/buy_hearts', methods=['POST'])
@@ -510,202 +709,341 @@ def buy_hearts():
     try:
         # Use cursor for transaction control
         cursor = conn.cursor()
-        user = cursor.execute("SELECT hearts, gems FROM users WHERE email = ?", (user_email,)).fetchone()
+        now_ts = int(time.time())
+        cursor.execute("BEGIN IMMEDIATE") # Gems are spent: read and write under the same lock
+        user = cursor.execute("SELECT hearts, heart_anchor, gems FROM users WHERE email = ?", (user_email,)).fetchone()
 
         if not user:
+            conn.rollback()
             return jsonify({"error": "User not found", "success": False}), 404
 
-        current_hearts = user['hearts']
+        current_hearts, _ = compute_hearts(user['hearts'], user['heart_anchor'], now_ts)
         current_gems = user['gems']
 
         if current_hearts >= MAX_HEARTS:
+            conn.rollback()
             return jsonify({"error": "Your hearts are already full!", "success": False, "code": "HEARTS_FULL"}), 400
 
         if current_gems < HEART_REFILL_COST_GEMS:
+            conn.rollback()
             return jsonify({"error": f"Not enough gems! You need {HEART_REFILL_COST_GEMS}.", "success": False, "code": "INSUFFICIENT_GEMS"}), 400
 
         # --- Perform Purchase ---
         new_gems = current_gems - HEART_REFILL_COST_GEMS
         new_hearts = MAX_HEARTS
 
-        cursor.execute("UPDATE users SET gems = ?, hearts = ? WHERE email = ?",
-                     (new_gems, new_hearts, user_email))
+        cursor.execute("UPDATE users SET gems = ?, hearts = ?, heart_anchor = ? WHERE email = ?",
+                     (new_gems, new_hearts, now_ts, user_email))
         conn.commit() # Commit the purchase
+        invalidate_user_rows(user_email)
 
-        print(f"User {user_email}: Bought hearts refill. Gems: {current_gems} -> {new_gems}, Hearts: {current_hearts} -> {new_hearts}")
-
-        # Fetch updated time_left (will be 0 now)
-        _, time_left = update_hearts(user_email)
+        log_event("hearts_bought", user=user_email, gems_before=current_gems, gems_after=new_gems, hearts_before=current_hearts)
 
         return jsonify({
             "success": True,
             "message": "Hearts refilled successfully!",
             "new_gems": new_gems,
             "new_hearts": new_hearts,
-            "time_left": time_left
+            "time_left": 0 # Hearts are full, nothing regenerating
         })
 
     except sqlite3.Error as e:
-        print(f"DATABASE ERROR during buy_hearts for {user_email}: {e}")
+        log_event("buy_hearts_failed", logging.ERROR, user=user_email, error=e)
         conn.rollback()
         return jsonify({"error": "Database error during purchase.", "success": False}), 500
-    finally:
-        if conn: conn.close()
 
-# app.py
+def apply_lesson_completion(conn, user_email, lang, lesson_id, lesson_xp, user_stats):
+    """
+    Marks a lesson completed and applies its XP, daily progress, streak, gems and achievements
+    in the caller's transaction (nothing is committed here). `user_stats` is the user's row as
+    read in that transaction (xp, daily_progress, last_daily_reset, streak, last_streak_update).
+    Returns a dict with first_completion, new_xp, new_streak, gems_added and new_achievements.
+    """
+    lesson_gems = LESSON_GEM_REWARD
+    cursor = conn.cursor()
 
-# ... (keep all other imports, constants, functions like get_db_connection, etc.) ...
+    # Re-completions are allowed; only a first completion moves the lesson counters
+    cursor.execute("INSERT OR IGNORE INTO progress (user_email, lesson_id, language, completed) VALUES (?, ?, ?, 1)",
+                   (user_email, lesson_id, lang))
+    first_completion = cursor.rowcount == 1
+    if not first_completion:
+        cursor.execute("UPDATE progress SET completed = 1 WHERE user_email = ? AND lesson_id = ? AND language = ? AND completed = 0",
+                       (user_email, lesson_id, lang))
+        first_completion = cursor.rowcount == 1
+
+    # --- Streak Logic ---
+    old_level, _, _ = calculate_level_xp(user_stats["xp"]) # Calculate level *before* adding XP
+    new_xp = user_stats["xp"] + lesson_xp
+    current_streak = user_stats["streak"] # Streak value *before* this lesson's update
+    updated_streak = current_streak # Default: assume no change initially
+
+    today = date.today()
+    today_iso = today.isoformat()
+    # Today's daily reset may not be written yet (it can be queued, see write_behind.py): apply it here too
+    daily_progress = user_stats["daily_progress"]
+    if not user_stats["last_daily_reset"] or user_stats["last_daily_reset"] < today_iso:
+        daily_progress = 0
+    new_daily_progress = daily_progress + lesson_xp
+    last_streak_update_str = user_stats["last_streak_update"]
+    last_streak_date = None
+
+    if last_streak_update_str: # Check if the string exists and is not empty
+        try:
+            # Attempt to parse the date string (assuming YYYY-MM-DD)
+            last_streak_date = date.fromisoformat(last_streak_update_str)
+        except (ValueError, TypeError) as e: # Catch potential errors during parsing
+            log_event("unparseable_date", logging.WARNING, user=user_email, column="last_streak_update", value=last_streak_update_str)
+            last_streak_date = None # Ensure it's None if parsing fails
+
+    # --- Refined Streak Logic ---
+    if last_streak_date == today:
+        # Activity already happened today.
+        # If streak is 0, it means it was reset *today* before this activity,
+        # so this is the *first* successful activity today, start streak at 1.
+        # Otherwise, maintain the current streak.
+        if current_streak == 0:
+            streak_rule = "first_today"
+            updated_streak = 1
+        else:
+            streak_rule = "already_active_today"
+            updated_streak = current_streak # No change needed
+    elif last_streak_date == (today - timedelta(days=1)):
+        # Activity occurred yesterday, increment streak.
+        streak_rule = "continued_from_yesterday"
+        updated_streak = current_streak + 1
+    else:
+        # Covers several cases:
+        # 1. last_streak_date is None (first ever activity, or DB error).
+        # 2. last_streak_date is older than yesterday (missed one or more days).
+        # In both cases, the streak starts/restarts at 1.
+        streak_rule = "restarted"
+        updated_streak = 1
+
+    log_event("streak_check", logging.DEBUG, user=user_email, lesson=lesson_id, lang=lang, today=today,
+              last_update=last_streak_date, rule=streak_rule, old_streak=current_streak, new_streak=updated_streak)
+
+
+    # --- Check for Level Up AFTER calculating new XP ---
+    new_level, _, _ = calculate_level_xp(new_xp)
+    gems_from_level_up = 0
+    if new_level > old_level:
+        gems_from_level_up = 50 # Award 50 gems for leveling up (example)
+        log_event("level_up", user=user_email, old_level=old_level, new_level=new_level, gems=gems_from_level_up)
+
+    # --- Total Gems to Add ---
+    total_gems_to_add = lesson_gems + gems_from_level_up
+
+    # --- Execute the Database Update ---
+    # Always update last_streak_update to today's date when activity occurs
+    cursor.execute(
+        """UPDATE users
+           SET xp = xp + ?, daily_progress = ?, last_daily_reset = ?, streak = ?, last_streak_update = ?, gems = gems + ?
+           WHERE email = ?""",
+        (lesson_xp, new_daily_progress, today_iso, updated_streak, today_iso, total_gems_to_add, user_email)
+    )
+    record_xp_event(cursor, user_email, lesson_xp, f"lesson:{lang}:{lesson_id}") # Same transaction as the XP update
+
+    # --- Check for Achievements AFTER stats are updated ---
+    # Only the counters this completion moved are evaluated
+    achievement_events = [
+        ('streak', current_streak, updated_streak, None),
+        ('level', old_level, new_level, None),
+    ]
+    if first_completion:
+        # Denormalized counters, bumped in this transaction (see user_stats.py)
+        total_lessons, language_lessons = increment_lesson_counts(cursor, user_email, lang)
+        achievement_events.append(('lessons_total', total_lessons - 1, total_lessons, None))
+        achievement_events.append(('lessons_language', language_lessons - 1, language_lessons, lang))
+    newly_earned_achievements = check_and_award_achievements(user_email, conn, achievement_events, new_xp)
+
+    return {
+        "first_completion": first_completion,
+        "new_xp": new_xp,
+        "new_streak": updated_streak,
+        "gems_added": total_gems_to_add,
+        "new_achievements": newly_earned_achievements,
+    }
+
+# --- Answer Grading ---
+# Answers are checked against the catalog's compiled matchers (see grading.py)
+MAX_GRADED_ANSWERS = 200 # Per request; a lesson attempt with retries stays well under this
 
-@app.route('/complete_lesson/<int:lesson_id>', methods=['POST'])
-def complete_lesson_api(lesson_id):
+@app.route('/lesson/<int:lesson_id>/grade', methods=['POST'])
+def grade_lesson_answers(lesson_id):
+    """
+    Grades a batch of answers for one lesson: {"answers": [{"question": <index>, "answer": ...}, ...]},
+    where a matching question's answer is an object of left -> right items. The lesson page checks
+    every answer here (it has no answers of its own), so each result carries the expected answer.
+    """
     if "user" not in session:
         return jsonify({"error": "User not logged in"}), 401
 
-    user_email = session["user"]
     lang = request.args.get("lang", "Spanish")
+    grader = get_catalog().lesson_grader(lang, lesson_id)
+    if grader is None:
+        return jsonify({"error": "Lesson details not found"}), 404
+
+    payload = request.get_json(silent=True) or {}
+    answers = payload.get("answers") if isinstance(payload, dict) else None
+    if not isinstance(answers, list) or len(answers) > MAX_GRADED_ANSWERS:
+        return jsonify({"error": f"Expected an 'answers' list of at most {MAX_GRADED_ANSWERS} items"}), 400
+
+    results = grader.grade_attempt(answers)
+    for result in results:
+        if "error" not in result:
+            result["expected"] = grader.expected(result["question"])
+    return jsonify({
+        "results": results,
+        "correct": sum(1 for result in results if result["correct"]),
+        "total": len(results),
+    })
+
+# --- Lesson Attempts ---
+# A whole attempt (every answer, including review rounds) is submitted once at the end and applied
+# in one transaction: heart loss, completion, XP, gems, streak and achievements. The client's
+# attempt_id is an idempotency key: a retried submission gets the stored response back instead of
+# being applied twice.
+ATTEMPT_ID_MAX_LENGTH = 64
+ATTEMPT_RETENTION_SECONDS = 7 * 24 * 3600 # Stored responses older than this are pruned (per user, on their next attempt)
+
+def score_attempt(grader, answers, hearts):
+    """
+    Replays an attempt against the user's hearts: each wrong answer costs a heart, and answers
+    given after the hearts ran out don't count. The lesson is completed when every question's
+    last counted answer is correct. Returns (results, hearts_lost, completed).
+    """
+    results = grader.grade_attempt(answers)
+    counted = []
+    hearts_lost = 0
+    for result in results:
+        if hearts - hearts_lost <= 0:
+            break
+        counted.append(result)
+        if not result["correct"]:
+            hearts_lost += 1
+    last_result = {result["question"]: result["correct"] for result in counted if "error" not in result}
+    completed = len(last_result) == len(grader) and all(last_result.values())
+    return results, hearts_lost, completed
+
+@app.route('/lesson/<int:lesson_id>/attempt', methods=['POST'])
+def submit_lesson_attempt(lesson_id):
+    """
+    Body: {"attempt_id": "<client-generated id>", "answers": [{"question": <index>, "answer": ...}, ...],
+           "mistakes": <client-side count, optional>, "duration_ms": <optional>}
+    Answers are graded here (see grading.py); a client-reported mistake count can only add heart loss.
+    Returns the updated hearts, XP, gems, streak, level, completed lessons and new achievements.
+    """
+    if "user" not in session:
+        return jsonify({"error": "User not logged in"}), 401
 
-    lang_key = f"{lang}-English"
-    if lang_key not in lessons_data:
-         return jsonify({"error": f"Invalid language specified: {lang}"}), 400
-
-    lesson_info = next((l for l in lessons_data[lang_key] if l.get("lesson") == lesson_id), None)
-    if not lesson_info:
-         return jsonify({"error": "Lesson details not found"}), 404
-
-    lesson_xp = lesson_info.get("xp", 10)
-    lesson_gems = 1 # Award 1 gem per lesson
+    user_email = session["user"]
+    lang = request.args.get("lang", "Spanish")
+    catalog = get_catalog()
+    grader = catalog.lesson_grader(lang, lesson_id)
+    if grader is None:
+        return jsonify({"error": "Lesson details not found"}), 404
+
+    payload = request.get_json(silent=True)
+    payload = payload if isinstance(payload, dict) else {}
+    attempt_id = payload.get("attempt_id")
+    answers = payload.get("answers")
+    mistakes = payload.get("mistakes", 0)
+    duration_ms = payload.get("duration_ms")
+    if not isinstance(attempt_id, str) or not 0 < len(attempt_id) <= ATTEMPT_ID_MAX_LENGTH:
+        return jsonify({"error": f"'attempt_id' must be a string of 1-{ATTEMPT_ID_MAX_LENGTH} characters"}), 400
+    if not isinstance(answers, list) or len(answers) > MAX_GRADED_ANSWERS:
+        return jsonify({"error": f"Expected an 'answers' list of at most {MAX_GRADED_ANSWERS} items"}), 400
+    if not isinstance(mistakes, int) or isinstance(mistakes, bool) or mistakes < 0:
+        mistakes = 0
+    if not isinstance(duration_ms, int) or isinstance(duration_ms, bool) or duration_ms < 0:
+        duration_ms = None
 
     conn = get_db_connection()
+    now_ts = int(time.time())
     try:
         cursor = conn.cursor()
-
-        # --- Mark lesson as completed FIRST ---
-        # Use INSERT OR REPLACE to handle potential re-completion attempts safely
-        cursor.execute("INSERT OR REPLACE INTO progress (user_email, lesson_id, language, completed) VALUES (?, ?, ?, 1)",
-                       (user_email, lesson_id, lang))
-        print(f"User {user_email}: Marked lesson {lesson_id} ({lang}) as completed in progress table.")
-
-        # --- Get Current User Stats for Update ---
-        user_stats = cursor.execute(
-            "SELECT xp, daily_progress, daily_goal, streak, last_streak_update FROM users WHERE email = ?",
+        cursor.execute("BEGIN IMMEDIATE") # Serializes retries of the same attempt, and the read-modify-write below
+        stored = cursor.execute("SELECT response FROM lesson_attempts WHERE user_email = ? AND attempt_id = ?",
+                                (user_email, attempt_id)).fetchone()
+        if stored:
+            conn.rollback()
+            log_event("lesson_attempt_replayed", user=user_email, lesson=lesson_id, lang=lang, attempt=attempt_id)
+            return app.response_class(stored["response"], mimetype="application/json")
+
+        user = cursor.execute(
+            """SELECT xp, gems, hearts, heart_anchor, daily_progress, daily_goal, last_daily_reset, streak, last_streak_update
+               FROM users WHERE email = ?""",
             (user_email,)
         ).fetchone()
-
-        if not user_stats:
-             print(f"CRITICAL ERROR: User {user_email} not found in users table during lesson completion update.")
-             conn.rollback() # Rollback lesson completion mark
-             return jsonify({"error": "User data not found during update"}), 500
-
-        # --- START DETAILED STREAK DEBUG & REFINED LOGIC ---
-        print(f"\n--- Streak Check Start (User: {user_email}, Lesson: {lesson_id}, Lang: {lang}) ---")
-        print(f"DB Values Read -> Streak: {user_stats['streak']}, Last Update STR: '{user_stats['last_streak_update']}'") # Added quotes for clarity
-
-        old_level, _, _ = calculate_level_xp(user_stats["xp"]) # Calculate level *before* adding XP
-        new_xp = user_stats["xp"] + lesson_xp
-        new_daily_progress = user_stats["daily_progress"] + lesson_xp
-        current_streak = user_stats["streak"] # Streak value *before* this lesson's update
-        updated_streak = current_streak # Default: assume no change initially
-
-        today = date.today()
-        last_streak_update_str = user_stats["last_streak_update"]
-        last_streak_date = None
-
-        if last_streak_update_str: # Check if the string exists and is not empty
-            try:
-                # Attempt to parse the date string (assuming YYYY-MM-DD)
-                last_streak_date = date.fromisoformat(last_streak_update_str)
-            except (ValueError, TypeError) as e: # Catch potential errors during parsing
-                print(f"WARNING: Could not parse last_streak_update date '{last_streak_update_str}' for user {user_email}. Error: {e}")
-                last_streak_date = None # Ensure it's None if parsing fails
-        else:
-             print(f"DB Info -> last_streak_update was NULL or empty.")
-
-        print(f"Parsed/Compared -> Today: {today}, Last Update DATE: {last_streak_date}")
-
-        # --- Refined Streak Logic ---
-        if last_streak_date == today:
-            # Activity already happened today.
-            # If streak is 0, it means it was reset *today* before this activity,
-            # so this is the *first* successful activity today, start streak at 1.
-            # Otherwise, maintain the current streak.
-            if current_streak == 0:
-                print("Condition: First activity today after reset/signup? Starting streak at 1.")
-                updated_streak = 1
-            else:
-                print("Condition: Already active today. Streak maintained.")
-                updated_streak = current_streak # No change needed
-        elif last_streak_date == (today - timedelta(days=1)):
-            # Activity occurred yesterday, increment streak.
-            print("Condition: Last update was yesterday. Incrementing streak.")
-            updated_streak = current_streak + 1
-        else:
-            # Covers several cases:
-            # 1. last_streak_date is None (first ever activity, or DB error).
-            # 2. last_streak_date is older than yesterday (missed one or more days).
-            # In both cases, the streak starts/restarts at 1.
-            print(f"Condition: New day (last update: {last_streak_date}) or missed day(s) or first activity. Setting streak to 1.")
-            updated_streak = 1
-        # --- End Refined Streak Logic ---
-
-        print(f"Result -> Current Streak (Before Update): {current_streak}, Calculated New Streak: {updated_streak}")
-        # --- END DETAILED STREAK DEBUG ---
-
-
-        # --- Check for Level Up AFTER calculating new XP ---
-        new_level, _, _ = calculate_level_xp(new_xp)
-        gems_from_level_up = 0
-        if new_level > old_level:
-            gems_from_level_up = 50 # Award 50 gems for leveling up (example)
-            print(f"User {user_email} leveled up: {old_level} -> {new_level}! Awarding {gems_from_level_up} gems.")
-
-        # --- Total Gems to Add ---
-        total_gems_to_add = lesson_gems + gems_from_level_up
-
-        # --- Execute the Database Update ---
-        # Always update last_streak_update to today's date when activity occurs
-        today_iso = today.isoformat()
+        if not user:
+            conn.rollback()
+            return jsonify({"error": "User not found"}), 404
+
+        hearts, time_left = compute_hearts(user["hearts"], user["heart_anchor"], now_ts)
+        results, hearts_lost, completed = score_attempt(grader, answers, hearts)
+        hearts_lost = min(hearts, max(hearts_lost, mistakes))
+        if hearts_lost:
+            hearts -= hearts_lost
+            # Re-anchor at the new count; losing a heart restarts the regeneration timer
+            cursor.execute("UPDATE users SET hearts = ?, heart_anchor = ? WHERE email = ?", (hearts, now_ts, user_email))
+            time_left = compute_hearts(hearts, now_ts, now_ts)[1]
+
+        xp, gems, streak = user["xp"], user["gems"], user["streak"]
+        completion = None
+        if completed:
+            completion = apply_lesson_completion(conn, user_email, lang, lesson_id, catalog.lesson_xp(lang, lesson_id), user)
+            streak = completion["new_streak"]
+            achievement_rewards = [(a.get('reward_xp', 0), a.get('reward_gems', 0)) for a in completion["new_achievements"]]
+            xp = completion["new_xp"] + sum(reward_xp for reward_xp, _ in achievement_rewards)
+            gems += completion["gems_added"] + sum(reward_gems for _, reward_gems in achievement_rewards)
+
+        completed_lessons = [row["lesson_id"] for row in cursor.execute(
+            "SELECT lesson_id FROM progress WHERE user_email = ? AND completed = 1 AND language = ?", (user_email, lang))]
+        level, level_percentage, next_level_xp = calculate_level_xp(xp)
+        response_data = {
+            "attempt_id": attempt_id,
+            "completed": completed,
+            "results": results,
+            "hearts_lost": hearts_lost,
+            "hearts": hearts,
+            "time_left": time_left,
+            "xp_earned": (xp - user["xp"]) if completed else 0,
+            "new_total_xp": xp,
+            "gems": gems,
+            "new_streak": streak,
+            "level": level,
+            "level_percentage": level_percentage,
+            "next_level_xp": next_level_xp,
+            "completed_lessons": completed_lessons,
+            "new_achievements": completion["new_achievements"] if completion else [],
+        }
+        response_body = json.dumps(response_data, separators=(",", ":"))
         cursor.execute(
-            """UPDATE users
-               SET xp = ?, daily_progress = ?, streak = ?, last_streak_update = ?, gems = gems + ?
-               WHERE email = ?""",
-            (new_xp, new_daily_progress, updated_streak, today_iso, total_gems_to_add, user_email)
+            """INSERT INTO lesson_attempts (user_email, attempt_id, lesson_id, language, completed, duration_ms, response, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (user_email, attempt_id, lesson_id, lang, completed, duration_ms, response_body, now_ts)
         )
-        print(f"Executing DB Update -> New XP: {new_xp}, New Daily: {new_daily_progress}, New Streak: {updated_streak}, New Last Update: {today_iso}, Gems Added: {total_gems_to_add}")
-
-        # --- Check for Achievements AFTER stats are updated ---
-        newly_earned_achievements = check_and_award_achievements(user_email, conn)
-
-        # --- Commit Transaction ---
+        cursor.execute("DELETE FROM lesson_attempts WHERE user_email = ? AND created_at < ?",
+                       (user_email, now_ts - ATTEMPT_RETENTION_SECONDS))
+        xp_event_id = last_xp_event_id(conn) if completed else None # Versions the leaderboard delta below
         conn.commit()
-        print("Transaction Committed.")
+        invalidate_user_rows(user_email)
+    except sqlite3.Error as db_err:
+        log_event("lesson_attempt_failed", logging.ERROR, user=user_email, lesson=lesson_id, error=db_err)
+        conn.rollback()
+        return jsonify({"error": "Database error while saving the lesson attempt."}), 500
 
-        # Fetch updated completed list for response
-        cursor.execute("SELECT lesson_id FROM progress WHERE user_email = ? AND completed = 1 AND language = ?", (user_email, lang))
-        completed_lessons = [row["lesson_id"] for row in cursor.fetchall()]
+    log_event("lesson_attempt", sampled=True, user=user_email, lesson=lesson_id, lang=lang, completed=completed,
+              answers=len(answers), hearts_lost=hearts_lost, duration_ms=duration_ms)
+    if completed:
+        # Applied only once the transaction is durable
+        leaderboard_service.add_xp(user_email, None, xp - user["xp"], event_id=xp_event_id)
+        invalidate_leaderboard_fragments(user_email)
+    return app.response_class(response_body, mimetype="application/json")
 
-        # Prepare JSON response
-        response_data = {
-            "message": "Lesson completed!",
-            "xp_earned": lesson_xp,
-            "new_total_xp": new_xp,
-            "new_streak": updated_streak, # Return the calculated streak
-            "completed_lessons": completed_lessons,
-            "new_achievements": newly_earned_achievements
-        }
-        return jsonify(response_data)
+# app.py
 
-    # --- Error Handling ---
-    except sqlite3.Error as db_err:
-         print(f"DATABASE ERROR during lesson completion for {user_email}: {db_err}")
-         conn.rollback() # Rollback changes on error
-         return jsonify({"error": "Database error during lesson completion."}), 500
-    except Exception as e:
-         print(f"UNEXPECTED ERROR during lesson completion for {user_email}: {e}")
-         conn.rollback() # Rollback changes on error
-         return jsonify({"error": "An unexpected error occurred."}), 500
-    finally:
-        # Ensure connection is always closed
-        if conn: conn.close()
+# ... (keep all other imports, constants, functions like get_db_connection, etc.) ...
 
 # ... (rest of your app.py, including check_and_award_achievements, etc.) ...
 
@@ -725,40 +1063,30 @@ def dashboard():
 
     # --- Pre-computation/Checks (Run for BOTH HTML and AJAX) ---
     try:
-        check_daily_reset_and_streak(user_email)
-        current_hearts, time_left_seconds = update_hearts(user_email)
+        # --- Language and Lessons (Needed for both) ---
+        catalog = get_catalog()
+        available_languages = get_available_languages(catalog)
+        lang = request.args.get("lang", "Spanish")
+        if lang not in available_languages:
+             lang = available_languages[0]
 
-        if current_hearts is None: # Handle case where user might have been deleted
-            session.pop('user', None)
-            flash("An error occurred fetching your data. Please log in again.", "danger")
-            return redirect(url_for('login'))
+        lessons = catalog.lesson_summaries(lang) # Ids, titles and XP; the page doesn't need the questions
 
-        user = get_user_data(user_email)
-        if not user:
+        # --- User row + completed lessons for the *selected* language, resets applied (one transaction) ---
+        state = load_user_state(user_email, lang, get_db_connection())
+        if state is None: # Handle case where user might have been deleted
             session.pop('user', None)
-            flash("Could not retrieve user data.", "danger")
+            flash("An error occurred fetching your data. Please log in again.", "danger")
             return redirect(url_for('login'))
 
-        # --- Language and Lessons (Needed for both) ---
-        lang = request.args.get("lang", "Spanish")
-        if lang not in AVAILABLE_LANGUAGES:
-             lang = AVAILABLE_LANGUAGES[0] if AVAILABLE_LANGUAGES else "Spanish"
-
-        lang_key = f"{lang}-English"
-        lessons = lessons_data.get(lang_key, []) # Get lessons for the selected language
-
-        # --- Get Completed Lessons for the *Selected* Language (Needed for both) ---
-        conn = get_db_connection()
-        completed_rows = conn.execute(
-            "SELECT lesson_id FROM progress WHERE user_email = ? AND language = ? AND completed = 1",
-            (user_email, lang) # Filter by language!
-        ).fetchall()
-        completed_lessons = [row["lesson_id"] for row in completed_rows]
-        conn.close()
+        user = state["user"]
+        current_hearts = state["hearts"]
+        time_left_seconds = state["time_left"]
+        completed_lessons = state["completed_lessons"]
 
     except Exception as e:
          # Catch potential errors during data fetching before deciding HTML vs JSON
-         print(f"ERROR fetching dashboard data for {user_email}: {e}")
+         log_event("dashboard_load_failed", logging.ERROR, exc_info=True, user=user_email, error=e)
          flash("An error occurred while loading dashboard data. Please try again.", "danger")
          # Determine if it was likely an AJAX request based on headers even during error
          if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -772,18 +1100,24 @@ def dashboard():
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         try:
             # Ensure all required variables were successfully fetched above
-            print(f"DEBUG: AJAX request for dashboard. Lang: {lang}, User: {user_email}") # Add Debug Print
-            print(f"DEBUG: Data for JSON -> lessons count: {len(lessons)}, completed: {completed_lessons}, hearts: {current_hearts}, time_left: {time_left_seconds}")
+            log_event("dashboard_ajax", logging.DEBUG, user=user_email, lang=lang, lessons=len(lessons),
+                      completed=len(completed_lessons), hearts=current_hearts, time_left=time_left_seconds)
 
-            return jsonify({
-                "lessons": lessons,               # Already filtered by lang
+            state_json = json.dumps({
                 "completed": completed_lessons,   # Already filtered by lang
                 "hearts": current_hearts,
-                "time_left": time_left_seconds
-            })
+                "time_left": time_left_seconds,
+                "lessons_url": lesson_content_url(catalog, lang), # Cacheable lesson content (see lesson_content)
+            }, separators=(",", ":"))
+            if request.args.get("lessons") == "0": # Caller fetches the lesson list from lessons_url
+                return app.response_class(state_json, mimetype="application/json")
+            # Splice the catalog's pre-serialized lesson list in instead of re-running jsonify on it
+            lessons_json = catalog.lessons_json(lang) or b"[]"
+            body = b'{"lessons":' + lessons_json + b"," + state_json[1:].encode("utf-8")
+            return app.response_class(body, mimetype="application/json")
         except Exception as e:
              # Catch error specifically during jsonify or if data is bad
-             print(f"ERROR during jsonify in dashboard AJAX for {user_email}: {e}")
+             log_event("dashboard_ajax_failed", logging.ERROR, exc_info=True, user=user_email, error=e)
              # Send a specific JSON error response with 500 status
              return jsonify({"error": "Internal server error preparing data"}), 500
 
@@ -812,11 +1146,11 @@ def dashboard():
             lessons=lessons,               # Already filtered by lang
             language=lang,                 # Pass current language
             completed_lessons=completed_lessons, # Already filtered by lang
-            available_languages=AVAILABLE_LANGUAGES
+            available_languages=available_languages
         )
     except Exception as e:
          # Catch potential errors during HTML rendering calculation
-         print(f"ERROR rendering dashboard HTML for {user_email}: {e}")
+         log_event("dashboard_render_failed", logging.ERROR, exc_info=True, user=user_email, error=e)
          flash("An error occurred while displaying the dashboard.", "danger")
          return redirect(url_for('login'))
 
@@ -824,6 +1158,73 @@ def dashboard():
 
 
 
+@app.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    """Serves built assets (and their .br/.gz siblings) with immutable, year-long caching."""
+    encodings = asset_manifest.encodings(filename)
+    if encodings is None:
+        abort(404)
+    encoding = choose_encoding(encodings)
+    suffix = {"br": ".br", "gzip": ".gz"}.get(encoding, "")
+    response = send_from_directory(ASSET_BUILD_DIR, filename + suffix,
+                                   mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
+
+# --- Lesson Content (HTTP-cacheable) ---
+LESSON_CONTENT_MAX_AGE = 365 * 24 * 3600 # Versioned URLs never change content
+PRECOMPRESSED_ENCODINGS = ("br", "gzip") # Preference order for precompressed variants
+
+def choose_encoding(available):
+    """Best precompressed encoding the client accepts among `available`, or None for identity."""
+    for name in PRECOMPRESSED_ENCODINGS:
+        if name in available and request.accept_encodings[name]:
+            return name
+    return None
+
+def lesson_content_url(catalog, lang):
+    """Versioned (content-hash) URL of a language's lesson list."""
+    return url_for('lesson_content', language=lang, version=catalog.content_hash(lang))
+
+@app.route('/lesson_content/<language>')
+@app.route('/lesson_content/<language>/<version>')
+def lesson_content(language, version=None):
+    """
+    A language's lesson list, straight from the catalog's pre-serialized (and precompressed) bytes.
+    The versioned URL is cached for a year; the unversioned one revalidates with its ETag.
+    """
+    if "user" not in session:
+        return jsonify({"error": "User not logged in"}), 401
+
+    catalog = get_catalog()
+    content_hash = catalog.content_hash(language)
+    if content_hash is None:
+        return jsonify({"error": f"Invalid language specified: {language}"}), 404
+    if version is not None and version != content_hash:
+        return redirect(lesson_content_url(catalog, language)) # Link from before a catalog reload
+
+    variants = {"br": catalog.lessons_brotli(language), "gzip": catalog.lessons_gzip(language)}
+    encoding = choose_encoding([name for name, data in variants.items() if data is not None])
+    body = variants[encoding] if encoding else catalog.lessons_json(language)
+    # Each encoding is a different representation, so it gets its own strong ETag
+    etag = content_hash if encoding is None else f"{content_hash}-{encoding}"
+
+    known_tags = [content_hash] + [f"{content_hash}-{name}" for name in PRECOMPRESSED_ENCODINGS]
+    if any(request.if_none_match.contains_weak(tag) for tag in known_tags):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = ("private, no-cache" if version is None
+                                         else f"private, max-age={LESSON_CONTENT_MAX_AGE}, immutable")
+    return response
+
 @app.route('/leaderboard')
 def leaderboard():
     if "user" not in session:
@@ -831,78 +1232,48 @@ def leaderboard():
         return redirect(url_for('login'))
 
     user_email = session['user'] # Get current user's email for highlighting
+    period = request.args.get("period", "all") # 'all', or a window from PERIODS ('week', 'month')
+    if period not in PERIODS:
+        period = "all"
 
     try:
+        # Shared rows come from the fragment cache; only the viewer's highlight and own rank are per request
         conn = get_db_connection()
-        # Fetch top users ordered by XP, assign rank
-        # Using RANK() window function for tie handling (requires SQLite 3.25+)
-        query = """
-            SELECT
-                email,
-                fullname,
-                xp,
-                RANK() OVER (ORDER BY xp DESC) as rank
-            FROM users
-            ORDER BY rank ASC, fullname ASC -- Sort by rank, then name for ties
-            LIMIT ?
-        """
-        leaderboard_data = conn.execute(query, (LEADERBOARD_LIMIT,)).fetchall()
-        conn.close()
-
-        # Prepare data for template, adding profile color
-        leaderboard_list = []
-        for user_row in leaderboard_data:
-            user_dict = dict(user_row) # Convert row object to dictionary
-            # Generate profile color based on fullname or email
-            display_name = user_dict['fullname'] or user_dict['email']
-            user_dict['profile_color'] = get_profile_color(display_name)
-            # Get first initial for icon
-            user_dict['initial'] = (display_name[0] if display_name else '?').upper()
-            leaderboard_list.append(user_dict)
-
-        # Optional: Find current user's rank if not in top list (more complex query)
-        # For now, we just highlight if they appear in the top LEADERBOARD_LIMIT
-
-    except sqlite3.OperationalError as e:
-         # Handle cases where RANK() might not be supported (older SQLite)
-         if "window functions are not supported" in str(e).lower() or "no such function: rank" in str(e).lower():
-              print("WARNING: RANK() window function not supported. Falling back to manual ranking (might be slow).")
-              conn = get_db_connection()
-              # Fetch without RANK()
-              query_fallback = """
-                    SELECT email, fullname, xp
-                    FROM users
-                    ORDER BY xp DESC, fullname ASC
-                    LIMIT ?
-              """
-              leaderboard_data = conn.execute(query_fallback, (LEADERBOARD_LIMIT,)).fetchall()
-              conn.close()
-              # Manually add rank and color
-              leaderboard_list = []
-              rank_counter = 1
-              for user_row in leaderboard_data:
-                   user_dict = dict(user_row)
-                   user_dict['rank'] = rank_counter # Simple rank, doesn't handle ties like RANK()
-                   display_name = user_dict['fullname'] or user_dict['email']
-                   user_dict['profile_color'] = get_profile_color(display_name)
-                   user_dict['initial'] = (display_name[0] if display_name else '?').upper()
-                   leaderboard_list.append(user_dict)
-                   rank_counter += 1
-         else:
-              # Re-raise other operational errors
-              print(f"ERROR fetching leaderboard data: {e}")
-              flash("Could not load the leaderboard due to a database error.", "danger")
-              return redirect(url_for('dashboard')) # Redirect on error
+        fragment = fragment_cache.get_or_render(("leaderboard", period),
+                                                lambda: render_leaderboard_rows(fetch_leaderboard_entries(conn, period)))
+
+        # Show the current user's own rank below the list if they aren't in the top LEADERBOARD_LIMIT
+        current_user_entry = None
+        if not any(email == user_email for email, _ in fragment["rows"]):
+            if period == "all" and leaderboard_service.ready:
+                around_user = leaderboard_service.around(user_email, radius=0)
+                current_user_entry = around_user[0] if around_user else None
+            elif period == "all":
+                current_user_entry = rank_from_sql(conn, user_email)
+                if current_user_entry:
+                    display_name = current_user_entry['fullname'] or user_email
+                    current_user_entry.update(profile_color=get_profile_color(display_name),
+                                              initial=display_name[0].upper())
+            else:
+                current_user_entry = windowed_rank(conn, period, user_email)
+                user_info = get_user_data(user_email, conn) if current_user_entry else None
+                if user_info:
+                    display_name = user_info['fullname'] or user_email
+                    current_user_entry.update(fullname=user_info['fullname'],
+                                              profile_color=get_profile_color(display_name),
+                                              initial=display_name[0].upper())
 
     except Exception as e:
-        print(f"ERROR fetching leaderboard data: {e}")
+        log_event("leaderboard_load_failed", logging.ERROR, error=e)
         flash("An error occurred while loading the leaderboard.", "danger")
         return redirect(url_for('dashboard')) # Redirect on error
 
 
     return render_template(
         "leaderboard.html",
-        leaderboard_data=leaderboard_list,
+        leaderboard_rows=fragment["rows"],
+        current_user_entry=current_user_entry,
+        period=period,
         current_user_email=user_email # Pass current user's email for highlighting
     )
 
@@ -917,12 +1288,14 @@ def lesson_page(lesson_id):
     lang = request.args.get("lang", "Spanish") # Get language
 
     # --- Check Hearts ---
-    # Update hearts status before allowing lesson access
-    current_hearts, _ = update_hearts(user_email)
-    if current_hearts is None: # User not found
+    # Update hearts status before allowing lesson access (same snapshot covers the prerequisite check)
+    state = load_user_state(user_email, lang, get_db_connection())
+    if state is None: # User not found
         flash("Could not verify user data.", "error")
         return redirect(url_for('login'))
 
+    current_hearts = state["hearts"]
+
     if current_hearts <= 0:
         flash("You're out of hearts! Wait for them to regenerate or visit the shop.", "warning")
         # Redirect back to dashboard, maybe with a query param indicating no hearts?
@@ -931,27 +1304,19 @@ def lesson_page(lesson_id):
     # --- Check Lesson Prerequisite ---
     if lesson_id > 1:
         required_lesson_id = lesson_id - 1
-        conn = get_db_connection()
-        completion = conn.execute(
-            "SELECT 1 FROM progress WHERE user_email = ? AND lesson_id = ? AND language = ? AND completed = 1",
-            (user_email, required_lesson_id, lang)
-        ).fetchone()
-        conn.close()
-        if not completion:
+        if required_lesson_id not in state["completed_lessons"]:
             flash(f"Please complete Lesson {required_lesson_id} first.", "warning")
             return redirect(url_for('dashboard', lang=lang))
 
 
     # --- Load Lesson Data ---
-    lang_key = f"{lang}-English"
-    lessons = lessons_data.get(lang_key, [])
-    lesson = next((l for l in lessons if l.get("lesson") == lesson_id), None)
+    lesson = get_catalog().get_lesson(lang, lesson_id)
 
     if lesson:
         # Optional: Deduct heart immediately upon starting lesson?
         # Or deduct only upon making a mistake (more complex)?
         # For simplicity, let's assume mistakes trigger /lose_heart calls from lesson.js
-        return render_template("lesson.html", lesson=lesson, language=lang, current_hearts=current_hearts) # Pass hearts
+        return render_template("lesson.html", lesson=client_lesson(lesson), language=lang, current_hearts=current_hearts) # Pass hearts
 
     flash(f"Lesson {lesson_id} not found for {lang}.", "error")
     return redirect(url_for('dashboard', lang=lang))
@@ -968,7 +1333,8 @@ def profile():
         return redirect(url_for('login'))
 
     user_email = session['user']
-    user_info = get_user_data(user_email)
+    conn = get_db_connection()
+    user_info = get_user_data(user_email, conn)
 
     if not user_info:
         flash("Could not retrieve your profile data.", "danger")
@@ -989,36 +1355,25 @@ def profile():
     earned_achievements_list = []
     earned_achievements_count = 0 # Initialize count
     try:
-        conn_ach = get_db_connection()
-        if conn_ach:
-             # Fetch details for listing
-             earned_rows = conn_ach.execute(
+        # Fetch details for listing
+        earned_rows = conn.execute(
                   """SELECT ua.achievement_key, a.name, a.description, a.icon FROM user_achievements ua
                      JOIN achievements a ON ua.achievement_key = a.achievement_key
                      WHERE ua.user_email = ? ORDER BY ua.earned_at DESC""", (user_email,)
-              ).fetchall()
-             earned_achievements_list = [dict(row) for row in earned_rows]
-             # Get the count separately (more efficient than len() if list is large)
-             count_result = conn_ach.execute("SELECT COUNT(*) as count FROM user_achievements WHERE user_email = ?", (user_email,)).fetchone()
-             earned_achievements_count = count_result['count'] if count_result else 0
-             conn_ach.close()
+         ).fetchall()
+        earned_achievements_list = [dict(row) for row in earned_rows]
+        # Get the count separately (more efficient than len() if list is large)
+        count_result = conn.execute("SELECT COUNT(*) as count FROM user_achievements WHERE user_email = ?", (user_email,)).fetchone()
+        earned_achievements_count = count_result['count'] if count_result else 0
     except Exception as e:
-         print(f"Error fetching profile achievements: {e}")
+         log_event("profile_achievements_failed", logging.ERROR, user=user_email, error=e)
 
     # --- Get Completed Lessons Count (Total across all languages) ---
     total_lessons_completed = 0
     try:
-        conn_lessons = get_db_connection()
-        if conn_lessons:
-            # Count distinct lessons (lesson_id + language combination)
-            count_result = conn_lessons.execute(
-                "SELECT COUNT(DISTINCT lesson_id || '-' || language) as count FROM progress WHERE user_email = ? AND completed = 1",
-                (user_email,)
-            ).fetchone()
-            total_lessons_completed = count_result['count'] if count_result else 0
-            conn_lessons.close()
+        total_lessons_completed = get_lessons_completed(conn, user_email) # Single-row lookup in user_stats
     except Exception as e:
-        print(f"Error fetching completed lessons count for profile: {e}")
+        log_event("profile_lesson_count_failed", logging.ERROR, user=user_email, error=e)
 
     # --- Prepare data for the template ---
     profile_data = {
@@ -1050,7 +1405,7 @@ def settings():
         return redirect(url_for('login'))
 
     user_email = session['user']
-    user_info = get_user_data(user_email)
+    user_info = get_user_data(user_email, get_db_connection())
 
     if not user_info:
         flash("Could not retrieve your profile data.", "danger")
@@ -1090,7 +1445,6 @@ def update_profile():
         existing_user = cursor.fetchone()
         if existing_user:
             flash("That email address is already taken by another user.", "warning")
-            conn.close()
             return redirect(url_for('settings'))
         else:
              # Update email if it's valid and different
@@ -1098,25 +1452,27 @@ def update_profile():
                 cursor.execute("UPDATE users SET fullname = ?, email = ? WHERE email = ?",
                                (new_fullname, new_email.lower(), user_email))
                 conn.commit()
+                invalidate_user_rows(user_email, new_email.lower())
+                leaderboard_service.rename(user_email, new_email.lower(), new_fullname)
+                invalidate_leaderboard_fragments()
                 # IMPORTANT: Update the email in the session!
                 session['user'] = new_email.lower()
                 flash("Profile updated successfully!", "success")
             except sqlite3.Error as e:
                  conn.rollback()
                  flash(f"Database error updating profile: {e}", "danger")
-            finally:
-                conn.close()
     else:
         # Only update fullname if email hasn't changed
         try:
             cursor.execute("UPDATE users SET fullname = ? WHERE email = ?", (new_fullname, user_email))
             conn.commit()
+            invalidate_user_rows(user_email)
+            leaderboard_service.rename(user_email, user_email, new_fullname)
+            invalidate_leaderboard_fragments()
             flash("Full name updated successfully!", "success")
         except sqlite3.Error as e:
              conn.rollback()
              flash(f"Database error updating full name: {e}", "danger")
-        finally:
-             conn.close()
 
     # --- SECURITY NOTE ---
     # In a production app, changing email should trigger a verification email
@@ -1152,27 +1508,27 @@ def update_password():
          return redirect(url_for('settings'))
 
     # --- Verify Current Password ---
-    user_info = get_user_data(user_email)
+    user_info = get_user_data(user_email, get_db_connection(), fresh=True)
+    return_db_connection() # Don't hold a pooled connection while waiting for the hasher
     if not user_info:
         flash("Could not retrieve user data.", "danger")
         return redirect(url_for('settings')) # Or redirect to login
 
-    if not check_password_hash(user_info['password'], current_password):
+    if not password_hasher.verify(user_info['password'], current_password):
         flash("Incorrect current password.", "danger")
         return redirect(url_for('settings'))
 
     # --- Update Password ---
+    new_hashed_password = password_hasher.hash(new_password)
+    conn = get_db_connection()
     try:
-        new_hashed_password = generate_password_hash(new_password)
-        conn = get_db_connection()
         conn.execute("UPDATE users SET password = ? WHERE email = ?", (new_hashed_password, user_email))
         conn.commit()
-        conn.close()
+        invalidate_user_rows(user_email)
         flash("Password updated successfully!", "success")
     except sqlite3.Error as e:
+        conn.rollback()
         flash(f"Database error updating password: {e}", "danger")
-        # Ensure connection is closed even on error
-        if conn: conn.close()
 
     return redirect(url_for('settings'))
 
@@ -1191,26 +1547,28 @@ def delete_account():
         return redirect(url_for('settings'))
 
     # --- Verify Password ---
-    user_info = get_user_data(user_email)
+    user_info = get_user_data(user_email, get_db_connection(), fresh=True)
+    return_db_connection() # Don't hold a pooled connection while waiting for the hasher
     if not user_info:
         flash("Could not retrieve user data for deletion.", "danger")
         return redirect(url_for('settings'))
 
-    if not check_password_hash(user_info['password'], confirm_password):
+    if not password_hasher.verify(user_info['password'], confirm_password):
         flash("Incorrect password. Account deletion cancelled.", "danger")
         return redirect(url_for('settings'))
 
     # --- PERFORM DELETION ---
     # IMPORTANT: Ensure ON DELETE CASCADE is set correctly on the 'progress' table's
-    # foreign key in your database schema (database.py). If it is, deleting
+    # foreign key in your database schema (migrations.py). If it is, deleting
     # the user should automatically delete their progress records.
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        print(f"ATTEMPTING TO DELETE USER: {user_email}")
         conn.execute("DELETE FROM users WHERE email = ?", (user_email,))
         conn.commit()
-        conn.close()
-        print(f"SUCCESSFULLY DELETED USER: {user_email}")
+        invalidate_user_rows(user_email)
+        leaderboard_service.remove(user_email)
+        invalidate_leaderboard_fragments()
+        log_event("account_deleted", user=user_email)
 
         # Clear the session completely
         session.clear()
@@ -1220,16 +1578,72 @@ def delete_account():
 
     except sqlite3.Error as e:
         flash(f"Database error deleting account: {e}", "danger")
-        print(f"DATABASE ERROR deleting account for {user_email}: {e}")
-        # Ensure connection is closed even on error
-        if conn: conn.close()
+        log_event("account_delete_failed", logging.ERROR, user=user_email, error=e)
+        conn.rollback()
         return redirect(url_for('settings')) # Redirect back to settings on error
 
 
+# --- Admin Routes ---
+
+def is_admin_request():
+    """Admin endpoints require the X-Admin-Token header to match ADMIN_TOKEN."""
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+@app.route('/admin/reload_lessons', methods=['POST'])
+def reload_lessons():
+    """Re-reads lessons.json now. The current catalog is kept if the new file is invalid."""
+    if not is_admin_request():
+        return jsonify({"error": "Not authorized"}), 403
+
+    reloaded = catalog_loader.reload(force=True)
+    status = 200 if reloaded else 422
+    return jsonify({"reloaded": reloaded, **catalog_loader.stats()}), status
+
+@app.route('/admin/catalog_status')
+def catalog_status():
+    """Reload timing and catalog size metrics."""
+    if not is_admin_request():
+        return jsonify({"error": "Not authorized"}), 403
+    return jsonify(catalog_loader.stats())
+
+def is_metrics_request():
+    """/metrics requires an Authorization: Bearer header matching METRICS_TOKEN."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return bool(METRICS_TOKEN) and scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), METRICS_TOKEN)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target (this worker process only)."""
+    if not is_metrics_request():
+        return app.response_class("Not authorized\n", status=403, mimetype="text/plain")
+    catalog_stats = catalog_loader.stats()
+    gauges = {
+        "lesson_catalog_lessons": ("Lessons in the loaded catalog.", catalog_stats["lessons"]),
+        "lesson_catalog_size_bytes": ("Size of the loaded catalog source.", catalog_stats["size_bytes"]),
+        "lesson_catalog_reloads": ("Successful catalog reloads.", catalog_stats["reload_count"]),
+        "lesson_catalog_reload_failures": ("Failed catalog reloads.", catalog_stats["reload_failures"]),
+        "lesson_catalog_last_reload_seconds": ("Duration of the last catalog reload.", catalog_stats["last_reload_seconds"] or 0),
+        "leaderboard_users": ("Users in the in-memory leaderboard.", len(leaderboard_service)),
+        "leaderboard_last_rebuild_seconds": ("Duration of the last background leaderboard rebuild.", leaderboard_service.last_rebuild_seconds or 0),
+        "leaderboard_last_catch_up_seconds": ("Duration of the last leaderboard catch-up with other workers' XP.", leaderboard_service.last_catch_up_seconds or 0),
+        "leaderboard_rebuild_failures": ("Failed background leaderboard rebuilds and catch-ups.", leaderboard_service.rebuild_failures),
+    }
+    for name, value in fragment_cache.stats().items():
+        gauges[f"fragment_cache_{name}"] = (f"Fragment cache {name}.", value)
+    if write_behind is not None:
+        for name, value in write_behind.stats().items():
+            gauges[f"write_behind_{name}"] = (f"Write-behind queue {name}.", value)
+    for name, value in user_cache.stats().items():
+        gauges[f"user_cache_{name}"] = (f"User row cache {name}.", value)
+    gauges["user_cache_resyncs"] = ("Whole user cache drops by the change feed.", user_changes.resyncs)
+    for name, value in password_hasher.stats().items():
+        gauges[f"password_hash_{name}"] = (f"Password hashing {name}.", value)
+    body = request_metrics.render(gauges)
+    return app.response_class(body, mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    # Ensure the DB is initialized before running the app
-    # Running database.py separately is often cleaner
-    # init_db() # Or call it here if database.py isn't run separately
     print("Starting Flask app...")
-    print(f"Available languages: {AVAILABLE_LANGUAGES}")
+    print(f"Available languages: {get_available_languages(catalog_loader.catalog)}")
     app.run(debug=True) # debug=True enables auto-reloading and error pages
\ No newline at end of file
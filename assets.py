@@ -0,0 +1,180 @@
+# assets.py
+# Static asset build step: minify, fingerprint and precompress everything under static/.
+#
+#   python assets.py [--clean]
+#
+# Writes static/dist/<dir>/<name>.<hash>.<ext> (+ .gz/.br siblings for text assets) and
+# static/dist/manifest.json; templates link assets through asset_url() in app_test.py, which
+# falls back to the plain /static/ URL for anything not in the manifest (e.g. before a build).
+# CSS url() references are not rewritten; keep assets referenced from templates.
+#
+# Optional packages, installed from the package index (never vendored as wheels):
+#   pip install brotli rcssmin rjsmin
+# Without brotli only .gz variants are written (the app then serves gzip); without rcssmin/rjsmin
+# a built-in minifier is used.
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+try:
+    import brotli # Optional: .br variants are skipped without it
+except ImportError:
+    brotli = None
+try:
+    import rcssmin # Optional: better CSS minification than the built-in fallback
+except ImportError:
+    rcssmin = None
+try:
+    import rjsmin # Optional: better JS minification than the built-in fallback
+except ImportError:
+    rjsmin = None
+
+STATIC_DIR = "static"
+BUILD_SUBDIR = "dist"
+MANIFEST_NAME = "manifest.json"
+FINGERPRINT_LENGTH = 12
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+MIN_COMPRESS_BYTES = 256 # Smaller files aren't worth an extra variant
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')') # Quoted strings are left untouched
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+
+
+def minify_css(text):
+    """Drops comments and insignificant whitespace outside of quoted strings."""
+    if rcssmin is not None:
+        return rcssmin.cssmin(text)
+    parts = _CSS_TOKENS.split(_CSS_COMMENT.sub("", text))
+    for i in range(0, len(parts), 2): # Even indexes are outside strings
+        code = re.sub(r"\s+", " ", parts[i])
+        code = re.sub(r"\s*([{};,])\s*", r"\1", code)
+        code = re.sub(r":\s+", ":", code)
+        parts[i] = code.replace(";}", "}")
+    return "".join(parts).strip() + "\n"
+
+
+def minify_js(text):
+    """
+    Conservative fallback: removes indentation, blank lines, whole-line // comments and
+    comment blocks that start a line. Line breaks are kept so automatic semicolon insertion
+    behaves exactly as before.
+    """
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+    lines = []
+    in_block_comment = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if in_block_comment:
+            if "*/" in stripped:
+                in_block_comment = False
+                stripped = stripped.split("*/", 1)[1].strip()
+            else:
+                continue
+        if stripped.startswith("/*"):
+            if "*/" not in stripped:
+                in_block_comment = True
+                continue
+            stripped = stripped.split("*/", 1)[1].strip()
+        if not stripped or stripped.startswith("//"):
+            continue
+        lines.append(stripped)
+    return "\n".join(lines) + "\n"
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(static_dir=STATIC_DIR, clean=False):
+    """
+    Builds every file under `static_dir` (except the build output) into static_dir/dist and
+    writes the manifest last, so a running app never sees a manifest pointing at missing files.
+    Returns the manifest dict.
+    """
+    build_dir = os.path.join(static_dir, BUILD_SUBDIR)
+    assets = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir) and BUILD_SUBDIR in dirs:
+            dirs.remove(BUILD_SUBDIR)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            stem, ext = os.path.splitext(logical)
+            with open(source, "rb") as file:
+                data = file.read()
+            minifier = MINIFIERS.get(ext)
+            if minifier is not None:
+                data = minifier(data.decode("utf-8")).encode("utf-8")
+
+            fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]}{ext}"
+            target = os.path.join(build_dir, fingerprinted)
+            _write(target, data)
+            encodings = []
+            if ext in COMPRESSIBLE_EXTENSIONS and len(data) >= MIN_COMPRESS_BYTES:
+                if brotli is not None:
+                    _write(f"{target}.br", brotli.compress(data, quality=11))
+                    encodings.append("br")
+                _write(f"{target}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+                encodings.append("gzip")
+            assets[logical] = {"path": fingerprinted, "size": len(data), "encodings": encodings}
+
+    manifest = {"assets": assets}
+    _write(os.path.join(build_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    if clean: # Drop builds no longer referenced (keep them for a deploy or two if old pages may still link them)
+        keep = {MANIFEST_NAME}
+        for entry in assets.values():
+            keep.add(entry["path"])
+            keep.update(f"{entry['path']}{suffix}" for suffix in (".gz", ".br"))
+        for root, _, files in os.walk(build_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, build_dir).replace(os.sep, "/") not in keep:
+                    os.remove(path)
+    return manifest
+
+
+class AssetManifest:
+    """Lookup of the build manifest: logical name -> fingerprinted path, and the variants each path has."""
+
+    def __init__(self, assets=None):
+        self._paths = {logical: entry["path"] for logical, entry in (assets or {}).items()}
+        self._encodings = {entry["path"]: tuple(entry.get("encodings", ())) for entry in (assets or {}).values()}
+
+    @classmethod
+    def load(cls, path):
+        """Manifest from disk; an empty one (every asset falls back to /static/) if it hasn't been built."""
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return cls(json.load(file).get("assets", {}))
+        except FileNotFoundError:
+            return cls()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def fingerprinted(self, filename):
+        """Fingerprinted path for a logical static filename, or None if it isn't built."""
+        return self._paths.get(filename)
+
+    def encodings(self, fingerprinted_path):
+        """Precompressed variants of a fingerprinted path, or None if it isn't a built asset."""
+        return self._encodings.get(fingerprinted_path)
+
+
+if __name__ == "__main__":
+    result = build_assets(clean="--clean" in sys.argv[1:])
+    total = sum(entry["size"] for entry in result["assets"].values())
+    print(f"✅ Built {len(result['assets'])} assets ({total} bytes) into {os.path.join(STATIC_DIR, BUILD_SUBDIR)}"
+          f"{'' if brotli else ' (brotli not installed: gzip variants only)'}.")
@@ -0,0 +1,121 @@
+# fragment_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+def approximate_size(value):
+    """Rough size in bytes of a rendered fragment: str/bytes length, summed through tuples/lists/dicts."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approximate_size(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(approximate_size(item) for item in value)
+    return 8 # Numbers, None, ...
+
+
+class FragmentCache:
+    """
+    Bounded in-process cache for rendered page fragments shared by many viewers.
+
+    Keys are tuples whose first item is a namespace ('leaderboard', 'page', ...). Entries expire
+    after a TTL and the least recently used ones are evicted once `max_entries` or `max_bytes`
+    is exceeded. Routes that change the underlying data call `invalidate(namespace)`; a render
+    that was already in flight when its namespace was invalidated is returned but not stored,
+    so it can't put stale HTML back. Concurrent misses on the same key may render it twice.
+
+    Each worker process keeps its own cache, so the TTL bounds how long other workers' writes
+    can go unseen.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=4 * 1024 * 1024, ttl_seconds=10):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (expires_at, size, value), least recently used first
+        self._generations = {}        # namespace -> invalidation count
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        """Cached value for `key`, or None if missing or expired (counted as a hit/miss)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl_seconds=None, generation=None):
+        """Stores `value`; skipped if `generation` is given and the namespace was invalidated since."""
+        size = approximate_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            if generation is not None and self._generations.get(key[0], 0) != generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def generation(self, namespace):
+        """Invalidation count of `namespace`; take it before rendering and pass it to put()."""
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def get_or_render(self, key, render, ttl_seconds=None):
+        """Cached value for `key`, calling `render()` and storing its result on a miss."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        generation = self.generation(key[0])
+        value = render()
+        self.put(key, value, ttl_seconds, generation)
+        return value
+
+    def invalidate(self, namespace, predicate=None):
+        """
+        Drops the entries of `namespace`, or only those for which predicate(key, value) is true.
+        Returns the number of entries dropped.
+        """
+        with self._lock:
+            keys = [key for key, (_, _, value) in self._entries.items()
+                    if key[0] == namespace and (predicate is None or predicate(key, value))]
+            for key in keys:
+                self._drop(key)
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1 # Renders in flight may predate the change
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
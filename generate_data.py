@@ -0,0 +1,188 @@
+# generate_data.py
+# Fills a database with synthetic learners for scale testing:
+#
+#   python generate_data.py --database /tmp/scale.db --users 1000000
+#
+# XP, lesson counts and streaks follow heavy-tailed (Pareto) distributions, language popularity
+# is Zipf-like, and achievements are derived from the generated counters. Rows are written with
+# chunked executemany inside large transactions, in primary-key order, with secondary indexes
+# dropped during the load and rebuilt afterwards.
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from achievements import ALL_ACHIEVEMENTS, qualifying_users_sql
+from database import DATABASE, init_db
+from lesson_catalog import load_catalog
+from user_stats import repair_user_stats
+from xp_ledger import period_keys
+
+PARETO_ALPHA = 1.5              # Tail heaviness of lesson counts / XP (lower = more whales)
+EXECUTEMANY_CHUNK_ROWS = 50000  # Rows per executemany call
+USERS_PER_TRANSACTION = 100000  # Users (with their progress rows) per commit
+ACTIVE_THIS_WEEK = 0.3          # Fraction of users with XP in the current week/month rollups
+LOADED_TABLES = ("users", "progress", "user_achievements", "user_stats", "user_language_stats", "xp_period_totals")
+LOAD_PRAGMAS = (
+    "PRAGMA foreign_keys = OFF",    # Rows are generated consistent; skip per-row FK lookups
+    "PRAGMA synchronous = OFF",     # A crashed load is simply re-run
+    "PRAGMA cache_size = -262144",  # 256 MiB page cache for the index builds
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def _insert_chunked(conn, sql, rows):
+    for start in range(0, len(rows), EXECUTEMANY_CHUNK_ROWS):
+        conn.executemany(sql, rows[start:start + EXECUTEMANY_CHUNK_ROWS])
+
+
+def drop_secondary_indexes(conn):
+    """Drops explicit indexes on the loaded tables and returns their CREATE statements (PK/UNIQUE autoindexes stay)."""
+    placeholders = ", ".join("?" for _ in LOADED_TABLES)
+    indexes = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        LOADED_TABLES
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def generate_user(rng, index, prefix, languages, lessons_per_language, mean_lessons, password_hash, today, now_ts, periods):
+    """One learner's users row, progress rows and weekly/monthly XP rows."""
+    email = f"{prefix}{index:09d}@example.com" # Zero-padded, so emails (and the PK autoindexes) grow monotonically
+
+    max_lessons = lessons_per_language * len(languages)
+    lessons_done = min(max_lessons, int((rng.paretovariate(PARETO_ALPHA) - 1) * mean_lessons * (PARETO_ALPHA - 1)))
+    xp = lessons_done * rng.randint(8, 15)
+    if lessons_done:
+        xp += int(rng.expovariate(1 / 15)) # Re-completions and achievement rewards
+
+    # Fill the user's preferred languages in order (Zipf-weighted choice of the first one, then by popularity)
+    progress_rows = []
+    remaining = lessons_done
+    first = rng.choices(range(len(languages)), weights=[1 / (rank + 1) for rank in range(len(languages))])[0]
+    for language in languages[first:] + languages[:first]:
+        if remaining <= 0:
+            break
+        count = min(remaining, lessons_per_language)
+        progress_rows.extend((email, lesson_id, language, 1) for lesson_id in range(1, count + 1))
+        remaining -= count
+    progress_rows.sort(key=lambda row: (row[1], row[2])) # PK order (user_email, lesson_id, language)
+
+    days_since_active = int(rng.expovariate(1 / 5)) if lessons_done else None
+    streak = 0
+    if days_since_active is not None and days_since_active <= 1:
+        streak = min(lessons_done, int(rng.paretovariate(1.2)) + int(rng.expovariate(1 / 3)))
+    last_active = (today - timedelta(days=days_since_active)).isoformat() if days_since_active is not None else None
+
+    hearts = 5 if rng.random() < 0.8 else rng.randint(0, 4)
+    heart_anchor = now_ts - (rng.randint(0, 600) if hearts < 5 else rng.randint(0, 86400 * 30))
+
+    user_row = (
+        f"Learner {index}", email, password_hash, hearts, heart_anchor, xp,
+        50 + lessons_done + int(rng.expovariate(1 / 30)), streak, last_active,
+        rng.randint(0, 30) if days_since_active == 0 else 0, last_active,
+        (today - timedelta(days=rng.randint(days_since_active or 0, 730))).isoformat(),
+    )
+
+    period_rows = []
+    if xp and rng.random() < ACTIVE_THIS_WEEK:
+        week_xp = min(xp, int(rng.paretovariate(PARETO_ALPHA) * 10))
+        period_rows.append((periods["week"], email, week_xp))
+        period_rows.append((periods["month"], email, min(xp, week_xp + int(rng.paretovariate(PARETO_ALPHA) * 20))))
+    return user_row, progress_rows, period_rows
+
+
+def award_achievements(conn, definitions=ALL_ACHIEVEMENTS):
+    """Set-wise: every user meeting a definition gets it (rewards are assumed to be in the generated XP already)."""
+    max_user_id = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM users").fetchone()[0]
+    awarded = 0
+    for key, achievement in definitions.items():
+        query = qualifying_users_sql(achievement)
+        if query is None:
+            continue
+        select_sql, params = query
+        awarded += conn.execute(
+            f"INSERT OR IGNORE INTO user_achievements (user_email, achievement_key) SELECT q.email, :key FROM ({select_sql}) q",
+            {**params, "start": 1, "stop": max_user_id, "key": key}
+        ).rowcount
+    return awarded
+
+
+def generate(database, users, mean_lessons=10, lessons_per_language=None, prefix="learner", seed=None, catalog_path="lessons.json"):
+    """Appends `users` synthetic learners (and their progress/achievements/rollups) to `database`."""
+    init_db(database)
+    catalog = load_catalog(catalog_path)
+    languages = list(catalog.languages)
+    lessons_per_language = lessons_per_language or max(len(catalog.lessons(lang)) for lang in languages)
+    rng = random.Random(seed)
+    password_hash = generate_password_hash("password") # Hashed once: it's the slowest part of a signup by far
+    today = date.today()
+    now_ts = int(time.time())
+    periods = period_keys(now_ts)
+
+    conn = sqlite3.connect(database)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+
+    first_index = conn.execute("SELECT COUNT(*) FROM users WHERE email LIKE ?", (f"{prefix}%",)).fetchone()[0]
+    started = time.perf_counter()
+    index_sql = drop_secondary_indexes(conn)
+    conn.commit()
+
+    progress_total = 0
+    for batch_start in range(first_index, first_index + users, USERS_PER_TRANSACTION):
+        batch_stop = min(batch_start + USERS_PER_TRANSACTION, first_index + users)
+        user_rows, progress_rows, period_rows = [], [], []
+        for index in range(batch_start, batch_stop):
+            user_row, user_progress, user_periods = generate_user(
+                rng, index, prefix, languages, lessons_per_language, mean_lessons, password_hash, today, now_ts, periods)
+            user_rows.append(user_row)
+            progress_rows.extend(user_progress)
+            period_rows.extend(user_periods)
+
+        _insert_chunked(conn,
+            """INSERT INTO users (fullname, email, password, hearts, heart_anchor, xp, gems, streak,
+                                  last_streak_update, daily_progress, last_daily_reset, join_date)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", user_rows)
+        _insert_chunked(conn, "INSERT INTO progress (user_email, lesson_id, language, completed) VALUES (?, ?, ?, ?)", progress_rows)
+        _insert_chunked(conn, "INSERT INTO xp_period_totals (period, user_email, xp) VALUES (?, ?, ?)", period_rows)
+        conn.commit()
+        progress_total += len(progress_rows)
+        print(f"  {batch_stop - first_index}/{users} users, {progress_total} progress rows "
+              f"({time.perf_counter() - started:.1f}s)")
+
+    print(" Rebuilding secondary indexes...")
+    for sql in index_sql:
+        conn.execute(sql)
+    conn.commit()
+    repair_user_stats(conn) # Counters from progress, set-wise
+    with conn:
+        awarded = award_achievements(conn)
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"✅ Generated {users} users, {progress_total} progress rows, {awarded} achievements "
+          f"in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic learners for scale testing.")
+    parser.add_argument("--database", required=True, help="Target database (created if missing), e.g. /tmp/scale.db")
+    parser.add_argument("--force", action="store_true", help=f"Allow writing into the app's own database ({DATABASE})")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--mean-lessons", type=float, default=10, help="Mean completed lessons per user (heavy-tailed)")
+    parser.add_argument("--lessons-per-language", type=int, default=None,
+                        help="Lesson ids per language (default: from the catalog; raise it for more progress rows per user)")
+    parser.add_argument("--prefix", default="learner", help="Email prefix; re-runs append after existing users with it")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--lessons-file", default="lessons.json")
+    args = parser.parse_args()
+    if os.path.realpath(args.database) == os.path.realpath(DATABASE) and not args.force:
+        parser.error(f"{args.database} is the app's database (DATABASE); use a scratch path, or --force to fill it anyway")
+    print(f"Generating {args.users} users into {args.database}...")
+    generate(args.database, args.users, args.mean_lessons, args.lessons_per_language, args.prefix, args.seed, args.lessons_file)
@@ -0,0 +1,265 @@
+# grading.py
+# Server-side answer checking. Every question of a lesson is compiled once (when the catalog is
+# loaded) into a matcher holding its accepted answers already folded, so grading an answer is
+# one fold of the learner's input plus a set lookup.
+#
+# Folding: Unicode NFKC, case folding, Latin accents dropped (é -> e, ñ -> n), punctuation dropped
+# (including 。、「」), whitespace collapsed, katakana folded to hiragana.
+# Alternates: an answer like "Excuse me / Sorry" accepts either side; a question may also list
+# extra answers under "accept".
+# Japanese: an all-kana answer also accepts its romaji, in Hepburn or Kunrei spelling, with or
+# without long vowels written out, and with は/へ/を read either as written or as particles.
+import itertools
+import json
+import re
+import sys
+import time
+import unicodedata
+
+ALTERNATE_SEPARATOR = " / "
+MAX_PARTICLE_VARIANTS = 16 # Readings generated per kana answer (は/へ/を can each be read two ways)
+
+_PUNCTUATION = re.compile(r"[^\w\s]|_") # Punctuation and symbols, in any script
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+_WHITESPACE = re.compile(r"\s+")
+_KANA = re.compile(r"[ぁ-ゖァ-ヺー]")
+_KANA_ONLY = re.compile(r"[ぁ-ゖァ-ヺー\s]+")
+
+
+def _strip_latin_accents(text):
+    decomposed = unicodedata.normalize("NFD", text)
+    # Only combining diacriticals (U+0300-U+036F): kana voicing marks (U+3099/U+309A) are meaningful
+    kept = "".join(char for char in decomposed if not "\u0300" <= char <= "\u036f")
+    return unicodedata.normalize("NFC", kept)
+
+
+def fold(text):
+    """Canonical form of an answer for comparison."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION.sub(" ", _strip_latin_accents(text)).translate(_KATAKANA_TO_HIRAGANA)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+# --- Kana -> Romaji ---
+
+_ROMAJI = {
+    "あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+    "か": "ka", "き": "ki", "く": "ku", "け": "ke", "こ": "ko",
+    "さ": "sa", "し": "shi", "す": "su", "せ": "se", "そ": "so",
+    "た": "ta", "ち": "chi", "つ": "tsu", "て": "te", "と": "to",
+    "な": "na", "に": "ni", "ぬ": "nu", "ね": "ne", "の": "no",
+    "は": "ha", "ひ": "hi", "ふ": "fu", "へ": "he", "ほ": "ho",
+    "ま": "ma", "み": "mi", "む": "mu", "め": "me", "も": "mo",
+    "や": "ya", "ゆ": "yu", "よ": "yo",
+    "ら": "ra", "り": "ri", "る": "ru", "れ": "re", "ろ": "ro",
+    "わ": "wa", "ゐ": "i", "ゑ": "e", "を": "wo", "ん": "n",
+    "が": "ga", "ぎ": "gi", "ぐ": "gu", "げ": "ge", "ご": "go",
+    "ざ": "za", "じ": "ji", "ず": "zu", "ぜ": "ze", "ぞ": "zo",
+    "だ": "da", "ぢ": "ji", "づ": "zu", "で": "de", "ど": "do",
+    "ば": "ba", "び": "bi", "ぶ": "bu", "べ": "be", "ぼ": "bo",
+    "ぱ": "pa", "ぴ": "pi", "ぷ": "pu", "ぺ": "pe", "ぽ": "po",
+    "ゔ": "vu", "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o", "ゎ": "wa",
+}
+_SMALL_Y = {"ゃ": "a", "ゅ": "u", "ょ": "o"}
+_PARTICLE_READINGS = {"は": "wa", "へ": "e", "を": "o"}
+
+# Hepburn and Kunrei spellings folded to one form; longest patterns first
+_ROMAJI_FOLDS = [
+    ("tchi", "tti"), ("tch", "tty"),
+    ("shi", "si"), ("chi", "ti"), ("sh", "sy"), ("ch", "ty"), ("ts", "t"), ("fu", "hu"), ("ji", "zi"), ("j", "zy"),
+    ("dzu", "zu"), ("du", "zu"), ("di", "zi"),
+    ("m(?=[bmp])", "n"), ("nn", "n"),
+    ("ou", "o"), ("oo", "o"), ("uu", "u"), ("aa", "a"), ("ii", "i"), ("ee", "e"),
+]
+_ROMAJI_FOLD = re.compile("|".join(f"({pattern})" for pattern, _ in _ROMAJI_FOLDS))
+
+
+def kana_to_romaji(kana, particles=None):
+    """
+    Hepburn romaji of a hiragana string (fold katakana first). `particles` maps positions of
+    は/へ/を to read as particles (wa/e/o).
+    """
+    out = []
+    double_next = False
+    for position, char in enumerate(kana):
+        if char == "っ":
+            double_next = True
+            continue
+        if char in _SMALL_Y and out and out[-1][-1] == "i":
+            base = out.pop()[:-1] # き + ゃ -> ky + a; し + ゃ -> sh + a
+            syllable = base + ("" if base.endswith(("sh", "ch", "j")) else "y") + _SMALL_Y[char]
+        elif char == "ー":
+            syllable = out[-1][-1] if out else ""
+        elif particles and position in particles:
+            syllable = _PARTICLE_READINGS[char]
+        else:
+            syllable = _ROMAJI.get(char, char)
+        if double_next and syllable and syllable[0] not in "aiueon ":
+            syllable = ("t" if syllable.startswith("ch") else syllable[0]) + syllable
+        double_next = False
+        out.append(syllable)
+    return "".join(out)
+
+
+def fold_romaji(text):
+    """Folds alternative romaji spellings (shi/si, tsu/tu, ō/ou/o, ...) together; `text` is already fold()ed."""
+    previous = None
+    while text != previous: # "toukyou" -> "tokyo" needs more than one pass in general
+        previous = text
+        text = _ROMAJI_FOLD.sub(lambda m: _ROMAJI_FOLDS[m.lastindex - 1][1], text)
+    return text.replace(" ", "")
+
+
+def romaji_readings(folded_kana):
+    """Folded romaji for every particle reading of an all-kana answer (capped at MAX_PARTICLE_VARIANTS)."""
+    positions = [i for i, char in enumerate(folded_kana) if char in _PARTICLE_READINGS]
+    readings = set()
+    for chosen in itertools.islice(
+            itertools.chain.from_iterable(itertools.combinations(positions, n) for n in range(len(positions) + 1)),
+            MAX_PARTICLE_VARIANTS):
+        readings.add(fold_romaji(kana_to_romaji(folded_kana, set(chosen))))
+    return readings
+
+
+# --- Matchers ---
+
+def accepted_answers(answer, extra=()):
+    """Folded accepted forms of an answer string: each side of "a / b", plus `extra` alternates."""
+    texts = [answer, *answer.split(ALTERNATE_SEPARATOR), *extra]
+    return frozenset(filter(None, (fold(text) for text in texts)))
+
+
+class TextMatcher:
+    """translation, fill_in_blank, sentence_transformation and multiple_choice answers."""
+    __slots__ = ("accepted", "romaji", "expected")
+
+    def __init__(self, answer, extra=()):
+        self.expected = answer
+        self.accepted = accepted_answers(answer, extra)
+        self.romaji = frozenset().union(*(romaji_readings(text) for text in self.accepted
+                                          if _KANA_ONLY.fullmatch(text)))
+
+    def __call__(self, response):
+        if not isinstance(response, str):
+            return False
+        folded = fold(response)
+        if folded in self.accepted:
+            return True
+        return bool(self.romaji) and not _KANA.search(folded) and fold_romaji(folded) in self.romaji
+
+
+class ChoiceMatcher(TextMatcher):
+    """multiple_choice: the response must also be one of the offered options."""
+    __slots__ = ("options",)
+
+    def __init__(self, answer, options, extra=()):
+        super().__init__(answer, extra)
+        self.options = frozenset(fold(option) for option in options)
+
+    def __call__(self, response):
+        if not isinstance(response, str):
+            return False
+        folded = fold(response)
+        return folded in self.accepted and folded in self.options
+
+
+class MatchingMatcher:
+    """matching: the response maps every left-hand item to its right-hand partner."""
+    __slots__ = ("pairs", "expected")
+
+    def __init__(self, pairs):
+        self.expected = pairs
+        self.pairs = {fold(left): TextMatcher(right) for left, right in pairs.items()}
+
+    def __call__(self, response):
+        if not isinstance(response, dict) or len(response) != len(self.pairs):
+            return False
+        for left, right in response.items():
+            matcher = self.pairs.get(fold(left)) if isinstance(left, str) else None
+            if matcher is None or not matcher(right):
+                return False
+        return True
+
+
+def compile_question(question):
+    """Matcher for one lessons.json question (already validated)."""
+    extra = question.get("accept", ())
+    if question["type"] == "matching":
+        return MatchingMatcher(question["pairs"])
+    if question["type"] == "multiple_choice":
+        return ChoiceMatcher(question["answer"], question.get("options", ()), extra)
+    return TextMatcher(question["answer"], extra)
+
+
+def client_lesson(lesson):
+    """
+    Copy of a lesson for the lesson page, without its answers: the page sends every check to the
+    server. A matching question lists its left- and right-hand items separately instead of "pairs".
+    """
+    questions = []
+    for question in lesson["questions"]:
+        shown = {key: value for key, value in question.items() if key not in ("answer", "accept", "pairs")}
+        if question["type"] == "matching":
+            shown["left"] = list(question["pairs"])
+            shown["right"] = sorted(question["pairs"].values())
+        questions.append(shown)
+    return {**lesson, "questions": questions}
+
+
+class LessonGrader:
+    """Compiled matchers for every question of a lesson, indexed like lesson["questions"]."""
+    __slots__ = ("matchers",)
+
+    def __init__(self, lesson):
+        self.matchers = tuple(compile_question(question) for question in lesson["questions"])
+
+    def __len__(self):
+        return len(self.matchers)
+
+    def grade(self, question_index, response):
+        """True if `response` answers question `question_index`; IndexError for an unknown question."""
+        if not 0 <= question_index < len(self.matchers):
+            raise IndexError(question_index)
+        return self.matchers[question_index](response)
+
+    def expected(self, question_index):
+        """The answer shown for question `question_index` once it was graded (a dict for matching)."""
+        return self.matchers[question_index].expected
+
+    def grade_attempt(self, answers):
+        """
+        Grades a list of {"question": index, "answer": ...} items (a question may appear more than
+        once, e.g. when it was retried). Returns one result dict per item, in order.
+        """
+        results = []
+        for item in answers:
+            index = item.get("question") if isinstance(item, dict) else None
+            if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(self.matchers):
+                results.append({"question": index, "correct": False, "error": "unknown question"})
+                continue
+            results.append({"question": index, "correct": self.matchers[index](item.get("answer"))})
+        return results
+
+
+if __name__ == "__main__":
+    # Self-check and throughput: every expected answer must grade as correct against its own question
+    path = sys.argv[1] if len(sys.argv) > 1 else "lessons.json"
+    with open(path, "r", encoding="utf-8") as file:
+        lessons_data = json.load(file)
+    started = time.perf_counter()
+    graders = [(lesson, LessonGrader(lesson)) for lessons in lessons_data.values() for lesson in lessons]
+    compile_seconds = time.perf_counter() - started
+
+    attempts = [[{"question": i, "answer": q.get("pairs") or q["answer"]} for i, q in enumerate(lesson["questions"])]
+                for lesson, _ in graders]
+    failures = [(lesson["title"], r["question"]) for (lesson, grader), attempt in zip(graders, attempts)
+                for r in grader.grade_attempt(attempt) if not r["correct"]]
+    rounds = 50
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for (_, grader), attempt in zip(graders, attempts):
+            grader.grade_attempt(attempt)
+    elapsed = time.perf_counter() - started
+    gradings = rounds * sum(len(attempt) for attempt in attempts)
+    print(f"{'✅' if not failures else '❌'} {len(graders)} lessons compiled in {compile_seconds * 1000:.1f} ms; "
+          f"{gradings / elapsed:,.0f} gradings/s on one core; {len(failures)} self-check failures {failures[:5]}")
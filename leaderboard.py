@@ -0,0 +1,370 @@
+# leaderboard.py
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from app_logging import log_event
+from xp_ledger import last_xp_event_id
+
+SKIPLIST_MAX_LEVELS = 24 # Plenty for ~16M users
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels  # Next node per level (None = end of list)
+        self.width = [1] * levels    # Number of positions each link skips
+
+
+class IndexableSkipList:
+    """
+    Sorted sequence of unique, comparable keys with O(log n) insert, remove,
+    positional lookup and "how many keys are smaller than X".
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._head = _Node(None, SKIPLIST_MAX_LEVELS)
+
+    def __len__(self):
+        return self.size
+
+    def _find_chain(self, key):
+        """Per level, the last node whose key is < key, and the position steps taken at that level."""
+        chain = [None] * SKIPLIST_MAX_LEVELS
+        steps_at_level = [0] * SKIPLIST_MAX_LEVELS
+        node = self._head
+        for level in reversed(range(SKIPLIST_MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps_at_level
+
+    def insert(self, key):
+        chain, steps_at_level = self._find_chain(key)
+        levels = min(SKIPLIST_MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, SKIPLIST_MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find_chain(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), SKIPLIST_MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def bisect_left(self, key):
+        """Number of keys strictly smaller than `key`."""
+        position = 0
+        node = self._head
+        for level in reversed(range(SKIPLIST_MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start, stop):
+        """Keys at positions [start, stop)."""
+        start = max(0, start)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        # Walk down to the node at `start`, then along the bottom level
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(SKIPLIST_MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """
+    In-memory XP leaderboard ordered by (-xp, fullname, email), matching
+    `RANK() OVER (ORDER BY xp DESC)` with ties listed by fullname.
+    Top-N, a user's rank and the users around them are O(log n) (+ the size of the result).
+
+    Each worker process keeps its own copy, updated by the routes that change XP/names. Every
+    `refresh_seconds` a background thread catches up with other processes' XP: it re-reads the
+    users that xp_events rows past the last one it saw belong to, and does nothing when the
+    sequence hasn't moved. The whole ranking is rebuilt from the users table on a cold start, when
+    events it hasn't seen were deleted (account deletion, compaction), and every
+    `rebuild_seconds` to pick up other processes' renames and deletions. Requests never rebuild
+    it: until the first build is done, `ready` is False and callers use top_from_sql()/rank_from_sql().
+
+    Builds and catch-ups read in one snapshot together with the xp_events sequence at that point.
+    Updates made meanwhile are journaled and replayed on top; XP deltas carry the xp_events id of
+    their transaction (see xp_ledger.last_xp_event_id), so those already in a snapshot are not
+    counted twice, whether they arrive during the read or after it.
+    """
+
+    def __init__(self, profile_color, pool, refresh_seconds=60, rebuild_seconds=3600):
+        self._profile_color = profile_color
+        self.pool = pool
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._lock = threading.Lock()
+        self._ranking = IndexableSkipList()
+        self._entries = {}         # email -> (sort key, display dict without rank)
+        self._journal = None       # (method, args, xp event id) applied while a build/catch-up reads, else None
+        self._seen_event_id = 0    # xp_events id the ranking is complete up to
+        self._built_event_id = 0   # ... as of the last full rebuild: older deltas are in every entry
+        self._entry_event_ids = {} # email -> xp_events id its entry was last re-read at (since the last rebuild)
+        self._refresher_pid = None
+        self.built_at = None
+        self.last_rebuild_seconds = None
+        self.last_catch_up_seconds = None
+        self.rebuild_failures = 0
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    def _make_entry(self, email, fullname, xp):
+        display_name = fullname or email
+        display = {
+            "email": email,
+            "fullname": fullname,
+            "xp": xp,
+            "profile_color": self._profile_color(display_name), # Computed once per name, not per page view
+            "initial": (display_name[0] if display_name else '?').upper(),
+        }
+        return (-xp, fullname or "", email), display
+
+    # --- Building ---
+
+    def rebuild(self, conn):
+        """Rebuilds the whole ranking from the users table (refresher thread only; takes seconds at 100k+ users)."""
+        started = time.perf_counter()
+        with self._lock:
+            self._journal = []
+        try:
+            conn.execute("BEGIN") # One read snapshot for the sequence and the rows
+            snapshot_event_id = last_xp_event_id(conn)
+            rows = conn.execute("SELECT email, fullname, xp FROM users").fetchall()
+            conn.rollback()
+            ranking = IndexableSkipList()
+            entries = {}
+            for row in rows:
+                key, display = self._make_entry(row["email"], row["fullname"], row["xp"] or 0)
+                ranking.insert(key)
+                entries[row["email"]] = (key, display)
+            with self._lock:
+                for method, args, event_id in self._journal:
+                    if event_id is not None and event_id <= snapshot_event_id:
+                        continue # Committed before the snapshot: already in the rows
+                    method(ranking, entries, *args)
+                self._ranking, self._entries = ranking, entries
+                self._seen_event_id = self._built_event_id = snapshot_event_id
+                self._entry_event_ids = {}
+                self.built_at = time.monotonic()
+                self.last_rebuild_seconds = time.perf_counter() - started
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def catch_up(self, conn):
+        """
+        Applies the XP other processes added since the last build or catch-up by re-reading the users
+        their new xp_events belong to (refresher thread only). Returns False, changing nothing, when
+        some of those events are gone and only a rebuild can tell what changed.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._journal = [] # Local updates from here on may or may not be in the rows read below
+        try:
+            conn.execute("BEGIN") # One read snapshot for the sequence and the rows
+            try:
+                snapshot_event_id = last_xp_event_id(conn)
+                seen_event_id = self._seen_event_id
+                if snapshot_event_id == seen_event_id:
+                    return True
+                present = conn.execute("SELECT COUNT(*) FROM xp_events WHERE id > ? AND id <= ?",
+                                       (seen_event_id, snapshot_event_id)).fetchone()[0]
+                if present != snapshot_event_id - seen_event_id: # Ids are never reused, so a gap means deleted events
+                    return False
+                rows = conn.execute(
+                    """SELECT changed.user_email AS email, u.email IS NOT NULL AS present, u.fullname, u.xp
+                       FROM (SELECT DISTINCT user_email FROM xp_events WHERE id > ? AND id <= ?) changed
+                       LEFT JOIN users u ON u.email = changed.user_email""",
+                    (seen_event_id, snapshot_event_id)
+                ).fetchall()
+            finally:
+                conn.rollback()
+
+            with self._lock:
+                changed = set()
+                for row in rows:
+                    email = row["email"]
+                    changed.add(email)
+                    self._remove(self._ranking, self._entries, email)
+                    if row["present"]:
+                        self._add_xp(self._ranking, self._entries, email, row["fullname"], row["xp"] or 0)
+                        self._entry_event_ids[email] = snapshot_event_id
+                # The re-read rows replaced local updates made meanwhile; put back the ones they lack
+                for method, args, event_id in self._journal:
+                    if method == self._add_xp and (args[0] not in changed or (event_id is not None and event_id <= snapshot_event_id)):
+                        continue # Unaffected, or already in the rows
+                    method(self._ranking, self._entries, *args) # Renames and removals are idempotent
+                self._seen_event_id = snapshot_event_id
+                self.last_catch_up_seconds = time.perf_counter() - started
+            return True
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def ensure_refreshing(self):
+        """Starts the rebuild thread in this process (threads don't survive a fork, so this is re-checked per process)."""
+        if self._refresher_pid == os.getpid():
+            return
+        self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh, name="leaderboard-refresher", daemon=True).start()
+
+    def _refresh(self):
+        while True:
+            conn = self.pool.acquire()
+            try:
+                due = not self.ready or time.monotonic() - self.built_at >= self.rebuild_seconds
+                if due or not self.catch_up(conn):
+                    self.rebuild(conn)
+            except sqlite3.Error as e:
+                self.rebuild_failures += 1
+                log_event("leaderboard_rebuild_failed", logging.WARNING, error=e)
+            finally:
+                self.pool.release(conn)
+            time.sleep(self.refresh_seconds)
+
+    # --- Incremental Updates (call after the DB change is committed) ---
+
+    def _update(self, method, *args, event_id=None):
+        with self._lock:
+            if event_id is not None and event_id <= max(self._built_event_id, self._entry_event_ids.get(args[0], 0)):
+                return # Its transaction committed before a snapshot this entry was read from
+            method(self._ranking, self._entries, *args)
+            if self._journal is not None:
+                self._journal.append((method, args, event_id))
+
+    def add_xp(self, email, fullname, xp_delta, event_id=None):
+        """
+        Adds XP to a user (inserting them if unknown). Deltas commute, so concurrent requests can't
+        reorder updates. `event_id` is last_xp_event_id() read in the transaction that added the XP.
+        """
+        self._update(self._add_xp, email, fullname, xp_delta, event_id=event_id)
+
+    def rename(self, old_email, new_email, fullname):
+        """Applies a name/email change."""
+        self._update(self._rename, old_email, new_email, fullname)
+
+    def remove(self, email):
+        self._update(self._remove, email)
+
+    def _add_xp(self, ranking, entries, email, fullname, xp_delta):
+        old = entries.pop(email, None)
+        xp = xp_delta
+        if old is not None:
+            ranking.remove(old[0])
+            xp += old[1]["xp"]
+            fullname = fullname if fullname is not None else old[1]["fullname"]
+        key, display = self._make_entry(email, fullname, xp)
+        ranking.insert(key)
+        entries[email] = (key, display)
+
+    def _rename(self, ranking, entries, old_email, new_email, fullname):
+        old = entries.pop(old_email, None)
+        if old is None:
+            return
+        ranking.remove(old[0])
+        self._remove(ranking, entries, new_email) # A catch-up may have read the new email already
+        self._entry_event_ids.pop(old_email, None)
+        key, display = self._make_entry(new_email, fullname, old[1]["xp"])
+        ranking.insert(key)
+        entries[new_email] = (key, display)
+
+    def _remove(self, ranking, entries, email):
+        old = entries.pop(email, None)
+        if old is not None:
+            ranking.remove(old[0])
+
+    # --- Queries ---
+
+    def _rank_for_xp(self, xp):
+        return self._ranking.bisect_left((-xp,)) + 1 # 1 + number of users with strictly more XP
+
+    def _ranked_slice(self, start, stop):
+        keys = self._ranking.slice(start, stop)
+        result = []
+        rank = None
+        for position, key in enumerate(keys, start=max(0, start)):
+            if rank is None:
+                rank = self._rank_for_xp(-key[0])
+            elif key[0] != previous_key[0]:
+                rank = position + 1
+            previous_key = key
+            result.append({**self._entries[key[2]][1], "rank": rank})
+        return result
+
+    def top(self, limit):
+        """Top `limit` users as dicts (email, fullname, xp, rank, profile_color, initial)."""
+        with self._lock:
+            return self._ranked_slice(0, limit)
+
+    def around(self, email, radius=2):
+        """The user plus up to `radius` users on either side, or [] if unknown."""
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return []
+            position = self._ranking.bisect_left(entry[0])
+            return self._ranked_slice(position - radius, position + radius + 1)
+
+    def __len__(self):
+        return len(self._ranking)
+
+
+# --- SQL Fallback (until the in-memory ranking is first built) ---
+
+def top_from_sql(conn, limit):
+    """Top `limit` users with RANK() ties, as dicts (email, fullname, xp, rank)."""
+    rows = conn.execute(
+        """SELECT email, fullname, xp, RANK() OVER (ORDER BY xp DESC) AS rank
+           FROM users ORDER BY rank ASC, fullname ASC LIMIT ?""",
+        (limit,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def rank_from_sql(conn, email):
+    """A user's RANK()-style entry (email, fullname, xp, rank), or None if unknown."""
+    user = conn.execute("SELECT email, fullname, xp FROM users WHERE email = ?", (email,)).fetchone()
+    if user is None:
+        return None
+    ahead = conn.execute("SELECT COUNT(*) FROM users WHERE xp > ?", (user["xp"] or 0,)).fetchone()[0]
+    return {**dict(user), "rank": ahead + 1}
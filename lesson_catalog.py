@@ -0,0 +1,451 @@
+# lesson_catalog.py
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import mmap
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+
+try:
+    import brotli # Optional: enables the br variant of the lesson payloads
+except ImportError:
+    brotli = None
+
+from app_logging import log_event
+from grading import LessonGrader
+
+DEFAULT_LESSON_XP = 10
+TARGET_LANGUAGE_SUFFIX = "-English" # lessons.json keys look like "Spanish-English"
+QUESTION_TYPES = {"translation", "fill_in_blank", "multiple_choice", "matching", "sentence_transformation"}
+
+
+class CatalogValidationError(ValueError):
+    """Raised when lessons.json content is structurally invalid."""
+
+
+def validate_lessons_data(lessons_data):
+    """Checks the structure of parsed lessons.json content. Raises CatalogValidationError."""
+    if not isinstance(lessons_data, dict) or not lessons_data:
+        raise CatalogValidationError("Top level must be a non-empty object of '<Language>-English' keys")
+
+    for lang_key, lessons in lessons_data.items():
+        if not isinstance(lang_key, str) or not lang_key.endswith(TARGET_LANGUAGE_SUFFIX):
+            raise CatalogValidationError(f"Invalid language key: {lang_key!r}")
+        if not isinstance(lessons, list) or not lessons:
+            raise CatalogValidationError(f"{lang_key}: expected a non-empty list of lessons")
+
+        seen_ids = set()
+        for lesson in lessons:
+            lesson_id = lesson.get("lesson") if isinstance(lesson, dict) else None
+            if not isinstance(lesson_id, int) or isinstance(lesson_id, bool):
+                raise CatalogValidationError(f"{lang_key}: every lesson needs an integer 'lesson' id")
+            where = f"{lang_key} lesson {lesson_id}"
+            if lesson_id in seen_ids:
+                raise CatalogValidationError(f"{where}: duplicate lesson id")
+            seen_ids.add(lesson_id)
+            if not isinstance(lesson.get("title"), str):
+                raise CatalogValidationError(f"{where}: missing 'title'")
+            if not isinstance(lesson.get("xp", DEFAULT_LESSON_XP), int):
+                raise CatalogValidationError(f"{where}: 'xp' must be an integer")
+            questions = lesson.get("questions")
+            if not isinstance(questions, list) or not questions:
+                raise CatalogValidationError(f"{where}: expected a non-empty 'questions' list")
+
+            for number, question in enumerate(questions, start=1):
+                q_type = question.get("type") if isinstance(question, dict) else None
+                if q_type not in QUESTION_TYPES:
+                    raise CatalogValidationError(f"{where} question {number}: unknown type {q_type!r}")
+                if q_type == "matching":
+                    if not isinstance(question.get("pairs"), dict) or not question["pairs"]:
+                        raise CatalogValidationError(f"{where} question {number}: 'matching' needs 'pairs'")
+                    continue
+                if not isinstance(question.get("question"), str) or not isinstance(question.get("answer"), str):
+                    raise CatalogValidationError(f"{where} question {number}: needs 'question' and 'answer' strings")
+                if q_type == "multiple_choice" and question["answer"] not in question.get("options", []):
+                    raise CatalogValidationError(f"{where} question {number}: answer is not one of the options")
+                accept = question.get("accept", [])
+                if not isinstance(accept, list) or not all(isinstance(text, str) for text in accept):
+                    raise CatalogValidationError(f"{where} question {number}: 'accept' must be a list of strings")
+
+
+class LessonCatalog:
+    """
+    Indexed view of lessons.json, built once at load time.
+    - O(1) lookup of a lesson by (language, lesson_id)
+    - Precomputed XP table per language
+    - Per-language summaries (id, title, XP) for lesson lists that don't need the questions
+    - Each language's summaries pre-serialized as JSON bytes (+ gzip/brotli copies) with a content hash:
+      the lesson list clients get, which carries no questions (and so no answers)
+    - Each lesson's questions compiled into answer matchers (see grading.py)
+    Treat instances as read-only; build a new catalog to change content.
+    """
+
+    def __init__(self, lessons_data):
+        self.languages = []       # In file order, e.g. ["Spanish", "German", ...]
+        self._lessons = {}        # language -> list of lesson dicts
+        self._index = {}          # (language, lesson_id) -> lesson dict
+        self._graders = {}        # (language, lesson_id) -> LessonGrader
+        self._xp = {}             # language -> {lesson_id: xp}
+        self._summaries = {}      # language -> [{"lesson", "title", "xp"}] in file order
+        self._json = {}           # language -> JSON bytes of the lesson summaries
+        self._gzip = {}           # language -> gzip-compressed JSON bytes
+        self._brotli = {}         # language -> brotli-compressed JSON bytes (only if brotli is installed)
+        self._hashes = {}         # language -> content hash of the JSON bytes
+        self.lesson_count = 0
+        self.size_bytes = 0       # Total size of the serialized lesson lists
+
+        for lang_key, lessons in lessons_data.items():
+            language = lang_key.split('-')[0]
+            self.languages.append(language)
+            self._lessons[language] = lessons
+            self._xp[language] = {}
+            self._summaries[language] = []
+            for lesson in lessons:
+                lesson_id = lesson.get("lesson")
+                self._index[(language, lesson_id)] = lesson
+                self._graders[(language, lesson_id)] = LessonGrader(lesson)
+                self._xp[language][lesson_id] = lesson.get("xp", DEFAULT_LESSON_XP)
+                self._summaries[language].append({"lesson": lesson_id, "title": lesson.get("title"),
+                                                  "xp": self._xp[language][lesson_id]})
+
+            body = json.dumps(self._summaries[language], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self._json[language] = body
+            self._gzip[language] = gzip.compress(body, compresslevel=9, mtime=0) # mtime=0 keeps output deterministic
+            if brotli is not None:
+                self._brotli[language] = brotli.compress(body, quality=11)
+            self._hashes[language] = hashlib.sha256(body).hexdigest()[:20]
+            self.lesson_count += len(lessons)
+            self.size_bytes += len(body)
+
+        # Hash of the whole catalog, changes whenever any language's content does
+        combined = hashlib.sha256()
+        for language in sorted(self._hashes):
+            combined.update(f"{language}:{self._hashes[language]};".encode("utf-8"))
+        self.version = combined.hexdigest()[:20]
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads, validates and indexes a lessons.json file. Raises on missing/invalid files."""
+        with open(path, "r", encoding="utf-8") as file:
+            lessons_data = json.load(file)
+        validate_lessons_data(lessons_data)
+        return cls(lessons_data)
+
+    def __contains__(self, language):
+        return language in self._lessons
+
+    def lessons(self, language):
+        """Lesson list for a language (empty if unknown)."""
+        return self._lessons.get(language, [])
+
+    def lesson_summaries(self, language):
+        """Lesson ids, titles and XP for a language, in order (empty if unknown)."""
+        return self._summaries.get(language, [])
+
+    def get_lesson(self, language, lesson_id):
+        """Single lesson by id, or None."""
+        return self._index.get((language, lesson_id))
+
+    def lesson_xp(self, language, lesson_id):
+        """XP awarded for a lesson (DEFAULT_LESSON_XP if the lesson has none)."""
+        return self._xp.get(language, {}).get(lesson_id, DEFAULT_LESSON_XP)
+
+    def xp_table(self, language):
+        """{lesson_id: xp} for every lesson of a language (empty if unknown)."""
+        return dict(self._xp.get(language, {}))
+
+    def lesson_grader(self, language, lesson_id):
+        """Compiled answer matchers for a lesson, or None."""
+        return self._graders.get((language, lesson_id))
+
+    def lessons_json(self, language):
+        """Ready-to-send JSON bytes of a language's lesson summaries, or None if unknown."""
+        return self._json.get(language)
+
+    def lessons_gzip(self, language):
+        """Gzip-compressed copy of lessons_json(language), or None if unknown."""
+        return self._gzip.get(language)
+
+    def lessons_brotli(self, language):
+        """Brotli-compressed copy of lessons_json(language), or None if unknown or brotli isn't installed."""
+        return self._brotli.get(language)
+
+    def content_hash(self, language):
+        """Content hash of lessons_json(language), or None if unknown."""
+        return self._hashes.get(language)
+
+
+# --- Compiled Catalog ---
+# Build step: `python lesson_catalog.py lessons.json lessons.bin` validates the JSON and writes
+#   MAGIC (8 bytes) | index length (u32 LE) | index JSON | data blobs
+# The index holds, per language, (offset, length) spans into the data section for the
+# serialized lesson summaries, their gzip (and, if brotli was installed at build time, br) copies and
+# every single lesson, plus the XP table and the lesson summaries.
+# The app memory-maps the file, so forked workers share its pages and lessons are
+# only decoded when accessed.
+COMPILED_MAGIC = b"LLCAT\x00\x01\x00"
+LESSON_CACHE_SIZE = 256 # Decoded single lessons (and their graders) kept per compiled catalog, least recently used dropped
+
+
+def compile_catalog(source_path, dest_path):
+    """Validates `source_path` (lessons.json) and writes the compiled artifact atomically. Returns the catalog version."""
+    catalog = LessonCatalog.from_file(source_path)
+    blobs = bytearray()
+
+    def add_blob(data):
+        span = [len(blobs), len(data)]
+        blobs.extend(data)
+        return span
+
+    languages = []
+    for language in catalog.languages:
+        lessons = {}
+        for lesson in catalog.lessons(language):
+            body = json.dumps(lesson, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            lessons[str(lesson["lesson"])] = add_blob(body)
+        languages.append({
+            "language": language,
+            "hash": catalog.content_hash(language),
+            "count": len(catalog.lessons(language)),
+            "lessons_json": add_blob(catalog.lessons_json(language)),
+            "lessons_gzip": add_blob(catalog.lessons_gzip(language)),
+            "lessons_br": add_blob(catalog.lessons_brotli(language)) if brotli is not None else None,
+            "lessons": lessons,
+            "xp": {str(lesson_id): xp for lesson_id, xp in catalog.xp_table(language).items()},
+            "summaries": catalog.lesson_summaries(language),
+        })
+
+    index = json.dumps({"version": catalog.version, "size_bytes": catalog.size_bytes, "languages": languages},
+                       separators=(",", ":")).encode("utf-8")
+    tmp_path = f"{dest_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(COMPILED_MAGIC)
+        file.write(struct.pack("<I", len(index)))
+        file.write(index)
+        file.write(blobs)
+    os.replace(tmp_path, dest_path) # Readers mapping the old file keep the old inode
+    return catalog.version
+
+
+class CompiledLessonCatalog:
+    """
+    Read-only LessonCatalog backed by a memory-mapped compiled artifact.
+    Same interface as LessonCatalog. Only the index stays decoded; single lessons are decoded
+    on access into a small LRU, and whole lesson lists are never kept (pages use the summaries).
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mm[:len(COMPILED_MAGIC)] != COMPILED_MAGIC:
+                raise CatalogValidationError(f"{path} is not a compiled lesson catalog")
+            (index_length,) = struct.unpack_from("<I", self._mm, len(COMPILED_MAGIC))
+            index_start = len(COMPILED_MAGIC) + 4
+            index = json.loads(self._mm[index_start:index_start + index_length])
+            self._base = index_start + index_length
+
+            self.version = index["version"]
+            self.size_bytes = index["size_bytes"]
+            self.languages = [entry["language"] for entry in index["languages"]]
+            self.lesson_count = sum(entry["count"] for entry in index["languages"])
+            self._entries = {}
+            for entry in index["languages"]:
+                entry["lessons"] = {int(lesson_id): span for lesson_id, span in entry["lessons"].items()}
+                entry["xp"] = {int(lesson_id): xp for lesson_id, xp in entry["xp"].items()}
+                self._entries[entry["language"]] = entry
+            for entry in self._entries.values():
+                if "summaries" not in entry: # Artifact built before summaries were added
+                    entry["summaries"] = [self._summary(entry, lesson_id) for lesson_id in entry["lessons"]]
+        except (struct.error, ValueError, KeyError, TypeError, AttributeError) as e: # ValueError covers bad JSON and UTF-8
+            raise CatalogValidationError(f"{path}: corrupt compiled catalog ({e!r})")
+        # Per instance, so a reload starts cold and the old catalog's entries go with it
+        self._cached_lesson = functools.lru_cache(maxsize=LESSON_CACHE_SIZE)(self._decode_lesson)
+        self._cached_grader = functools.lru_cache(maxsize=LESSON_CACHE_SIZE)(self._compile_grader)
+
+    def _blob(self, span):
+        offset, length = span
+        start = self._base + offset
+        return self._mm[start:start + length]
+
+    def __contains__(self, language):
+        return language in self._entries
+
+    def _summary(self, entry, lesson_id):
+        lesson = json.loads(self._blob(entry["lessons"][lesson_id]))
+        return {"lesson": lesson_id, "title": lesson.get("title"), "xp": entry["xp"].get(lesson_id, DEFAULT_LESSON_XP)}
+
+    def lessons(self, language):
+        """Lesson list for a language (empty if unknown). Decoded on every call and not kept."""
+        entry = self._entries.get(language)
+        return [json.loads(self._blob(span)) for span in entry["lessons"].values()] if entry else []
+
+    def lesson_summaries(self, language):
+        """Lesson ids, titles and XP for a language, in order (empty if unknown)."""
+        entry = self._entries.get(language)
+        return entry["summaries"] if entry else []
+
+    def get_lesson(self, language, lesson_id):
+        """Single lesson by id, or None."""
+        return self._cached_lesson(language, lesson_id)
+
+    def _decode_lesson(self, language, lesson_id):
+        span = self._entries.get(language, {}).get("lessons", {}).get(lesson_id)
+        return json.loads(self._blob(span)) if span is not None else None
+
+    def lesson_xp(self, language, lesson_id):
+        """XP awarded for a lesson (DEFAULT_LESSON_XP if the lesson has none)."""
+        return self._entries.get(language, {}).get("xp", {}).get(lesson_id, DEFAULT_LESSON_XP)
+
+    def xp_table(self, language):
+        """{lesson_id: xp} for every lesson of a language (empty if unknown)."""
+        return dict(self._entries.get(language, {}).get("xp", {}))
+
+    def lesson_grader(self, language, lesson_id):
+        """Compiled answer matchers for a lesson, or None."""
+        return self._cached_grader(language, lesson_id)
+
+    def _compile_grader(self, language, lesson_id):
+        lesson = self.get_lesson(language, lesson_id)
+        return LessonGrader(lesson) if lesson is not None else None
+
+    def lessons_json(self, language):
+        """Ready-to-send JSON bytes of a language's lesson summaries, or None if unknown."""
+        entry = self._entries.get(language)
+        return self._blob(entry["lessons_json"]) if entry else None
+
+    def lessons_gzip(self, language):
+        """Gzip-compressed copy of lessons_json(language), or None if unknown."""
+        entry = self._entries.get(language)
+        return self._blob(entry["lessons_gzip"]) if entry else None
+
+    def lessons_brotli(self, language):
+        """Brotli-compressed copy of lessons_json(language), or None if unknown or not built."""
+        entry = self._entries.get(language)
+        return self._blob(entry["lessons_br"]) if entry and entry.get("lessons_br") else None
+
+    def content_hash(self, language):
+        """Content hash of lessons_json(language), or None if unknown."""
+        entry = self._entries.get(language)
+        return entry["hash"] if entry else None
+
+
+def load_catalog(path):
+    """Loads either a compiled artifact or a lessons.json file, detected by the file's magic bytes."""
+    with open(path, "rb") as file:
+        is_compiled = file.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+    return CompiledLessonCatalog(path) if is_compiled else LessonCatalog.from_file(path)
+
+
+class CatalogLoader:
+    """
+    Owns the current LessonCatalog and replaces it when lessons.json changes.
+    A reload parses and validates the new file first and only then swaps the
+    `catalog` reference in one assignment, so readers that grabbed the old
+    catalog keep a consistent view and a broken file never replaces a good one.
+    Reloads are triggered by mtime polling (background thread), SIGHUP, or reload().
+    `path` may be lessons.json or a compiled artifact (see compile_catalog).
+    """
+
+    def __init__(self, path, poll_interval=0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.catalog = LessonCatalog({})
+        self._reload_lock = threading.Lock()  # One reload at a time; readers never take it
+        self._mtime = None
+        self._watcher_pid = None
+        # --- Metrics ---
+        self.reload_count = 0
+        self.reload_failures = 0
+        self.last_reload_seconds = 0.0
+        self.last_reload_at = None
+        self.last_error = None
+
+    def reload(self, force=False):
+        """Reloads the file if its mtime changed (or if forced). Returns True if a new catalog was swapped in."""
+        with self._reload_lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                return self._record_failure(e)
+            if not force and mtime == self._mtime:
+                return False
+
+            started = time.perf_counter()
+            try:
+                new_catalog = load_catalog(self.path)
+            except (OSError, ValueError, KeyError, TypeError) as e: # ValueError covers JSONDecodeError and CatalogValidationError
+                self._mtime = mtime # Don't retry the same broken file on every poll
+                return self._record_failure(e)
+
+            self.catalog = new_catalog # Atomic swap
+            self._mtime = mtime
+            self.reload_count += 1
+            self.last_reload_seconds = time.perf_counter() - started
+            self.last_reload_at = time.time()
+            self.last_error = None
+            log_event("lesson_catalog_loaded", path=self.path, lessons=new_catalog.lesson_count,
+                      languages=len(new_catalog.languages), ms=round(self.last_reload_seconds * 1000, 1),
+                      version=new_catalog.version)
+            return True
+
+    def _record_failure(self, error):
+        self.reload_failures += 1
+        self.last_error = str(error)
+        log_event("lesson_catalog_load_failed", logging.ERROR, path=self.path, error=error) # The current catalog stays
+        return False
+
+    def ensure_watching(self):
+        """Starts the mtime polling thread in this process (threads don't survive a fork, so this is re-checked per process)."""
+        if self.poll_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name="lesson-catalog-watcher", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.reload()
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGHUP", None)):
+        """Reloads (off the signal handler) on SIGHUP. No-op where unsupported or outside the main thread."""
+        if signum is None:
+            return
+        def handler(_signum, _frame):
+            threading.Thread(target=self.reload, kwargs={"force": True}, daemon=True).start()
+        try:
+            signal.signal(signum, handler)
+        except ValueError: # Not in the main thread
+            pass
+
+    def stats(self):
+        """Reload and size metrics for monitoring."""
+        catalog = self.catalog
+        return {
+            "version": catalog.version,
+            "languages": len(catalog.languages),
+            "lessons": catalog.lesson_count,
+            "size_bytes": catalog.size_bytes,
+            "reload_count": self.reload_count,
+            "reload_failures": self.reload_failures,
+            "last_reload_seconds": self.last_reload_seconds,
+            "last_reload_at": self.last_reload_at,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else "lessons.json"
+    dest = sys.argv[2] if len(sys.argv) > 2 else "lessons.bin"
+    try:
+        version = compile_catalog(source, dest)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not compile {source}: {e}")
+        sys.exit(1)
+    print(f"✅ Compiled {source} -> {dest} (version {version}, {os.path.getsize(dest)} bytes)")
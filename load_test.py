@@ -0,0 +1,332 @@
+# load_test.py
+# End-to-end load test: concurrent simulated learners walk the real signup -> lesson -> leaderboard flow.
+#
+#   python load_test.py --learners 50 --iterations 5                 # in-process (Flask test client, scratch DB copy)
+#   python load_test.py --url http://127.0.0.1:5000 --learners 50    # against a running server
+#
+# Results (per-route p50/p95/p99, throughput, errors, SQL work per request from /metrics) are
+# printed and written as JSON to --output, tagged with the git commit so runs can be compared.
+# /metrics is scraped with METRICS_TOKEN (set it to the server's; in-process runs make one up).
+# Pages only carry questions, so learners answer from --lessons, which must match the server's catalog.
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from lesson_catalog import load_catalog
+
+DEFAULT_LANGUAGES = ["Spanish", "French", "German", "Japanese"]
+AJAX_HEADERS = {"X-Requested-With": "XMLHttpRequest"}
+JSON_HEADERS = {"Content-Type": "application/json"}
+METRIC_LINE = re.compile(r'^(app_\w+)\{endpoint="([^"]*)"(?:,status="(\d+)")?\} (\S+)$')
+
+
+class TestClientSession:
+    """One learner's session against the in-process app."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None, headers=None):
+        response = self._client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None # Report the 302 itself, like the test client does
+
+
+class HttpSession:
+    """One learner's session (own cookie jar) against a running server."""
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip("/")
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None, headers=None):
+        if isinstance(data, bytes):
+            body = data
+        else:
+            body = urllib.parse.urlencode(data).encode() if data is not None else (b"" if method == "POST" else None)
+        req = urllib.request.Request(self._base_url + path, data=body, headers=headers or {}, method=method)
+        try:
+            with self._opener.open(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Recorder:
+    """Thread-safe latency and status collection per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.failures = 0 # Transport errors (no HTTP status at all)
+
+    def call(self, session, route, method, path, data=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, body = session.request(method, path, data=data, headers=headers)
+        except OSError:
+            with self._lock:
+                self.failures += 1
+            return None, b""
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            route_statuses = self.statuses.setdefault(route, {})
+            route_statuses[status] = route_statuses.get(status, 0) + 1
+        return status, body
+
+
+def build_attempt(lesson, mistakes, rng):
+    """
+    Answers like lesson.js sends them: one pass over every question, then the `mistakes` missed ones
+    again. `lesson` is the full catalog entry (answers included), not what the pages serve.
+    """
+    def correct(question):
+        return question["pairs"] if question["type"] == "matching" else question["answer"]
+    questions = lesson["questions"]
+    missed = set(rng.sample(range(len(questions)), min(mistakes, len(questions))))
+    answers = [{"question": index, "answer": "wrong answer" if index in missed else correct(question)}
+               for index, question in enumerate(questions)]
+    answers += [{"question": index, "answer": correct(questions[index])} for index in sorted(missed)]
+    return answers
+
+
+def run_learner(session, recorder, answer_key, email, languages, iterations, max_heart_losses, rng):
+    """Signup, logout/login, then `iterations` rounds of dashboard -> lesson -> attempt -> leaderboard -> profile."""
+    password = "loadtest-password"
+    recorder.call(session, "signup", "POST", "/signup", data={"fullname": email.split("@")[0], "email": email, "password": password})
+    recorder.call(session, "logout", "GET", "/logout") # Signup logs the learner in; exercise the real login too
+    recorder.call(session, "login", "POST", "/login", data={"email": email, "password": password})
+
+    lesson_cache = {} # lessons_url -> {lesson id: summary}, like the browser's cache of the immutable URL
+    for _ in range(iterations):
+        lang = rng.choice(languages)
+        recorder.call(session, "dashboard", "GET", f"/dashboard?lang={lang}")
+        # Same two-step load as dashboard.js: user state, then the (immutable, browser-cached) lesson list
+        status, body = recorder.call(session, "dashboard_ajax", "GET", f"/dashboard?lang={lang}&lessons=0", headers=AJAX_HEADERS)
+        lessons, completed = {}, []
+        if status == 200:
+            payload = json.loads(body)
+            completed = payload.get("completed", [])
+            lessons_url = payload.get("lessons_url")
+            if lessons_url and lessons_url not in lesson_cache:
+                status, body = recorder.call(session, "lesson_content", "GET", lessons_url)
+                if status == 200:
+                    lesson_cache[lessons_url] = {lesson["lesson"]: lesson for lesson in json.loads(body)}
+            lessons = lesson_cache.get(lessons_url) or lessons
+        if not lessons:
+            continue
+        pending = [lesson_id for lesson_id in lessons if lesson_id not in completed]
+        lesson_id = pending[0] if pending else rng.choice(list(lessons))
+        lesson = answer_key.get_lesson(lang, lesson_id)
+        if lesson is None: # --lessons doesn't match the server's catalog
+            continue
+
+        recorder.call(session, "lesson", "GET", f"/lesson/{lesson_id}?lang={lang}")
+        attempt = {
+            "attempt_id": f"{rng.getrandbits(128):032x}",
+            "answers": build_attempt(lesson, rng.randint(0, max_heart_losses), rng),
+            "duration_ms": rng.randint(30000, 300000),
+        }
+        recorder.call(session, "lesson_attempt", "POST", f"/lesson/{lesson_id}/attempt?lang={lang}",
+                      data=json.dumps(attempt).encode(), headers=JSON_HEADERS)
+        recorder.call(session, "leaderboard", "GET", "/leaderboard")
+        recorder.call(session, "profile", "GET", "/profile")
+
+
+def scrape_metrics(session):
+    """Per-endpoint counters from /metrics: {endpoint: {metric: value}} (status counts keyed 'status_<code>')."""
+    status, body = session.request("GET", "/metrics", headers={"Authorization": f"Bearer {os.getenv('METRICS_TOKEN', '')}"})
+    counters = {}
+    if status != 200:
+        print(f"⚠️ /metrics answered {status}; server-side SQL numbers are left out (is METRICS_TOKEN set?)")
+        return counters
+    for line in body.decode("utf-8").splitlines():
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, endpoint, status_code, value = match.groups()
+        if name == "app_requests_total":
+            name = f"status_{status_code}"
+        elif name not in ("app_sql_queries_total", "app_sql_rows_total", "app_sql_seconds_total",
+                          "app_sql_lock_errors_total", "app_request_duration_seconds_count"):
+            continue
+        counters.setdefault(endpoint, {})[name] = float(value)
+    return counters
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(recorder, duration, before, after):
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+        routes[route] = {
+            "count": len(ordered),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+            "statuses": {str(code): count for code, count in sorted(recorder.statuses[route].items())},
+        }
+
+    server = {}
+    for endpoint, values in sorted(after.items()):
+        delta = {name: value - before.get(endpoint, {}).get(name, 0) for name, value in values.items()}
+        requests = delta.get("app_request_duration_seconds_count", 0)
+        if requests <= 0 or endpoint == "metrics_endpoint":
+            continue
+        server[endpoint] = {
+            "requests": int(requests),
+            "sql_queries_per_request": round(delta.get("app_sql_queries_total", 0) / requests, 2),
+            "sql_rows_per_request": round(delta.get("app_sql_rows_total", 0) / requests, 2),
+            "sql_ms_per_request": round(delta.get("app_sql_seconds_total", 0) * 1000 / requests, 3),
+            "sql_lock_errors": int(delta.get("app_sql_lock_errors_total", 0)),
+            "statuses": {name[len("status_"):]: int(value) for name, value in delta.items() if name.startswith("status_") and value},
+        }
+
+    total_requests = sum(route["count"] for route in routes.values())
+    server_errors = sum(count for statuses in recorder.statuses.values() for code, count in statuses.items() if code >= 500)
+    return {
+        "duration_seconds": round(duration, 3),
+        "requests": total_requests,
+        "throughput_rps": round(total_requests / duration, 2) if duration > 0 else None,
+        "errors": {
+            "http_5xx": server_errors,
+            "transport": recorder.failures,
+            "sqlite_lock": sum(endpoint["sql_lock_errors"] for endpoint in server.values()),
+        },
+        "routes": routes,
+        "server": server,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_in_process_app(source_database):
+    """Imports the app against a scratch copy of the database so the real one is never written."""
+    scratch_dir = tempfile.mkdtemp(prefix="loadtest-")
+    scratch_database = os.path.join(scratch_dir, "database.db")
+    if os.path.exists(source_database):
+        shutil.copy(source_database, scratch_database)
+    os.environ["DATABASE"] = scratch_database
+    os.environ.setdefault("LOG_LEVEL", "WARNING") # Keep per-request log lines out of the timings
+    os.environ.setdefault("METRICS_TOKEN", secrets.token_hex(16)) # Read by the app at import, sent by scrape_metrics
+    from database import init_db
+    init_db()
+    from app_test import app
+    return app, scratch_dir
+
+
+def print_report(results):
+    print(f"\n{results['requests']} requests in {results['duration_seconds']}s -> {results['throughput_rps']} req/s "
+          f"(5xx: {results['errors']['http_5xx']}, transport: {results['errors']['transport']}, "
+          f"SQLite lock: {results['errors']['sqlite_lock']})")
+    print(f"{'route':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for route, stats in results["routes"].items():
+        print(f"{route:<16}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+              f"{stats['max_ms']:>10}  {stats['statuses']}")
+    if results["server"]:
+        print(f"\n{'endpoint':<22}{'requests':>9}{'queries/req':>13}{'rows/req':>10}{'sql ms/req':>12}{'locks':>7}")
+        for endpoint, stats in results["server"].items():
+            print(f"{endpoint:<22}{stats['requests']:>9}{stats['sql_queries_per_request']:>13}"
+                  f"{stats['sql_rows_per_request']:>10}{stats['sql_ms_per_request']:>12}{stats['sql_lock_errors']:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the learner journey with concurrent simulated users.")
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process test client)")
+    parser.add_argument("--database", default=os.getenv("DATABASE", "database.db"),
+                        help="In-process mode: database copied to a scratch location before the run")
+    parser.add_argument("--lessons", default=os.getenv("LESSONS_FILE", "lessons.json"),
+                        help="Lesson catalog (lessons.json or a compiled lessons.bin) the learners answer from")
+    parser.add_argument("--learners", type=int, default=20, help="Simulated learners (one session each)")
+    parser.add_argument("--concurrency", type=int, default=None, help="Learners running at once (default: all)")
+    parser.add_argument("--iterations", type=int, default=3, help="Lesson rounds per learner")
+    parser.add_argument("--max-heart-losses", type=int, default=3, help="Upper bound of wrong answers per lesson attempt")
+    parser.add_argument("--languages", default=",".join(DEFAULT_LANGUAGES))
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="load_test_results.json", help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    answer_key = load_catalog(args.lessons)
+    scratch_dir = None
+    if args.url:
+        make_session = lambda: HttpSession(args.url)
+        mode = "http"
+    else:
+        app, scratch_dir = prepare_in_process_app(args.database)
+        make_session = lambda: TestClientSession(app)
+        mode = "in-process"
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    languages = [lang.strip() for lang in args.languages.split(",") if lang.strip()]
+    run_id = f"{int(time.time())}-{seed}"
+    recorder = Recorder()
+    metrics_session = make_session()
+    before = scrape_metrics(metrics_session)
+
+    def learner(index):
+        run_learner(make_session(), recorder, answer_key, f"loadtest-{run_id}-{index}@example.com", languages,
+                    args.iterations, args.max_heart_losses, random.Random(seed + index))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency or args.learners) as executor:
+        list(executor.map(learner, range(args.learners)))
+    duration = time.perf_counter() - started
+
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "mode": mode,
+        "config": {"url": args.url, "learners": args.learners, "concurrency": args.concurrency or args.learners,
+                   "iterations": args.iterations, "max_heart_losses": args.max_heart_losses,
+                   "languages": languages, "seed": seed},
+        **summarize(recorder, duration, before, scrape_metrics(metrics_session)),
+    }
+    print_report(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+    if scratch_dir:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return 0 if results["errors"]["http_5xx"] == 0 and results["errors"]["transport"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
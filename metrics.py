@@ -0,0 +1,203 @@
+# metrics.py
+# Per-endpoint request and SQL metrics, rendered in the Prometheus text exposition format.
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # Seconds
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55) # SQL statements per request
+
+
+class QueryStats:
+    """SQL work done by one request: statements, rows fetched/changed, time spent in SQLite and lock errors."""
+    __slots__ = ("queries", "rows", "seconds", "lock_errors")
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.lock_errors = 0
+
+
+def _is_lock_error(error):
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that reports to its connection's `query_stats` (a no-op attribute check when unset)."""
+
+    def execute(self, sql, parameters=()):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e): # "database is locked" after busy_timeout expired
+                stats.lock_errors += 1
+            raise
+        finally:
+            stats.queries += 1
+            stats.seconds += time.perf_counter() - started
+            if self.rowcount > 0: # Rows changed by INSERT/UPDATE/DELETE
+                stats.rows += self.rowcount
+
+    def executemany(self, sql, seq_of_parameters):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e): # "database is locked" after busy_timeout expired
+                stats.lock_errors += 1
+            raise
+        finally:
+            stats.queries += 1
+            stats.seconds += time.perf_counter() - started
+            if self.rowcount > 0:
+                stats.rows += self.rowcount
+
+    def _fetch(self, fetch, *args):
+        stats = self.connection.query_stats
+        if stats is None:
+            return fetch(*args)
+        started = time.perf_counter() # SQLite steps lazily, so fetching is query time too
+        result = fetch(*args)
+        stats.seconds += time.perf_counter() - started
+        if isinstance(result, list):
+            stats.rows += len(result)
+        elif result is not None:
+            stats.rows += 1
+        return result
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection factory whose cursors feed `query_stats` while it is set.
+    Connection.execute() doesn't go through cursor() in C, so it is routed explicitly.
+    """
+    query_stats = None
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class _EndpointMetrics:
+    __slots__ = ("latency_buckets", "latency_sum", "statuses", "sql_queries", "sql_rows", "sql_seconds", "sql_lock_errors",
+                 "query_buckets")
+
+    def __init__(self):
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1) # Last slot is +Inf
+        self.latency_sum = 0.0
+        self.statuses = {}
+        self.sql_queries = 0
+        self.sql_rows = 0
+        self.sql_seconds = 0.0
+        self.sql_lock_errors = 0
+        self.query_buckets = [0] * (len(QUERY_COUNT_BUCKETS) + 1)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestMetrics:
+    """
+    Fixed-bucket histograms and counters keyed by endpoint.
+    Buckets are stored non-cumulatively so recording a request is a handful of integer
+    increments under one short lock acquisition; cumulative counts are built at scrape time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, endpoint, status, seconds, query_stats=None):
+        latency_slot = bisect_left(LATENCY_BUCKETS, seconds)
+        query_slot = bisect_left(QUERY_COUNT_BUCKETS, query_stats.queries) if query_stats is not None else None
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = _EndpointMetrics()
+            metrics.latency_buckets[latency_slot] += 1
+            metrics.latency_sum += seconds
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            if query_slot is not None:
+                metrics.sql_queries += query_stats.queries
+                metrics.sql_rows += query_stats.rows
+                metrics.sql_seconds += query_stats.seconds
+                metrics.sql_lock_errors += query_stats.lock_errors
+                metrics.query_buckets[query_slot] += 1
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(
+                (endpoint, list(m.latency_buckets), m.latency_sum, dict(m.statuses),
+                 m.sql_queries, m.sql_rows, m.sql_seconds, m.sql_lock_errors, list(m.query_buckets))
+                for endpoint, m in self._endpoints.items()
+            )
+
+    @staticmethod
+    def _histogram_lines(name, labels, bounds, buckets, total):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(bounds, buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += buckets[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {total}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+    def render(self, gauges=None):
+        """Prometheus text format. `gauges` is an optional {metric_name: (help, value)} dict."""
+        snapshot = self._snapshot()
+        families = {
+            "app_request_duration_seconds": ("histogram", "Request latency by endpoint.", []),
+            "app_requests_total": ("counter", "Requests by endpoint and status code.", []),
+            "app_sql_queries_total": ("counter", "SQL statements executed, by endpoint.", []),
+            "app_sql_rows_total": ("counter", "Rows fetched or changed by SQL statements, by endpoint.", []),
+            "app_sql_seconds_total": ("counter", "Time spent executing SQL and fetching rows, by endpoint.", []),
+            "app_sql_lock_errors_total": ("counter", "SQLite busy/locked errors, by endpoint.", []),
+            "app_sql_queries_per_request": ("histogram", "SQL statements per request, by endpoint.", []),
+        }
+        for endpoint, latency, latency_sum, statuses, queries, rows, sql_seconds, lock_errors, query_buckets in snapshot:
+            labels = f'endpoint="{_label(endpoint)}"'
+            families["app_request_duration_seconds"][2].extend(
+                self._histogram_lines("app_request_duration_seconds", labels, LATENCY_BUCKETS, latency, latency_sum))
+            for status, count in sorted(statuses.items()):
+                families["app_requests_total"][2].append(f'app_requests_total{{{labels},status="{status}"}} {count}')
+            families["app_sql_queries_total"][2].append(f"app_sql_queries_total{{{labels}}} {queries}")
+            families["app_sql_rows_total"][2].append(f"app_sql_rows_total{{{labels}}} {rows}")
+            families["app_sql_seconds_total"][2].append(f"app_sql_seconds_total{{{labels}}} {sql_seconds}")
+            families["app_sql_lock_errors_total"][2].append(f"app_sql_lock_errors_total{{{labels}}} {lock_errors}")
+            families["app_sql_queries_per_request"][2].extend(
+                self._histogram_lines("app_sql_queries_per_request", labels, QUERY_COUNT_BUCKETS, query_buckets, queries))
+
+        output = []
+        for name, (metric_type, help_text, lines) in families.items():
+            output += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", *lines]
+        for name, (help_text, value) in (gauges or {}).items():
+            output += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(output) + "\n"
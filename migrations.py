@@ -0,0 +1,445 @@
+# migrations.py
+# Numbered schema migrations, tracked with PRAGMA user_version (the number of the last one applied).
+#
+#   python database.py    # Applies pending migrations and syncs changed achievement definitions
+#
+# migrate() reads that one integer and returns straight away when it equals SCHEMA_VERSION, so
+# every worker and script can call it at startup. Each migration runs in its own BEGIN IMMEDIATE
+# transaction that also bumps user_version: an interrupted upgrade stops at the last complete
+# migration, and processes migrating concurrently apply each one exactly once.
+#
+# Released migrations are never edited or renumbered; schema changes go in a new one at the end.
+# Rebuilding a table (SQLite can't ALTER a constraint) goes through TableRebuild: rows are copied
+# in chunks, one short transaction and checkpoint each, so upgrading a large database neither holds
+# the write lock for minutes nor starts over after an interruption.
+import sqlite3
+
+REBUILD_CHUNK_ROWS = 5000 # Rows copied per TableRebuild transaction
+BUSY_TIMEOUT_SECONDS = 30 # Migrations wait this long for the write lock (e.g. behind a write-behind flush)
+USER_ROW_CHANGES_KEPT = 10000 # Newest users changes kept in user_row_changes; a process further behind drops its whole cache
+
+MIGRATIONS = [] # (version, description, step), in order; see migration()
+
+
+def migration(version, description):
+    """Registers `step(conn)` (or a TableRebuild) as migration `version`, which must be the next number."""
+    def register(step):
+        if version != len(MIGRATIONS) + 1:
+            raise ValueError(f"Migration {version} registered out of order (expected {len(MIGRATIONS) + 1})")
+        MIGRATIONS.append((version, description, step))
+        return step
+    return register
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def column_names(conn, table):
+    return [column[1] for column in conn.execute(f"PRAGMA table_info({table})")]
+
+
+class TableRebuild:
+    """
+    Migration step that recreates `table` from `create_sql` (with "{name}" for the table name),
+    filling it from the old rows. `columns` maps each new column to an SQL expression over an old
+    row, "{row}" standing for its alias (e.g. "{row}.user_email", or "'Spanish'" for a constant);
+    `keys` are the new table's primary key columns and `indexes` are re-created after the swap.
+    The rebuild only runs while `needed(conn)` is true.
+
+    prepare() copies the rows into "<table>__rebuild" in chunks of `chunk_size` by rowid, each in
+    its own transaction with a checkpoint in migration_checkpoints, and resumes from there after an
+    interruption. Triggers on the old table mirror writes made by running app processes meanwhile.
+    The migration transaction itself only copies what's left, then swaps the tables.
+    """
+
+    def __init__(self, table, create_sql, columns, keys, indexes=(), needed=None, chunk_size=REBUILD_CHUNK_ROWS):
+        self.table = table
+        self.new_table = f"{table}__rebuild"
+        self.create_sql = create_sql
+        self.columns = columns
+        self.keys = keys
+        self.indexes = indexes
+        self.needed = needed or (lambda conn: True)
+        self.chunk_size = chunk_size
+
+    def _values(self, row):
+        return ", ".join(expression.format(row=row) for expression in self.columns.values())
+
+    def _key_matches(self, row):
+        return " AND ".join(f"{key} = {self.columns[key].format(row=row)}" for key in self.keys)
+
+    def _start(self, conn):
+        """Creates the new table, mirroring triggers and checkpoint if they don't exist yet; returns the last rowid copied."""
+        conn.execute("""CREATE TABLE IF NOT EXISTS migration_checkpoints (
+                            name TEXT PRIMARY KEY,
+                            last_rowid INTEGER NOT NULL   -- Highest rowid of the old table already copied
+                        )""")
+        checkpoint = conn.execute("SELECT last_rowid FROM migration_checkpoints WHERE name = ?", (self.new_table,)).fetchone()
+        if checkpoint is not None and table_exists(conn, self.new_table):
+            return checkpoint[0]
+
+        new_table, columns = self.new_table, ", ".join(self.columns)
+        conn.execute(f"DROP TABLE IF EXISTS {new_table}")
+        conn.execute(self.create_sql.format(name=new_table))
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {new_table}_insert AFTER INSERT ON {self.table} BEGIN
+                             INSERT OR REPLACE INTO {new_table} ({columns}) VALUES ({self._values('NEW')});
+                         END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {new_table}_update AFTER UPDATE ON {self.table} BEGIN
+                             DELETE FROM {new_table} WHERE {self._key_matches('OLD')};
+                             INSERT OR REPLACE INTO {new_table} ({columns}) VALUES ({self._values('NEW')});
+                         END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {new_table}_delete AFTER DELETE ON {self.table} BEGIN
+                             DELETE FROM {new_table} WHERE {self._key_matches('OLD')};
+                         END""")
+        conn.execute("INSERT OR REPLACE INTO migration_checkpoints (name, last_rowid) VALUES (?, 0)", (new_table,))
+        return 0
+
+    def _copy_chunk(self, conn, last_rowid):
+        """Copies the next chunk of old rows; returns (rows copied, new checkpoint)."""
+        upper = conn.execute(f"SELECT MAX(rowid) FROM (SELECT rowid FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                             (last_rowid, self.chunk_size)).fetchone()[0]
+        if upper is None:
+            return 0, last_rowid
+        copied = conn.execute(f"""INSERT OR REPLACE INTO {self.new_table} ({', '.join(self.columns)})
+                                  SELECT {self._values(self.table)} FROM {self.table} WHERE rowid > ? AND rowid <= ?""",
+                              (last_rowid, upper)).rowcount
+        conn.execute("UPDATE migration_checkpoints SET last_rowid = ? WHERE name = ?", (upper, self.new_table))
+        return copied, upper
+
+    def prepare(self, conn, version):
+        """Copies the old rows chunk by chunk, one transaction each, until a chunk comes back short."""
+        copied_total = 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if get_schema_version(conn) >= version or not self.needed(conn):
+                    conn.rollback() # Nothing to do, or another process finished the migration meanwhile
+                    return
+                copied, last_rowid = self._copy_chunk(conn, self._start(conn))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            copied_total += copied
+            if copied:
+                print(f"    -> {self.table}: {copied_total} rows copied (rowid {last_rowid})")
+            if copied < self.chunk_size:
+                return
+
+    def __call__(self, conn):
+        """Inside the migration transaction: copies the remaining rows and swaps the new table in."""
+        if not self.needed(conn):
+            return
+        last_rowid = self._start(conn)
+        while True:
+            copied, last_rowid = self._copy_chunk(conn, last_rowid)
+            if not copied:
+                break
+        for trigger in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {self.new_table}_{trigger}")
+        conn.execute(f"DROP TABLE {self.table}")
+        conn.execute(f"ALTER TABLE {self.new_table} RENAME TO {self.table}")
+        for index_sql in self.indexes:
+            conn.execute(index_sql)
+        conn.execute("DELETE FROM migration_checkpoints WHERE name = ?", (self.new_table,))
+        violations = conn.execute(f"PRAGMA foreign_key_check({self.table})").fetchall()
+        if violations:
+            # Copied as they were (foreign keys weren't always enforced); reported, not fatal
+            print(f"⚠️ {len(violations)} '{self.table}' rows reference missing parent rows")
+
+
+# --- Migrations ---
+
+@migration(1, "Base schema (users, progress, achievements)")
+def create_base_schema(conn):
+    # Databases created before versioning already have some of these; missing pieces are added.
+    # The rows of the achievements table come from init_db's definition sync, after migrating.
+    if not table_exists(conn, "users"):
+        conn.execute("""
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fullname TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                hearts INTEGER DEFAULT 5,
+                last_heart_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Legacy, superseded by heart_anchor
+                heart_anchor INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- Epoch seconds at which `hearts` was stored
+                xp INTEGER DEFAULT 0,
+                gems INTEGER DEFAULT 50,
+                streak INTEGER DEFAULT 0,
+                last_streak_update DATE,
+                daily_progress INTEGER DEFAULT 0,
+                daily_goal INTEGER DEFAULT 10,
+                last_daily_reset DATE,
+                join_date DATE DEFAULT CURRENT_DATE
+            )
+        """)
+    else:
+        columns = column_names(conn, "users")
+        added_columns = {
+            "xp": "INTEGER DEFAULT 0",
+            "gems": "INTEGER DEFAULT 50",
+            "streak": "INTEGER DEFAULT 0",
+            "last_streak_update": "DATE",
+            "daily_progress": "INTEGER DEFAULT 0",
+            "daily_goal": "INTEGER DEFAULT 10",
+            "last_daily_reset": "DATE",
+            "hearts": "INTEGER DEFAULT 5",
+            # ADD COLUMN can't take a non-constant default; older rows show "Join date not recorded"
+            "last_heart_time": "TIMESTAMP",
+            "join_date": "DATE",
+        }
+        for column, definition in added_columns.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+        if "heart_anchor" not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN heart_anchor INTEGER")
+            # last_heart_time was written with the server's local time, hence the 'utc' modifier
+            conn.execute("""UPDATE users
+                            SET heart_anchor = COALESCE(CAST(strftime('%s', last_heart_time, 'utc') AS INTEGER),
+                                                        CAST(strftime('%s', 'now') AS INTEGER))""")
+
+    # Pre-language progress tables are rebuilt by migration 2
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS progress (
+            user_email TEXT NOT NULL,
+            lesson_id INTEGER NOT NULL,
+            language TEXT NOT NULL,
+            completed BOOLEAN DEFAULT 0,
+            PRIMARY KEY (user_email, lesson_id, language),
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS achievements (
+            achievement_key TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            icon TEXT,
+            reward_xp INTEGER DEFAULT 0,
+            reward_gems INTEGER DEFAULT 0,
+            criteria_type TEXT NOT NULL,
+            criteria_value INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            user_email TEXT NOT NULL,
+            achievement_key TEXT NOT NULL,
+            earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_email, achievement_key),
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE,
+            FOREIGN KEY (achievement_key) REFERENCES achievements(achievement_key) ON DELETE CASCADE
+        )
+    """) # Older databases' copy lacks ON UPDATE CASCADE; migration 5 rebuilds it
+
+
+migration(2, "Add progress.language (rows predating it were Spanish)")(TableRebuild(
+    "progress",
+    """CREATE TABLE {name} (
+           user_email TEXT NOT NULL,
+           lesson_id INTEGER NOT NULL,
+           language TEXT NOT NULL,
+           completed BOOLEAN DEFAULT 0,
+           PRIMARY KEY (user_email, lesson_id, language),
+           FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+       )""",
+    columns={"user_email": "{row}.user_email", "lesson_id": "{row}.lesson_id",
+             "language": "'Spanish'", "completed": "{row}.completed"},
+    keys=("user_email", "lesson_id", "language"),
+    needed=lambda conn: "language" not in column_names(conn, "progress"),
+))
+
+
+@migration(3, "Recover progress rows stranded in 'old_progress' by the unversioned language migration")
+def recover_old_progress(conn):
+    # The pre-versioning init_db renamed progress to old_progress, then failed to create the new table
+    if not table_exists(conn, "old_progress"):
+        return
+    language = "language" if "language" in column_names(conn, "old_progress") else "'Spanish'"
+    recovered = conn.execute(f"""INSERT OR IGNORE INTO progress (user_email, lesson_id, language, completed)
+                                 SELECT user_email, lesson_id, {language}, completed FROM old_progress""").rowcount
+    conn.execute("DROP TABLE old_progress")
+    if recovered and table_exists(conn, "user_stats"):
+        print(f"⚠️ Recovered {recovered} progress rows; run `python user_stats.py` to recount lessons")
+
+
+@migration(4, "Denormalized lesson counters (see user_stats.py)")
+def create_user_stats(conn):
+    if table_exists(conn, "user_stats"):
+        return
+    conn.execute("""
+        CREATE TABLE user_stats (
+            user_email TEXT PRIMARY KEY,
+            lessons_completed INTEGER NOT NULL DEFAULT 0,   -- Distinct (lesson, language) pairs completed
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE user_language_stats (
+            user_email TEXT NOT NULL,
+            language TEXT NOT NULL,
+            lessons_completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, language),
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    # Backfill from existing progress rows (same set-wise queries as user_stats.repair_user_stats)
+    conn.execute("""INSERT INTO user_stats (user_email, lessons_completed)
+                    SELECT user_email, COUNT(*) FROM progress WHERE completed = 1 GROUP BY user_email""")
+    conn.execute("""INSERT INTO user_language_stats (user_email, language, lessons_completed)
+                    SELECT user_email, language, COUNT(*) FROM progress WHERE completed = 1 GROUP BY user_email, language""")
+
+
+def _email_update_cascades(conn, table):
+    return any(fk[2] == "users" and fk[3] == "user_email" and fk[5] == "CASCADE"
+               for fk in conn.execute(f"PRAGMA foreign_key_list({table})"))
+
+
+migration(5, "user_achievements follows email changes (ON UPDATE CASCADE)")(TableRebuild(
+    "user_achievements",
+    """CREATE TABLE {name} (
+           user_email TEXT NOT NULL,
+           achievement_key TEXT NOT NULL,
+           earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (user_email, achievement_key),
+           FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE,
+           FOREIGN KEY (achievement_key) REFERENCES achievements(achievement_key) ON DELETE CASCADE
+       )""",
+    columns={"user_email": "{row}.user_email", "achievement_key": "{row}.achievement_key",
+             "earned_at": "{row}.earned_at"},
+    keys=("user_email", "achievement_key"),
+    needed=lambda conn: not _email_update_cascades(conn, "user_achievements"),
+))
+
+
+
+@migration(6, "Digest of the synced achievement definitions (see database.init_db)")
+def create_definition_digests(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS definition_digests (
+            name TEXT PRIMARY KEY,                          -- e.g. 'achievements'
+            digest TEXT NOT NULL                            -- definitions_digest() of the last sync
+        )
+    """)
+
+
+@migration(7, "Log of changed users rows, for other processes' user caches (see user_cache.UserChangeFeed)")
+def create_user_row_changes(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_row_changes (
+            seq INTEGER PRIMARY KEY,                        -- Ascending; old entries are pruned as new ones arrive
+            email TEXT NOT NULL                             -- Row changed or deleted (its old email for an email change)
+        )
+    """)
+    # Triggers so every writer is covered, offline scripts included
+    for event in ("UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS users_{event.lower()}_logged AFTER {event} ON users BEGIN
+                INSERT INTO user_row_changes (email) VALUES (OLD.email);
+                DELETE FROM user_row_changes WHERE seq <= last_insert_rowid() - {USER_ROW_CHANGES_KEPT};
+            END
+        """)
+
+
+# Migration 1 used to create the tables of migrations 8-10 as well, so databases it ran on already have them
+
+@migration(8, "XP ledger: raw XP events and week/month totals (see xp_ledger.py)")
+def create_xp_ledger(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS xp_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            source TEXT NOT NULL,               -- e.g. 'lesson:Spanish:3', 'achievement:LESSONS_1'
+            created_at INTEGER NOT NULL,        -- Epoch seconds
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_created_at ON xp_events (created_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS xp_period_totals (
+            period TEXT NOT NULL,               -- ISO week ('2026-W42') or month ('2026-10')
+            user_email TEXT NOT NULL,
+            xp INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, user_email),
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_xp_period_totals_rank ON xp_period_totals (period, xp DESC)")
+
+
+@migration(9, "Achievement backfill checkpoints (see achievements.backfill_achievements)")
+def create_achievement_backfill_progress(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS achievement_backfill_progress (
+            achievement_key TEXT PRIMARY KEY,
+            criteria TEXT NOT NULL,          -- Criteria the checkpoint was made for; a change restarts the scan
+            last_user_id INTEGER NOT NULL    -- Highest users.rowid already evaluated
+        )
+    """)
+
+
+@migration(10, "Idempotency keys for /lesson/<id>/attempt")
+def create_lesson_attempts(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lesson_attempts (
+            user_email TEXT NOT NULL,
+            attempt_id TEXT NOT NULL,        -- Client-generated idempotency key
+            lesson_id INTEGER NOT NULL,
+            language TEXT NOT NULL,
+            completed BOOLEAN NOT NULL,
+            duration_ms INTEGER,
+            response TEXT NOT NULL,          -- JSON returned for the attempt, replayed to retries
+            created_at INTEGER NOT NULL,     -- Epoch seconds
+            PRIMARY KEY (user_email, attempt_id),
+            FOREIGN KEY (user_email) REFERENCES users(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(database):
+    """
+    Brings `database` to SCHEMA_VERSION and returns the numbers of the migrations applied.
+    When it's already current this is one PRAGMA read. Raises RuntimeError for a database
+    migrated by newer code.
+    """
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+    try:
+        version = get_schema_version(conn)
+        if version == SCHEMA_VERSION:
+            return []
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than this code's ({SCHEMA_VERSION})")
+
+        # Rebuilds drop and rename tables other tables point at; foreign keys are checked per table instead
+        conn.execute("PRAGMA foreign_keys = OFF")
+        applied = []
+        for number, description, step in MIGRATIONS[version:]:
+            print(f"📌 Applying migration {number}: {description}...")
+            if hasattr(step, "prepare"):
+                step.prepare(conn, number)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if get_schema_version(conn) >= number:
+                    conn.rollback() # Applied by another process while we waited for the lock
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            applied.append(number)
+        return applied
+    finally:
+        conn.close()
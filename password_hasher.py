@@ -0,0 +1,125 @@
+# password_hasher.py
+# Password hashing off the request threads: scrypt/pbkdf2 run in a small process pool, so a burst
+# of logins costs CPU on those processes only and never holds the GIL other requests need.
+#
+# The pool is bounded: at most `workers` hashes run and `max_queue` more wait; beyond that calls
+# fail fast with HasherBusy (routes answer 503 + Retry-After) instead of piling up behind a login
+# storm. `method` is a Werkzeug method string ("scrypt:32768:8:1", "pbkdf2:sha256:1000000", ...);
+# hashes made with any other method still verify and are flagged by needs_rehash().
+#
+# Pool processes are started by a fork server (or spawned where there is none), never forked from
+# the app process: a fork copies whatever locks its other threads held at that moment.
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt"
+SCRYPT_DEFAULTS = ("32768", "8", "1") # Werkzeug's n, r, p
+
+
+def _pool_context():
+    """Multiprocessing context for the pool: forkserver where available, spawn otherwise."""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full (or a hash didn't finish in time); try again shortly."""
+
+
+def canonical_method(method):
+    """Werkzeug method string with its defaults filled in, as it appears in stored hashes."""
+    name, *args = method.split(":")
+    if name == "scrypt":
+        return ":".join(["scrypt", *(args or SCRYPT_DEFAULTS)])
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else str(DEFAULT_PBKDF2_ITERATIONS)
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Unsupported password hash method: {method!r}")
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a process pool of `workers` processes (0 hashes inline in
+    the caller, e.g. for scripts), with at most `max_queue` calls waiting for a free worker.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=1, max_queue=16, timeout=10.0):
+        self.method = canonical_method(method)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        # --- Metrics ---
+        self.hashes = 0
+        self.verifications = 0
+        self.rejected = 0 # Queue full or timed out
+        self.in_flight = 0
+
+    def _get_executor(self):
+        """The pool for this process (a forked worker process must not share its parent's pool)."""
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run(self, function, *args):
+        if self._slots is None:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy(f"{self.workers + self.max_queue} password hashes already in progress")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(function, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel() # Only succeeds while it's still queued
+                with self._lock:
+                    self.rejected += 1
+                raise HasherBusy(f"Password hash not done within {self.timeout}s") from None
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def hash(self, password):
+        """Salted hash of `password` with the configured method. Raises HasherBusy."""
+        with self._lock:
+            self.hashes += 1
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """True if `password` matches `password_hash` (any supported method). Raises HasherBusy."""
+        with self._lock:
+            self.verifications += 1
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if `password_hash` was made with a method or cost other than the configured one."""
+        stored_method = password_hash.split("$", 1)[0]
+        try:
+            return canonical_method(stored_method) != self.method
+        except ValueError:
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hashes": self.hashes,
+                "verifications": self.verifications,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+            }
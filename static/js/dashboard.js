@@ -131,7 +131,9 @@ document.addEventListener("DOMContentLoaded", function () {
         console.log(`Fetching lessons for: ${language}`);
         if (lessonContainer) lessonContainer.innerHTML = '<p><i>Loading lessons...</i></p>';
 
-        fetch(`/dashboard?lang=${language}`, {
+        // Per-user state only (lessons=0); the lesson list comes from its versioned,
+        // browser-cacheable URL, so switching back to a language costs no lesson bytes.
+        fetch(`/dashboard?lang=${language}&lessons=0`, {
             headers: { "X-Requested-With": "XMLHttpRequest" }
         })
         .then(response => {
@@ -150,14 +152,21 @@ document.addEventListener("DOMContentLoaded", function () {
             if (!data || typeof data !== 'object') {
                  throw new Error("Received invalid data structure from server.");
             }
-            if (data.lessons === undefined || data.completed === undefined || data.hearts === undefined || data.time_left === undefined) {
+            if (data.lessons_url === undefined || data.completed === undefined || data.hearts === undefined || data.time_left === undefined) {
                  console.error("Data received is missing expected keys:", data);
                  throw new Error("Incomplete data received from server.");
             }
-
+            return fetch(data.lessons_url).then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error loading lesson content! status: ${response.status}`);
+                }
+                return response.json();
+            }).then(lessons => ({ lessons, state: data }));
+        })
+        .then(({ lessons, state }) => {
             console.log("Calling renderLessons and updateHeartsDisplay...");
-            renderLessons(data.lessons, data.completed, data.hearts);
-            updateHeartsDisplay(data.hearts, data.time_left); // This calls startHeartCountdown if needed
+            renderLessons(lessons, state.completed, state.hearts);
+            updateHeartsDisplay(state.hearts, state.time_left); // This calls startHeartCountdown if needed
             console.log("Rendering complete.");
         })
         .catch(error => {
@@ -30,6 +30,14 @@ document.addEventListener('DOMContentLoaded', () => {
     let userMatchedPairs = {};    // Stores user's confirmed matches {col1Value: col2Value} for the current question
     let itemsToMatchCount = 0;    // Total number of pairs for the current matching question
 
+    // --- State for the Attempt (submitted once, see submitAttempt) ---
+    const attemptId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID()
+                      : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`; // Idempotency key
+    const attemptStartedAt = Date.now();
+    let attemptAnswers = [];      // {question: originalIndex, answer} for every check, review rounds included
+    let attemptMistakes = 0;      // Hearts lost locally so far
+    let attemptSubmission = null; // Promise of the one submission of this attempt
+
     // --- Initialization ---
     function initLesson() {
         // Load essential data from global variables set in lesson.html
@@ -115,8 +123,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 createFillInBlank(question.question);
                 break;
             case 'matching':
-                itemsToMatchCount = Object.keys(question.pairs || {}).length; // Get count safely
-                createMatchingUI(question.pairs || {}); // Pass empty object if pairs missing
+                itemsToMatchCount = (question.left || []).length; // Get count safely
+                createMatchingUI(question.left || [], question.right || []); // Pass empty lists if items missing
                 break;
             default:
                 questionInstruction.textContent = 'Error:';
@@ -257,14 +265,12 @@ document.addEventListener('DOMContentLoaded', () => {
          if(checkButton) checkButton.disabled = true; // Initially disabled until selection
     }
 
-    function createMatchingUI(pairs) {
-        if (!pairs || Object.keys(pairs).length === 0) {
+    function createMatchingUI(keys, values) { // Left- and right-hand items; the pairing stays on the server
+        if (keys.length === 0 || keys.length !== values.length) {
              answerInputArea.textContent = "Error: No matching pairs provided.";
              if(checkButton) checkButton.disabled = true;
              return;
         }
-        const keys = Object.keys(pairs);
-        const values = Object.values(pairs);
 
         // Shuffle function
         function shuffle(array) { /* ... (same shuffle logic) ... */
@@ -388,7 +394,9 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Event Handlers ---
-    function handleCheckAnswer() {
+    // Every check is graded by the server, with the same rules as the attempt it scores at the end
+    // (see grading.py): lessonData carries no answers, the verdict brings the expected one.
+    async function handleCheckAnswer() {
         // Allow checking even with 0 hearts if a mistake was *already* made on this question instance
         if (currentHearts <= 0 && !mistakeMadeOnCurrent) {
             showFeedback("You are out of hearts!", "incorrect");
@@ -397,36 +405,39 @@ document.addEventListener('DOMContentLoaded', () => {
 
         const question = questionsToAsk[currentQuestionIndex];
         const originalIndex = question.originalIndex; // Get original index stored earlier
-        let isOverallCorrect = false; // Assume incorrect initially
+        const userAnswer = question.type === 'matching' ? { ...userMatchedPairs } : getUserAnswer(question.type);
 
         // Disable check button immediately to prevent double clicks
         if(checkButton) checkButton.disabled = true;
 
+        let verdict;
+        try {
+            verdict = await gradeAnswer(originalIndex, userAnswer);
+        } catch (error) {
+            console.error("Error checking answer:", error);
+            showFeedback("Could not check your answer. Please try again.", "incorrect");
+            if(checkButton) checkButton.disabled = false;
+            return;
+        }
+        attemptAnswers.push({ question: originalIndex, answer: userAnswer });
+        const isOverallCorrect = verdict.correct;
+
         if (question.type === 'matching') {
-            // --- Matching Check Logic ---
-            const correctPairs = question.pairs;
+            // --- Matching Feedback ---
+            const correctPairs = verdict.expected || {};
             let correctMatchesCount = 0;
-            isOverallCorrect = true; // Assume correct until a mismatch is found
 
             // Disable further interaction with matching items
             answerInputArea.querySelectorAll('.match-item').forEach(item => item.disabled = true);
 
-            for (const key in userMatchedPairs) {
-                const userValue = userMatchedPairs[key];
-                const correctValue = correctPairs[key];
-
+            for (const key in userAnswer) {
+                const userValue = userAnswer[key];
                 const item1 = answerInputArea.querySelector(`#match-col-1 .match-item[data-value="${key}"]`);
                 const item2 = answerInputArea.querySelector(`#match-col-2 .match-item[data-value="${userValue}"]`);
-
-                if (userValue === correctValue) {
-                    correctMatchesCount++;
-                    if(item1) item1.classList.add('correct-pair');
-                    if(item2) item2.classList.add('correct-pair');
-                } else {
-                    isOverallCorrect = false; // Mark overall as incorrect
-                    if(item1) item1.classList.add('incorrect-pair');
-                    if(item2) item2.classList.add('incorrect-pair');
-                }
+                const pairClass = userValue === correctPairs[key] ? 'correct-pair' : 'incorrect-pair';
+                if (pairClass === 'correct-pair') correctMatchesCount++;
+                if(item1) item1.classList.add(pairClass);
+                if(item2) item2.classList.add(pairClass);
             }
             // Provide feedback specific to matching
              if (isOverallCorrect) {
@@ -436,27 +447,15 @@ document.addEventListener('DOMContentLoaded', () => {
              }
 
         } else {
-            // --- Check Logic for other types ---
-            let userAnswer = getUserAnswer(question.type);
-            const correctAnswer = question.answer;
-
-            // Normalize strings for comparison
-            let normalizedUserAnswer = userAnswer;
-            let normalizedCorrectAnswer = correctAnswer;
-            if (typeof userAnswer === 'string') normalizedUserAnswer = userAnswer.trim().toLowerCase();
-            if (typeof correctAnswer === 'string') normalizedCorrectAnswer = correctAnswer.trim().toLowerCase();
-
-            isOverallCorrect = (normalizedUserAnswer !== null && normalizedUserAnswer === normalizedCorrectAnswer);
-
              // Provide feedback for non-matching types
              if (isOverallCorrect) {
                 showFeedback("Correct!", "correct");
              } else {
-                 showFeedback(`Incorrect. Correct answer: ${correctAnswer}`, "incorrect");
+                 showFeedback(`Incorrect. Correct answer: ${verdict.expected}`, "incorrect");
              }
               // Style inputs for non-matching types
-              styleInputFeedback(question.type, isOverallCorrect);
-        } // End check logic branching
+              styleInputFeedback(question.type, isOverallCorrect, verdict.expected);
+        } // End feedback branching
 
         // --- Common Actions After Checking ---
         if (isOverallCorrect) {
@@ -586,7 +585,7 @@ document.addEventListener('DOMContentLoaded', () => {
         feedbackArea.classList.add('visible');      // Make visible via CSS transition
     }
 
-    function styleInputFeedback(questionType, isCorrect) {
+    function styleInputFeedback(questionType, isCorrect, expectedAnswer) {
         const correctClass = 'correct';
         const incorrectClass = 'incorrect';
 
@@ -612,8 +611,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     const labelDiv = radio.closest('.mc-option'); // Get the container div
                     if (!labelDiv) return;
                     labelDiv.classList.remove(correctClass, incorrectClass); // Clear previous first
-                    const question = questionsToAsk[currentQuestionIndex]; // Current question object
-                    const isThisOptionCorrectAnswer = (radio.value === question.answer);
+                    const isThisOptionCorrectAnswer = (radio.value === expectedAnswer);
 
                     if (isThisOptionCorrectAnswer) {
                         labelDiv.classList.add(correctClass); // Always mark correct one green
@@ -646,10 +644,13 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- API Communication ---
-    async function loseHeart() {
+    // Hearts are only deducted locally while answering; the server grades and applies the whole
+    // attempt (heart loss, completion, XP, streak, achievements) in one request at the end.
+    function loseHeart() {
         if (currentHearts <= 0) return; // Safeguard
 
         currentHearts--;
+        attemptMistakes++;
         updateHeartsDisplay();
         console.log(`Lost a heart. Remaining: ${currentHearts}`);
 
@@ -658,27 +659,65 @@ document.addEventListener('DOMContentLoaded', () => {
              if(checkButton) checkButton.disabled = true;
              answerInputArea.querySelectorAll('button, input').forEach(el => el.disabled = true); // Disable all inputs/buttons
              showFeedback("Oh no, you're out of hearts! Review your mistakes.", "incorrect");
-             // Don't hide continue, allow user to proceed (and potentially fail review if needed)
-             // but checking is blocked.
+             // The attempt can't be finished any more: record the lost hearts now
+             submitAttempt().catch(error => console.error("Could not save lost hearts:", error));
         }
+    }
 
-        try {
-            const response = await fetch('/lose_heart', { method: 'POST' });
-            if (!response.ok) {
-                console.error(`Server error losing heart: ${response.status} ${response.statusText}`);
-                // Maybe attempt to revert UI heart count? Or show persistent error?
-                // currentHearts++; updateHeartsDisplay(); // Example revert
-            } else {
-                 console.log("Server confirmed heart loss.");
-                 // const data = await response.json(); // Process response if needed
+    async function gradeAnswer(questionIndex, answer) {
+        const response = await fetch(`/lesson/${lessonId}/grade?lang=${encodeURIComponent(language)}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ answers: [{ question: questionIndex, answer }] }),
+        });
+        if (!response.ok) throw new Error(`${response.status} ${response.statusText}`);
+        return (await response.json()).results[0];
+    }
+
+    function attemptPayload() {
+        return JSON.stringify({
+            attempt_id: attemptId,
+            answers: attemptAnswers,
+            mistakes: attemptMistakes,
+            duration_ms: Date.now() - attemptStartedAt,
+        });
+    }
+
+    function attemptUrl() {
+        return `/lesson/${lessonId}/attempt?lang=${encodeURIComponent(language)}`;
+    }
+
+    // Submits the attempt once; retries are safe because the server replays a known attempt_id
+    function submitAttempt(retries = 2) {
+        if (attemptSubmission) return attemptSubmission;
+        const send = async (retriesLeft) => {
+            try {
+                const response = await fetch(attemptUrl(), {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: attemptPayload(),
+                });
+                if (response.status >= 500 && retriesLeft > 0) return send(retriesLeft - 1);
+                if (!response.ok) throw new Error(`${response.status} ${response.statusText}`);
+                return response.json();
+            } catch (error) {
+                if (retriesLeft > 0 && error instanceof TypeError) return send(retriesLeft - 1); // Network error
+                throw error;
             }
-        } catch (error) {
-            console.error("Network error losing heart:", error);
-            // Inform user of network issue? Revert UI heart count?
-            // currentHearts++; updateHeartsDisplay(); // Example revert
-        }
+        };
+        attemptSubmission = send(retries);
+        attemptSubmission.catch(() => { attemptSubmission = null; }); // Allow another try (same attempt_id)
+        return attemptSubmission;
     }
 
+    // Leaving mid-lesson still records the hearts lost so far. Not when the page goes into the
+    // back/forward cache: it may come back and finish, and a stored partial result under this
+    // attempt_id would then be replayed instead of the completion.
+    window.addEventListener('pagehide', (event) => {
+        if (event.persisted || attemptSubmission || attemptMistakes === 0 || !navigator.sendBeacon) return;
+        navigator.sendBeacon(attemptUrl(), new Blob([attemptPayload()], { type: 'application/json' }));
+    });
+
     async function completeLesson() {
         console.log("Lesson complete!");
         if(progressBar) progressBar.style.width = '100%'; // Ensure progress is full
@@ -688,23 +727,21 @@ document.addEventListener('DOMContentLoaded', () => {
         if(continueButton) continueButton.style.display = 'none';
 
         try {
-            const url = `/complete_lesson/${lessonId}?lang=${language}`;
-            const response = await fetch(url, { method: 'POST' });
-
-            if (response.ok) {
-                const result = await response.json();
-                console.log("Lesson completion acknowledged by server:", result);
-                showFeedback(`Lesson Complete! +${result.xp_earned || '??'} XP`, "correct");
-                setTimeout(() => {
-                    window.location.href = `/dashboard?lang=${language}`;
-                }, 2000); // Redirect after 2 seconds
-            } else {
-                console.error(`Server error completing lesson: ${response.status} ${response.statusText}`);
-                showError("Could not save lesson completion. Please try again later.", false);
+            const result = await submitAttempt();
+            console.log("Lesson attempt acknowledged by server:", result);
+            currentHearts = result.hearts;
+            updateHeartsDisplay();
+            if (!result.completed) {
+                showError("The server didn't accept this attempt as complete. Please try the lesson again.", false);
+                return;
             }
+            showFeedback(`Lesson Complete! +${result.xp_earned} XP`, "correct");
+            setTimeout(() => {
+                window.location.href = `/dashboard?lang=${language}`;
+            }, 2000); // Redirect after 2 seconds
         } catch (error) {
-            console.error("Network error completing lesson:", error);
-            showError("Network error saving completion. Please check your connection.", false);
+            console.error("Error saving lesson attempt:", error);
+            showError("Could not save lesson completion. Please check your connection and try again.", false);
         }
     }
 
@@ -0,0 +1,54 @@
+# tests/conftest.py
+# The app module reads its configuration at import, so it's imported once per session against
+# a scratch database (the tracked database.db is never touched).
+import importlib
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    os.environ["DATABASE"] = str(tmp_path_factory.mktemp("db") / "database.db")
+    os.environ.setdefault("PASSWORD_HASH_WORKERS", "0") # Hash inline: no process pool in tests
+    os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+    os.chdir(ROOT) # lessons.json, templates and static are relative paths
+    sys.path.insert(0, ROOT)
+    return importlib.import_module("app_test")
+
+
+@pytest.fixture
+def signup(app_module):
+    """Signs a new user up on a fresh test client; returns (client, email)."""
+    def create(fullname="Tester"):
+        client = app_module.app.test_client()
+        email = f"{uuid.uuid4().hex[:12]}@example.com"
+        response = client.post("/signup", data={"fullname": fullname, "email": email, "password": "pw123456"})
+        assert response.status_code == 302
+        return client, email
+    return create
+
+
+def correct_answers(app_module, lesson_id, lang):
+    questions = app_module.catalog_loader.catalog.get_lesson(lang, lesson_id)["questions"]
+    return [{"question": i, "answer": q.get("pairs") or q["answer"]} for i, q in enumerate(questions)]
+
+
+def complete_lesson(app_module, client, lesson_id, lang, attempt_id=None):
+    """Posts a fully correct attempt for a lesson, the way static/js/lesson.js does."""
+    return client.post(f"/lesson/{lesson_id}/attempt?lang={lang}",
+                       json={"attempt_id": attempt_id or uuid.uuid4().hex,
+                             "answers": correct_answers(app_module, lesson_id, lang)})
+
+
+def user_row(conn, email):
+    return conn.execute("SELECT xp, gems FROM users WHERE email = ?", (email,)).fetchone()
+
+
+def earned(conn, email):
+    """Achievement keys a user holds."""
+    return {row[0] for row in conn.execute("SELECT achievement_key FROM user_achievements WHERE user_email = ?", (email,))}
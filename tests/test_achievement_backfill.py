@@ -0,0 +1,88 @@
+# tests/test_achievement_backfill.py
+# The bulk backfill (achievements.backfill_achievements), against a scratch database.
+import pytest
+
+import achievements
+from achievements import ALL_ACHIEVEMENTS, backfill_achievements
+from database import init_db
+from db_pool import create_connection
+from conftest import earned, user_row
+
+
+@pytest.fixture
+def scratch_db(tmp_path):
+    path = str(tmp_path / "backfill.db")
+    init_db(path)
+    conn = create_connection(path)
+    yield conn
+    conn.close()
+
+
+def add_user(conn, email, xp=0, streak=0, lessons=0):
+    conn.execute("INSERT INTO users (fullname, email, password, xp, streak) VALUES (?, ?, 'x', ?, ?)",
+                 (email, email, xp, streak))
+    conn.execute("INSERT INTO user_stats (user_email, lessons_completed) VALUES (?, ?)", (email, lessons))
+    conn.commit()
+
+
+def quiet(*_args):
+    pass
+
+
+def test_backfill_awards_a_lowered_threshold_to_dormant_users(scratch_db):
+    for streak in (4, 5, 6, 9):
+        add_user(scratch_db, f"s{streak}@example.com", streak=streak)
+    backfill_achievements(scratch_db, report=quiet) # Current definitions: only s9 has a 7-day streak
+    assert earned(scratch_db, "s9@example.com") == {"STREAK_3", "STREAK_7"}
+    assert "STREAK_7" not in earned(scratch_db, "s6@example.com")
+
+    lowered = {**ALL_ACHIEVEMENTS, "STREAK_7": {**ALL_ACHIEVEMENTS["STREAK_7"], "criteria_value": 5}}
+    counts = backfill_achievements(scratch_db, definitions=lowered, report=quiet)
+    assert counts["STREAK_7"] == 2 # s5 and s6; s9 already had it
+    assert "STREAK_7" in earned(scratch_db, "s5@example.com")
+    assert "STREAK_7" not in earned(scratch_db, "s4@example.com")
+    assert user_row(scratch_db, "s9@example.com")["xp"] == (ALL_ACHIEVEMENTS["STREAK_3"]["reward_xp"]
+                                                             + ALL_ACHIEVEMENTS["STREAK_7"]["reward_xp"])
+
+
+def test_backfill_picks_up_levels_reached_through_rewards(scratch_db):
+    add_user(scratch_db, "close@example.com", xp=480, streak=3) # STREAK_3's reward takes them to 500
+    add_user(scratch_db, "far@example.com", xp=100, streak=3)
+    counts = backfill_achievements(scratch_db, report=quiet)
+    assert counts["LEVEL_5"] == 1
+    assert earned(scratch_db, "close@example.com") == {"STREAK_3", "LEVEL_5"}
+    assert earned(scratch_db, "far@example.com") == {"STREAK_3"}
+    events = scratch_db.execute("SELECT source, amount FROM xp_events WHERE user_email = 'close@example.com' ORDER BY id").fetchall()
+    assert [tuple(event) for event in events] == [("achievement:STREAK_3", 20), ("achievement:LEVEL_5", 30)]
+
+
+def test_backfill_resumes_without_double_awarding(scratch_db, monkeypatch):
+    for i in range(5):
+        add_user(scratch_db, f"u{i}@example.com", streak=10, lessons=1)
+
+    award_chunk = achievements._award_chunk
+    calls = []
+    def interrupted(conn, key, *args):
+        calls.append(key)
+        if key == "STREAK_7" and calls.count(key) == 2:
+            raise KeyboardInterrupt # Stopped in the middle of STREAK_7's scan
+        return award_chunk(conn, key, *args)
+    monkeypatch.setattr(achievements, "_award_chunk", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        backfill_achievements(scratch_db, chunk_size=2, report=quiet)
+    assert scratch_db.execute("SELECT COUNT(*) FROM user_achievements WHERE achievement_key = 'STREAK_7'").fetchone()[0] == 2
+
+    resumed = []
+    def counting(conn, key, *args):
+        resumed.append(key)
+        return award_chunk(conn, key, *args)
+    monkeypatch.setattr(achievements, "_award_chunk", counting)
+    counts = backfill_achievements(scratch_db, chunk_size=2, report=quiet)
+    assert counts["LESSONS_1"] == 0 and counts["STREAK_3"] == 0 and counts["STREAK_7"] == 3
+    assert "LESSONS_1" not in resumed and "STREAK_3" not in resumed # Finished before the interruption: not rescanned
+    assert resumed.count("STREAK_7") == 2 # Users 3-4 and 5 only
+
+    expected_xp = sum(ALL_ACHIEVEMENTS[key]["reward_xp"] for key in ("STREAK_3", "STREAK_7", "LESSONS_1"))
+    for i in range(5):
+        assert earned(scratch_db, f"u{i}@example.com") == {"STREAK_3", "STREAK_7", "LESSONS_1"}
+        assert user_row(scratch_db, f"u{i}@example.com")["xp"] == expected_xp
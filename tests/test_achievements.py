@@ -0,0 +1,69 @@
+# tests/test_achievements.py
+# Event-driven awarding: AchievementEngine and app_test.check_and_award_achievements.
+from achievements import ALL_ACHIEVEMENTS, AchievementEngine
+from conftest import earned, user_row
+
+LADDER = {
+    "S3": {"criteria_type": "streak", "criteria_value": 3},
+    "S7": {"criteria_type": "streak", "criteria_value": 7},
+    "S7B": {"criteria_type": "streak", "criteria_value": 7},
+    "ES5": {"criteria_type": "lessons_language", "criteria_value": 5, "criteria_extra": "Spanish"},
+    "DE5": {"criteria_type": "lessons_language", "criteria_value": 5, "criteria_extra": "German"},
+}
+
+
+def keys(entries):
+    return [key for key, _ in entries]
+
+
+# --- AchievementEngine ---
+
+def test_each_rung_is_crossed_once():
+    engine = AchievementEngine(LADDER)
+    crossings = [keys(engine.crossed("streak", old, old + 1)) for old in range(10)]
+    assert crossings == [[], [], ["S3"], [], [], [], ["S7", "S7B"], [], [], []]
+
+
+def test_one_jump_crosses_several_rungs_lowest_first():
+    engine = AchievementEngine(LADDER)
+    assert keys(engine.crossed("streak", 0, 10)) == ["S3", "S7", "S7B"]
+    assert keys(engine.crossed("streak", 3, 7)) == ["S7", "S7B"] # Old value's own rung is not crossed again
+
+
+def test_no_crossing_when_the_counter_stays_or_drops():
+    engine = AchievementEngine(LADDER)
+    assert engine.crossed("streak", 7, 7) == []
+    assert engine.crossed("streak", 10, 0) == []
+    assert engine.crossed("unknown", 0, 100) == []
+
+
+def test_ladders_are_per_extra():
+    engine = AchievementEngine(LADDER)
+    assert keys(engine.crossed("lessons_language", 4, 5, "Spanish")) == ["ES5"]
+    assert keys(engine.crossed("lessons_language", 4, 5, "German")) == ["DE5"]
+    assert engine.crossed("lessons_language", 4, 5) == []
+
+
+# --- Awarding from a request ---
+
+def test_app_awards_once_and_cascades_levels(app_module, signup):
+    _, email = signup()
+    conn = app_module.db_pool.acquire()
+    try:
+        conn.execute("UPDATE users SET xp = 480 WHERE email = ?", (email,))
+        conn.commit()
+        # STREAK_3's 20 XP takes the user from 480 to 500: level 4 -> 5
+        first = app_module.check_and_award_achievements(email, conn, [("streak", 2, 3, None)], 480)
+        conn.commit()
+        assert [a["achievement_key"] for a in first] == ["STREAK_3", "LEVEL_5"]
+        xp_after = user_row(conn, email)["xp"]
+        assert xp_after == 480 + ALL_ACHIEVEMENTS["STREAK_3"]["reward_xp"] + ALL_ACHIEVEMENTS["LEVEL_5"]["reward_xp"]
+
+        # The streak is lost and rebuilt: the same crossing again awards nothing
+        again = app_module.check_and_award_achievements(email, conn, [("streak", 2, 3, None)], xp_after)
+        conn.commit()
+        assert again == []
+        assert user_row(conn, email)["xp"] == xp_after
+        assert earned(conn, email) == {"STREAK_3", "LEVEL_5"}
+    finally:
+        app_module.db_pool.release(conn)
@@ -0,0 +1,158 @@
+# tests/test_content_encoding.py
+# Precompressed responses: /lesson_content (ETag revalidation, variant choice, Vary) and the
+# built assets, with and without the optional brotli package.
+import gzip
+
+import pytest
+
+import assets
+import lesson_catalog
+from lesson_catalog import CompiledLessonCatalog, LessonCatalog, compile_catalog
+
+FAKE_BR = b"br variant" # Stands in for a brotli-compressed copy; only its selection is tested
+
+
+@pytest.fixture
+def catalog(app_module):
+    return app_module.catalog_loader.catalog
+
+
+@pytest.fixture
+def with_brotli(catalog, monkeypatch):
+    """The running catalog with a br variant, whether or not brotli is installed here."""
+    monkeypatch.setattr(catalog, "lessons_brotli", lambda language: FAKE_BR)
+
+
+@pytest.fixture
+def without_brotli(catalog, monkeypatch):
+    monkeypatch.setattr(catalog, "lessons_brotli", lambda language: None)
+
+
+def get(client, accept_encoding=None, if_none_match=None, url="/lesson_content/Spanish"):
+    headers = {}
+    if accept_encoding is not None:
+        headers["Accept-Encoding"] = accept_encoding
+    if if_none_match is not None:
+        headers["If-None-Match"] = if_none_match
+    return client.get(url, headers=headers)
+
+
+def vary(response):
+    return {value.strip() for value in response.headers.get("Vary", "").split(",")}
+
+
+def test_identity(app_module, signup, catalog, with_brotli):
+    client, _ = signup()
+    response = get(client)
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data() == catalog.lessons_json("Spanish")
+    assert response.headers["ETag"] == f'"{catalog.content_hash("Spanish")}"'
+    assert "Accept-Encoding" in vary(response)
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip, br", "br"),         # br preferred when both are acceptable
+    ("br;q=0, gzip", "gzip"),   # Explicitly refused
+    ("gzip", "gzip"),
+    ("deflate", None),          # Nothing precompressed that the client takes
+    ("identity", None),
+])
+def test_variant_choice(app_module, signup, catalog, with_brotli, accept_encoding, encoding):
+    client, _ = signup()
+    response = get(client, accept_encoding)
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == encoding
+    content_hash = catalog.content_hash("Spanish")
+    assert response.headers["ETag"] == (f'"{content_hash}"' if encoding is None else f'"{content_hash}-{encoding}"')
+    assert "Accept-Encoding" in vary(response)
+    if encoding == "gzip":
+        assert gzip.decompress(response.get_data()) == catalog.lessons_json("Spanish")
+    elif encoding == "br":
+        assert response.get_data() == FAKE_BR
+
+
+def test_revalidation(app_module, signup, catalog, with_brotli):
+    client, _ = signup()
+    first = get(client, "gzip")
+    etag = first.headers["ETag"]
+
+    again = get(client, "gzip", if_none_match=etag)
+    assert again.status_code == 304
+    assert again.get_data() == b""
+    assert again.headers["ETag"] == etag
+    assert "Accept-Encoding" in vary(again)
+    assert again.headers["Cache-Control"] == "private, no-cache"
+
+    # A cache holding another variant of the same content doesn't refetch it
+    assert get(client, "br, gzip", if_none_match=etag).status_code == 304
+    assert get(client, None, if_none_match=f'W/{etag}').status_code == 304
+    # Content from before a catalog change does
+    assert get(client, "gzip", if_none_match='"0123456789abcdef0123-gzip"').status_code == 200
+
+
+def test_versioned_url(app_module, signup, catalog):
+    client, _ = signup()
+    content_hash = catalog.content_hash("Spanish")
+    response = get(client, "gzip", url=f"/lesson_content/Spanish/{content_hash}")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["Cache-Control"]
+    stale = get(client, "gzip", url="/lesson_content/Spanish/0123456789abcdef0123")
+    assert stale.status_code == 302 and stale.headers["Location"].endswith(f"/lesson_content/Spanish/{content_hash}")
+
+
+# --- Without brotli ---
+
+def test_route_falls_back_to_gzip(app_module, signup, without_brotli):
+    client, _ = signup()
+    response = get(client, "br, gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert get(client, "br").headers.get("Content-Encoding") is None # br only: identity, not a missing variant
+
+
+def test_catalogs_without_brotli(tmp_path, monkeypatch):
+    monkeypatch.setattr(lesson_catalog, "brotli", None)
+    catalog = LessonCatalog.from_file("lessons.json")
+    assert catalog.lessons_brotli("Spanish") is None
+    assert gzip.decompress(catalog.lessons_gzip("Spanish")) == catalog.lessons_json("Spanish")
+
+    path = str(tmp_path / "lessons.bin")
+    compile_catalog("lessons.json", path)
+    compiled = CompiledLessonCatalog(path)
+    assert compiled.lessons_brotli("Spanish") is None
+    assert compiled.lessons_gzip("Spanish") == catalog.lessons_gzip("Spanish")
+
+
+@pytest.fixture
+def built_assets(tmp_path, monkeypatch):
+    """A build of a small static tree without brotli."""
+    monkeypatch.setattr(assets, "brotli", None)
+    static = tmp_path / "static"
+    (static / "js").mkdir(parents=True)
+    (static / "js" / "app.js").write_text("// app\n" + "console.log('hello');\n" * 40)
+    manifest = assets.build_assets(str(static))
+    return static, manifest
+
+
+def test_asset_build_without_brotli(built_assets):
+    static, manifest = built_assets
+    entry = manifest["assets"]["js/app.js"]
+    assert entry["encodings"] == ["gzip"]
+    built = static / "dist" / entry["path"]
+    assert (built.parent / (built.name + ".gz")).exists()
+    assert not (built.parent / (built.name + ".br")).exists()
+
+
+def test_asset_route_without_brotli(app_module, built_assets, monkeypatch):
+    static, manifest = built_assets
+    monkeypatch.setattr(app_module, "ASSET_BUILD_DIR", str(static / "dist"))
+    monkeypatch.setattr(app_module, "asset_manifest", assets.AssetManifest(manifest["assets"]))
+    path = manifest["assets"]["js/app.js"]["path"]
+
+    client = app_module.app.test_client()
+    response = client.get(f"/assets/{path}", headers={"Accept-Encoding": "br, gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in vary(response)
+    assert gzip.decompress(response.get_data()) == (static / "dist" / path).read_bytes()
+    response.close()
@@ -0,0 +1,129 @@
+# tests/test_grading.py
+# Server-side answer checking (grading.py), and that the pages only ever get answers from it.
+import pytest
+
+from grading import ChoiceMatcher, LessonGrader, MatchingMatcher, TextMatcher, client_lesson, fold, romaji_readings
+
+
+@pytest.mark.parametrize("text, folded", [
+    ("  Café, NIÑO!  ", "cafe nino"),    # Case, Latin accents, punctuation, outer whitespace
+    ("ＡＢＣ　ｄｅｆ", "abc def"),        # NFKC: full-width letters and space
+    ("Straße", "strasse"),              # Case folding, not just lowercasing
+    ("good   morning", "good morning"), # Inner whitespace collapsed
+    ("「はい」。", "はい"),               # Japanese punctuation
+    ("コンニチハ", "こんにちは"),           # Katakana folded to hiragana
+    ("がっこう", "がっこう"),              # Voicing marks are not accents
+])
+def test_fold(text, folded):
+    assert fold(text) == folded
+
+
+def test_alternates_and_extra_answers():
+    matcher = TextMatcher("Excuse me / Sorry", extra=["Pardon"])
+    assert matcher("sorry") and matcher("Excuse me!") and matcher("Excuse me / Sorry") and matcher("PARDON")
+    assert not matcher("excuse")
+    assert not matcher(None) and not matcher(["sorry"])
+
+
+def test_kana_answer_accepts_katakana():
+    assert TextMatcher("ありがとう")("アリガトウ")
+
+
+@pytest.mark.parametrize("response, correct", [
+    ("watashi wa gakusei desu", True),   # Hepburn, は read as a particle
+    ("watashi ha gakusei desu", True),   # は read as written
+    ("watasi wa gakusei desu", True),    # Kunrei
+    ("Watashi-wa gakusei desu.", True),  # Case and punctuation still fold
+    ("watashi wa gakusee desu", False),
+    ("わたしわ がくせいです", False),       # Kana must match the kana answer, not its reading
+])
+def test_romaji_readings_with_particles(response, correct):
+    assert TextMatcher("わたしは がくせいです")(response) is correct
+
+
+@pytest.mark.parametrize("response", ["toukyou", "tokyo", "tōkyō", "Tookyoo"])
+def test_romaji_long_vowels(response):
+    assert TextMatcher("とうきょう")(response)
+
+
+def test_romaji_double_consonants():
+    matcher = TextMatcher("がっこう")
+    assert matcher("gakkou") and matcher("gakko")
+    assert not matcher("gakou")
+
+
+def test_romaji_only_for_all_kana_answers():
+    matcher = TextMatcher("日本")
+    assert not matcher.romaji and not matcher("nihon")
+
+
+def test_particle_readings():
+    assert romaji_readings(fold("わたしは")) == {"watasiha", "watasiwa"}
+
+
+def test_choice_must_be_an_offered_option():
+    matcher = ChoiceMatcher("Hello", ["Hello", "Goodbye"], extra=["Hi"])
+    assert matcher(" hello! ")
+    assert not matcher("Hi")       # Accepted answer, but not one of the options
+    assert not matcher("Goodbye")
+    assert not matcher(None)
+
+
+def test_matching():
+    matcher = MatchingMatcher({"ありがとう": "Thank you", "すみません": "Excuse me / Sorry"})
+    assert matcher({"ありがとう": "thank you", "すみません": "sorry"})
+    assert matcher({"アリガトウ": "Thank you", "すみません": "Excuse me"}) # Left-hand items fold too
+    assert not matcher({"ありがとう": "Sorry", "すみません": "Thank you"})
+    assert not matcher({"ありがとう": "Thank you"})                       # Every pair is needed
+    assert not matcher({"ありがとう": "Thank you", "すみません": "Sorry", "はい": "Yes"})
+    assert not matcher([["ありがとう", "Thank you"]])
+
+
+def test_grade_attempt_flags_unknown_questions():
+    grader = LessonGrader({"questions": [{"type": "translation", "question": "Hola", "answer": "Hello"}]})
+    results = grader.grade_attempt([{"question": 0, "answer": "hello"}, {"question": 1, "answer": "x"},
+                                    {"question": True, "answer": "hello"}, "hello"])
+    assert [result["correct"] for result in results] == [True, False, False, False]
+    assert [("error" in result) for result in results] == [False, True, True, True]
+
+
+# --- Pages ---
+
+def test_client_lesson_has_no_answers(app_module):
+    for language in app_module.catalog_loader.catalog.languages:
+        for lesson in app_module.catalog_loader.catalog.lessons(language):
+            shown = client_lesson(lesson)
+            for question, original in zip(shown["questions"], lesson["questions"]):
+                assert not {"answer", "accept", "pairs"} & question.keys()
+                if original["type"] == "matching":
+                    assert question["left"] == list(original["pairs"])
+                    assert sorted(question["right"]) == sorted(original["pairs"].values())
+
+
+def test_lesson_page_and_list_carry_no_answers(app_module, signup):
+    client, _ = signup()
+    lesson = app_module.catalog_loader.catalog.get_lesson("Spanish", 1)
+    page = client.get("/lesson/1?lang=Spanish").get_data(as_text=True)
+    assert lesson["questions"][0]["question"] in page
+    assert '"answer"' not in page and '"pairs"' not in page
+
+    lessons = client.get("/lesson_content/Spanish").get_json()
+    assert lessons and all(set(entry) == {"lesson", "title", "xp"} for entry in lessons)
+
+
+def test_grade_route_uses_server_folding(app_module, signup):
+    client, _ = signup()
+    lesson = app_module.catalog_loader.catalog.get_lesson("Japanese", 1)
+    index = next(i for i, q in enumerate(lesson["questions"]) if q["type"] == "translation")
+    expected = lesson["questions"][index]["answer"]
+    response = client.post("/lesson/1/grade?lang=Japanese", json={"answers": [
+        {"question": index, "answer": f"  {expected.upper()}!! "},
+        {"question": index, "answer": "definitely wrong"},
+        {"question": 999, "answer": expected},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [result["correct"] for result in body["results"]] == [True, False, False]
+    assert body["results"][1]["expected"] == expected # Shown in the feedback once graded
+    assert "expected" not in body["results"][2]
+    assert body["correct"] == 1 and body["total"] == 3
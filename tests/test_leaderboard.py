@@ -0,0 +1,131 @@
+# tests/test_leaderboard.py
+import sqlite3
+
+import pytest
+
+from leaderboard import Leaderboard
+from xp_ledger import last_xp_event_id, record_xp_event
+
+
+@pytest.fixture
+def board(app_module):
+    """A leaderboard of its own (no refresher thread), built from the test database."""
+    leaderboard = Leaderboard(lambda name: "#000000", app_module.db_pool)
+    conn = app_module.db_pool.acquire()
+    try:
+        leaderboard.rebuild(conn)
+    finally:
+        app_module.db_pool.release(conn)
+    return leaderboard
+
+
+def run(app_module, method):
+    conn = app_module.db_pool.acquire()
+    try:
+        return method(conn)
+    finally:
+        app_module.db_pool.release(conn)
+
+
+def add_xp_elsewhere(app_module, email, amount):
+    """XP added by another worker process; returns the xp_events id of its transaction."""
+    conn = sqlite3.connect(app_module.DATABASE)
+    try:
+        with conn:
+            conn.execute("UPDATE users SET xp = xp + ? WHERE email = ?", (amount, email))
+            record_xp_event(conn.cursor(), email, amount, "test")
+            return last_xp_event_id(conn)
+    finally:
+        conn.close()
+
+
+def sql_ranks(app_module):
+    conn = sqlite3.connect(app_module.DATABASE)
+    try:
+        return dict(conn.execute("SELECT email, RANK() OVER (ORDER BY xp DESC) FROM users"))
+    finally:
+        conn.close()
+
+
+def board_rank(board, email):
+    entry = board.around(email, radius=0)
+    return entry[0]["rank"] if entry else None
+
+
+def test_catch_up_applies_other_workers_xp(app_module, signup, board):
+    _, leader = signup("Leader")
+    _, chaser = signup("Chaser")
+    board.add_xp(leader, "Leader", 0)
+    board.add_xp(chaser, "Chaser", 0)
+    add_xp_elsewhere(app_module, leader, 500)
+    add_xp_elsewhere(app_module, chaser, 900)
+
+    assert run(app_module, board.catch_up) is True
+    ranks = sql_ranks(app_module)
+    assert board_rank(board, chaser) == ranks[chaser]
+    assert board_rank(board, leader) == ranks[leader] > ranks[chaser]
+    assert len(board) == len(ranks)
+
+
+def test_catch_up_is_a_no_op_when_no_xp_was_added(app_module, board):
+    run(app_module, board.catch_up)
+    last = board.last_catch_up_seconds
+    assert run(app_module, board.catch_up) is True
+    assert board.last_catch_up_seconds == last # Nothing was re-read
+
+
+def test_catch_up_asks_for_a_rebuild_after_deleted_events(app_module, signup, board):
+    _, email = signup()
+    add_xp_elsewhere(app_module, email, 10)
+    add_xp_elsewhere(app_module, email, 10)
+    conn = sqlite3.connect(app_module.DATABASE)
+    with conn:
+        conn.execute("DELETE FROM xp_events WHERE id = (SELECT MAX(id) - 1 FROM xp_events)")
+    conn.close()
+    assert run(app_module, board.catch_up) is False
+
+
+def test_local_delta_already_read_by_a_catch_up_counts_once(app_module, signup, board):
+    _, email = signup()
+    board.add_xp(email, "Tester", 0)
+    # The route committed its XP, then a catch-up read the row before the route updated the board
+    event_id = add_xp_elsewhere(app_module, email, 40)
+    run(app_module, board.catch_up)
+    board.add_xp(email, None, 40, event_id=event_id)
+    assert board.around(email, radius=0)[0]["xp"] == 40
+
+    # A later transaction's delta still applies
+    event_id = add_xp_elsewhere(app_module, email, 5)
+    board.add_xp(email, None, 5, event_id=event_id)
+    assert board.around(email, radius=0)[0]["xp"] == 45
+
+
+class _Interleaved:
+    """Connection that runs `hook` just before the catch-up reads the changed users' rows."""
+
+    def __init__(self, conn, hook):
+        self._conn = conn
+        self._hook = hook
+
+    def execute(self, sql, parameters=()):
+        if "changed.user_email" in sql:
+            self._hook()
+        return self._conn.execute(sql, parameters)
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+def test_local_delta_during_a_catch_up_is_kept(app_module, signup, board):
+    _, email = signup()
+    board.add_xp(email, "Tester", 0)
+    add_xp_elsewhere(app_module, email, 30) # Another worker: picked up by the catch-up
+
+    def local_update(): # This worker commits and updates the board after the catch-up's snapshot
+        event_id = add_xp_elsewhere(app_module, email, 7)
+        board.add_xp(email, None, 7, event_id=event_id)
+
+    run(app_module, lambda conn: board.catch_up(_Interleaved(conn, local_update)))
+    assert board.around(email, radius=0)[0]["xp"] == 37
+    run(app_module, board.catch_up) # The next catch-up re-reads the row, still once
+    assert board.around(email, radius=0)[0]["xp"] == 37
@@ -0,0 +1,80 @@
+# tests/test_leaderboard_fragments.py
+# The shared leaderboard rows (fragment_cache) against per-viewer state: rank changes drop the
+# cached rows, and each viewer's highlight and own entry are theirs.
+import re
+import uuid
+
+import pytest
+
+from conftest import complete_lesson
+
+ROW = re.compile(r'<tr class="([^"]*)">.*?<span>([^<]*)</span>', re.S)
+
+
+def rows(page):
+    """(name, highlighted) for every table row, in order."""
+    return [(name, "current-user-row" in classes) for classes, name in ROW.findall(page)]
+
+
+def set_xp(app_module, email, xp):
+    conn = app_module.db_pool.acquire()
+    try:
+        conn.execute("UPDATE users SET xp = ? WHERE email = ?", (xp, email))
+        conn.commit()
+    finally:
+        app_module.db_pool.release(conn)
+
+
+@pytest.fixture
+def leaders(app_module, signup):
+    """Two users ahead of everyone else (below the top level, see XP_LEVELS), Beta 5 XP ahead of Alpha; (name -> (client, email))."""
+    suffix = uuid.uuid4().hex[:6]
+    users = {}
+    for name, xp in (("Alpha", 1800), ("Beta", 1805)):
+        name = f"{name} {suffix}"
+        users[name] = signup(name)
+        set_xp(app_module, users[name][1], xp)
+    conn = app_module.db_pool.acquire()
+    try:
+        app_module.leaderboard_service.rebuild(conn)
+    finally:
+        app_module.db_pool.release(conn)
+    app_module.fragment_cache.invalidate("leaderboard")
+    return users
+
+
+def page(client, period="all"):
+    response = client.get(f"/leaderboard?period={period}")
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_rank_change_drops_the_cached_rows(app_module, leaders):
+    alpha, beta = leaders
+    client, _ = leaders[alpha]
+    names = [name for name, _ in rows(page(client))]
+    assert names.index(beta) < names.index(alpha)
+    assert len(app_module.fragment_cache) > 0 # Cached now
+
+    assert complete_lesson(app_module, client, 1, "Spanish").status_code == 200 # +10 XP and more: Alpha overtakes
+    names = [name for name, _ in rows(page(client))]
+    assert names.index(alpha) < names.index(beta)
+
+
+def test_viewers_get_their_own_highlight_and_entry(app_module, signup, leaders):
+    alpha, beta = leaders
+    alpha_client, _ = leaders[alpha]
+    viewer = f"Gamma {uuid.uuid4().hex[:6]}"
+    viewer_client, _ = signup(viewer) # 0 XP: below the list
+
+    for period in ("all", "week"):
+        complete_lesson(app_module, alpha_client, 1, "Spanish") # Alpha on every list
+        alpha_rows = rows(page(alpha_client, period)) # Renders and caches the shared rows
+        viewer_rows = rows(page(viewer_client, period)) # Served from that cache
+
+        assert [name for name, highlighted in alpha_rows if highlighted] == [alpha] # In the list, no extra entry
+        assert [name for name, highlighted in viewer_rows if highlighted] == ([viewer] if period == "all" else [])
+        assert viewer_rows.count((alpha, False)) == 1
+        assert viewer_rows.count((viewer, True)) == (period == "all") # In the list or below it, once either way
+        # And the other way round: Alpha's page doesn't pick up the viewer's entry
+        assert [name for name, highlighted in rows(page(alpha_client, period)) if highlighted] == [alpha]
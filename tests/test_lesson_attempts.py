@@ -0,0 +1,73 @@
+# tests/test_lesson_attempts.py
+import sqlite3
+import uuid
+
+from conftest import complete_lesson, correct_answers
+
+
+def totals(app_module, email):
+    """Everything an attempt can award, straight from the database."""
+    conn = sqlite3.connect(app_module.DATABASE)
+    try:
+        return {
+            "user": conn.execute("SELECT xp, gems, hearts FROM users WHERE email = ?", (email,)).fetchone(),
+            "achievements": conn.execute("SELECT COUNT(*) FROM user_achievements WHERE user_email = ?", (email,)).fetchone()[0],
+            "xp_events": conn.execute("SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM xp_events WHERE user_email = ?", (email,)).fetchone(),
+            "attempts": conn.execute("SELECT COUNT(*) FROM lesson_attempts WHERE user_email = ?", (email,)).fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def test_replayed_attempt_returns_the_stored_response_and_awards_once(app_module, signup):
+    client, email = signup()
+    before = totals(app_module, email)
+    attempt_id = uuid.uuid4().hex
+
+    first = complete_lesson(app_module, client, 1, "Spanish", attempt_id)
+    assert first.status_code == 200
+    body = first.get_json()
+    assert body["completed"] and body["xp_earned"] > 0
+    assert [a["achievement_key"] for a in body["new_achievements"]] == ["LESSONS_1"]
+    after_first = totals(app_module, email)
+    assert after_first["achievements"] == before["achievements"] + 1
+    assert after_first["attempts"] == 1
+
+    replay = complete_lesson(app_module, client, 1, "Spanish", attempt_id)
+    assert replay.status_code == 200
+    assert replay.data == first.data
+    assert totals(app_module, email) == after_first
+
+
+def test_hearts_lost_is_clamped_to_the_hearts_left(app_module, signup):
+    client, email = signup()
+    hearts = totals(app_module, email)["user"][2]
+    wrong = [{"question": 0, "answer": "definitely not it"}] * (hearts + 3)
+
+    response = client.post("/lesson/1/attempt?lang=Spanish",
+                           json={"attempt_id": uuid.uuid4().hex, "answers": wrong, "mistakes": 99})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["hearts_lost"] == hearts
+    assert body["hearts"] == 0
+    assert not body["completed"]
+    assert totals(app_module, email)["user"][2] == 0
+
+
+def test_failed_attempt_leaves_nothing_behind(app_module, signup, monkeypatch):
+    client, email = signup()
+    before = totals(app_module, email)
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(app_module, "apply_lesson_completion", fail) # After the heart loss, before the insert
+
+    attempt_id = uuid.uuid4().hex
+    answers = [{"question": 0, "answer": "wrong first"}] + correct_answers(app_module, 1, "Spanish")
+    response = client.post("/lesson/1/attempt?lang=Spanish", json={"attempt_id": attempt_id, "answers": answers})
+    assert response.status_code == 500
+    assert totals(app_module, email) == before # No lesson_attempts row, and the heart loss was rolled back
+
+    monkeypatch.undo() # A retry of the same attempt is applied normally
+    retry = client.post("/lesson/1/attempt?lang=Spanish", json={"attempt_id": attempt_id, "answers": answers})
+    assert retry.status_code == 200 and retry.get_json()["completed"]
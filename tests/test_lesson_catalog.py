@@ -0,0 +1,93 @@
+# tests/test_lesson_catalog.py
+# compile_catalog -> CompiledLessonCatalog serves what LessonCatalog does; broken artifacts are refused.
+import json
+import struct
+
+import pytest
+
+from conftest import ROOT
+from lesson_catalog import (COMPILED_MAGIC, CatalogValidationError, CompiledLessonCatalog, LessonCatalog,
+                            compile_catalog, load_catalog)
+
+LESSONS_FILE = f"{ROOT}/lessons.json"
+
+
+@pytest.fixture(scope="module")
+def source():
+    return LessonCatalog.from_file(LESSONS_FILE)
+
+
+@pytest.fixture(scope="module")
+def compiled_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("catalog") / "lessons.bin")
+    compile_catalog(LESSONS_FILE, path)
+    return path
+
+
+def test_round_trip(source, compiled_path):
+    compiled = load_catalog(compiled_path)
+    assert isinstance(compiled, CompiledLessonCatalog)
+    assert (compiled.version, compiled.languages) == (source.version, source.languages)
+    assert (compiled.lesson_count, compiled.size_bytes) == (source.lesson_count, source.size_bytes)
+    for language in source.languages:
+        assert language in compiled
+        assert compiled.xp_table(language) == source.xp_table(language)
+        assert compiled.lessons(language) == source.lessons(language)
+        assert compiled.lesson_summaries(language) == source.lesson_summaries(language)
+        for method in ("lessons_json", "lessons_gzip", "lessons_brotli", "content_hash"):
+            assert getattr(compiled, method)(language) == getattr(source, method)(language), method
+        for lesson in source.lessons(language):
+            lesson_id = lesson["lesson"]
+            assert compiled.get_lesson(language, lesson_id) == lesson
+            assert compiled.lesson_xp(language, lesson_id) == source.lesson_xp(language, lesson_id)
+            assert compiled.lesson_grader(language, lesson_id) is not None
+
+
+def test_unknown_language_and_lesson(source, compiled_path):
+    compiled = CompiledLessonCatalog(compiled_path)
+    for catalog in (source, compiled):
+        assert "Klingon" not in catalog
+        assert catalog.xp_table("Klingon") == {} and catalog.lessons("Klingon") == []
+        assert catalog.get_lesson(source.languages[0], 10**6) is None
+        assert catalog.lessons_json("Klingon") is None
+
+
+def test_xp_table_is_a_copy(source):
+    language = source.languages[0]
+    source.xp_table(language).clear()
+    assert source.xp_table(language)
+
+
+def artifact(index, data=b""):
+    """A compiled catalog file's bytes around `index` (bytes, or anything json.dumps takes)."""
+    if not isinstance(index, bytes):
+        index = json.dumps(index).encode("utf-8")
+    return COMPILED_MAGIC + struct.pack("<I", len(index)) + index + data
+
+
+@pytest.mark.parametrize("content", [
+    b"LLCAT\x00\x09\x00" + b"\x00" * 16,                             # Another format version
+    COMPILED_MAGIC + b"\x01",                                        # Truncated before the index length
+    artifact(b"{not json"),
+    COMPILED_MAGIC + struct.pack("<I", 4096) + b'{"version":',       # Index runs past the end of the file
+    artifact({"version": "v", "size_bytes": 0}),                     # No languages
+    artifact({"version": "v", "size_bytes": 0, "languages": [{"language": "Spanish", "count": 1}]}),
+    artifact({"version": "v", "size_bytes": 0, "languages": [
+        {"language": "Spanish", "count": 1, "lessons": [[0, 2]], "xp": {}}]}), # Spans keyed by id, not listed
+    artifact({"version": "v", "size_bytes": 0, "languages": [
+        {"language": "Spanish", "count": 1, "lessons": {"one": [0, 2]}, "xp": {}}]}), # Non-integer lesson id
+])
+def test_malformed_artifact_is_refused(tmp_path, content):
+    path = tmp_path / "broken.bin"
+    path.write_bytes(content)
+    with pytest.raises(CatalogValidationError):
+        CompiledLessonCatalog(str(path))
+
+
+def test_invalid_source_is_not_compiled(tmp_path):
+    source = tmp_path / "lessons.json"
+    source.write_text(json.dumps({"Spanish-English": [{"lesson": 1, "title": "Hola", "questions": []}]}))
+    dest = tmp_path / "lessons.bin"
+    with pytest.raises(CatalogValidationError):
+        compile_catalog(str(source), str(dest))
+    assert not dest.exists()
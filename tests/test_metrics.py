@@ -0,0 +1,35 @@
+# tests/test_metrics.py
+# /metrics only answers scrapers holding METRICS_TOKEN.
+import pytest
+
+TOKEN = "scrape-secret"
+
+
+@pytest.fixture
+def metrics_token(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", TOKEN)
+
+
+def scrape(app_module, authorization=None):
+    headers = {"Authorization": authorization} if authorization is not None else {}
+    return app_module.app.test_client().get("/metrics", headers=headers)
+
+
+def test_disabled_without_a_token(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+    assert scrape(app_module).status_code == 403
+    assert scrape(app_module, "Bearer ").status_code == 403
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", TOKEN, f"Basic {TOKEN}"])
+def test_refused_without_the_token(app_module, metrics_token, authorization):
+    response = scrape(app_module, authorization)
+    assert response.status_code == 403
+    assert b"# HELP" not in response.get_data()
+
+
+def test_served_with_the_token(app_module, metrics_token):
+    response = scrape(app_module, f"Bearer {TOKEN}")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert b"user_cache_resyncs" in response.get_data()
@@ -0,0 +1,234 @@
+# tests/test_migrations.py
+# migrations.migrate() on new, pre-versioning and current databases, and TableRebuild's
+# chunked copy (resume after an interruption, writes mirrored while it runs).
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import ROOT
+from migrations import SCHEMA_VERSION, TableRebuild, get_schema_version, migrate
+
+# What the app created before migrations were versioned: no heart_anchor, progress without a
+# language, user_achievements without ON UPDATE CASCADE, and rows stranded in old_progress
+BASELINE_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fullname TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        hearts INTEGER DEFAULT 5,
+        last_heart_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        xp INTEGER DEFAULT 0
+    );
+    CREATE TABLE progress (
+        user_email TEXT NOT NULL,
+        lesson_id INTEGER NOT NULL,
+        completed BOOLEAN DEFAULT 0,
+        PRIMARY KEY (user_email, lesson_id)
+    );
+    CREATE TABLE old_progress (user_email TEXT, lesson_id INTEGER, completed BOOLEAN);
+    CREATE TABLE achievements (
+        achievement_key TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL, icon TEXT,
+        reward_xp INTEGER DEFAULT 0, reward_gems INTEGER DEFAULT 0,
+        criteria_type TEXT NOT NULL, criteria_value INTEGER NOT NULL
+    );
+    CREATE TABLE user_achievements (
+        user_email TEXT NOT NULL,
+        achievement_key TEXT NOT NULL,
+        earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_email, achievement_key)
+    );
+    INSERT INTO users (fullname, email, password, hearts, last_heart_time, xp)
+        VALUES ('Ana', 'ana@example.com', 'x', 3, '2026-01-01 12:00:00', 70);
+    INSERT INTO progress VALUES ('ana@example.com', 1, 1), ('ana@example.com', 2, 1);
+    INSERT INTO old_progress VALUES ('ana@example.com', 3, 1);
+    INSERT INTO achievements VALUES ('LESSONS_1', 'First Steps', 'd', NULL, 10, 5, 'lessons_total', 1);
+    INSERT INTO user_achievements (user_email, achievement_key) VALUES ('ana@example.com', 'LESSONS_1');
+"""
+
+LATER_TABLES = ("xp_events", "xp_period_totals", "achievement_backfill_progress", "lesson_attempts",
+                "user_stats", "user_language_stats", "definition_digests", "user_row_changes")
+
+
+def connect(path):
+    return sqlite3.connect(path, isolation_level=None)
+
+
+def schema(path):
+    conn = connect(path)
+    try:
+        return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master"))
+    finally:
+        conn.close()
+
+
+def table_names(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_empty_database(tmp_path):
+    path = str(tmp_path / "new.db")
+    assert migrate(path) == list(range(1, SCHEMA_VERSION + 1))
+    conn = connect(path)
+    try:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert {"users", "progress", "achievements", "user_achievements", *LATER_TABLES} <= table_names(conn)
+        assert "heart_anchor" in [column[1] for column in conn.execute("PRAGMA table_info(users)")]
+        # Definitions are init_db's job, not a migration's
+        assert conn.execute("SELECT COUNT(*) FROM achievements").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_baseline_schema_database(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    conn = connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    assert migrate(path) == list(range(1, SCHEMA_VERSION + 1))
+    conn = connect(path)
+    try:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert set(LATER_TABLES) <= table_names(conn)
+        assert "old_progress" not in table_names(conn)
+        assert sorted(conn.execute("SELECT lesson_id, language, completed FROM progress")) == [
+            (1, "Spanish", 1), (2, "Spanish", 1), (3, "Spanish", 1)] # Recovered from old_progress
+        assert conn.execute("SELECT lessons_completed FROM user_stats").fetchone()[0] == 3
+        assert conn.execute("SELECT hearts, xp, heart_anchor FROM users").fetchone() == (
+            3, 70, int(conn.execute("SELECT strftime('%s', '2026-01-01 12:00:00', 'utc')").fetchone()[0]))
+        assert any(fk[2] == "users" and fk[5] == "CASCADE" for fk in conn.execute("PRAGMA foreign_key_list(user_achievements)"))
+        assert conn.execute("SELECT user_email, achievement_key FROM user_achievements").fetchall() == [
+            ("ana@example.com", "LESSONS_1")]
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        # Triggers and checkpoints of the rebuilds are gone
+        assert not [name for (name,) in conn.execute("SELECT name FROM sqlite_master") if "__rebuild" in name]
+    finally:
+        conn.close()
+
+
+def test_shipped_database(tmp_path):
+    path = str(tmp_path / "database.db")
+    shutil.copyfile(os.path.join(ROOT, "database.db"), path) # Never migrate the tracked file itself
+    conn = connect(path)
+    before = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("users", "progress", "user_achievements")}
+    conn.close()
+
+    migrate(path)
+    conn = connect(path)
+    try:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in before} == before
+    finally:
+        conn.close()
+
+
+def test_second_migrate_is_a_no_op(tmp_path):
+    path = str(tmp_path / "twice.db")
+    migrate(path)
+    migrated = schema(path)
+    assert migrate(path) == []
+    assert schema(path) == migrated
+
+
+def test_newer_database_is_refused(tmp_path):
+    path = str(tmp_path / "newer.db")
+    conn = connect(path)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    conn.close()
+    with pytest.raises(RuntimeError):
+        migrate(path)
+
+
+# --- TableRebuild ---
+
+def items_rebuild(chunk_size):
+    return TableRebuild(
+        "items",
+        "CREATE TABLE {name} (id INTEGER PRIMARY KEY, name TEXT NOT NULL, shout TEXT NOT NULL)",
+        columns={"id": "{row}.id", "name": "{row}.name", "shout": "upper({row}.name)"},
+        keys=("id",),
+        indexes=("CREATE INDEX idx_items_shout ON items (shout)",),
+        needed=lambda conn: "shout" not in [column[1] for column in conn.execute("PRAGMA table_info(items)")],
+        chunk_size=chunk_size,
+    )
+
+
+@pytest.fixture
+def items_db(tmp_path):
+    conn = connect(str(tmp_path / "items.db"))
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    conn.executemany("INSERT INTO items (id, name) VALUES (?, ?)", [(i, f"item {i}") for i in range(1, 11)])
+    yield conn
+    conn.close()
+
+
+def finish(conn, rebuild):
+    """The migration transaction: copies what's left and swaps the tables."""
+    conn.execute("BEGIN IMMEDIATE")
+    rebuild(conn)
+    conn.commit()
+
+
+def checkpoint(conn):
+    return conn.execute("SELECT last_rowid FROM migration_checkpoints WHERE name = 'items__rebuild'").fetchone()
+
+
+def test_rebuild_resumes_from_its_checkpoint(items_db, monkeypatch):
+    rebuild = items_rebuild(chunk_size=3)
+    copy_chunk = rebuild._copy_chunk
+    copies = []
+    def interrupted(conn, last_rowid):
+        copies.append(last_rowid)
+        if len(copies) == 3:
+            raise KeyboardInterrupt
+        return copy_chunk(conn, last_rowid)
+    monkeypatch.setattr(rebuild, "_copy_chunk", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        rebuild.prepare(items_db, 1)
+    assert checkpoint(items_db) == (6,) # Two chunks committed, the third rolled back
+    assert items_db.execute("SELECT COUNT(*) FROM items__rebuild").fetchone()[0] == 6
+
+    copies.clear()
+    monkeypatch.setattr(rebuild, "_copy_chunk", lambda conn, last_rowid: copies.append(last_rowid) or copy_chunk(conn, last_rowid))
+    rebuild.prepare(items_db, 1)
+    assert copies[0] == 6 # Picked up after the last committed chunk
+    finish(items_db, rebuild)
+
+    assert items_db.execute("SELECT id, name, shout FROM items ORDER BY id").fetchall() == [
+        (i, f"item {i}", f"ITEM {i}") for i in range(1, 11)]
+    assert checkpoint(items_db) is None
+    assert items_db.execute("SELECT name FROM sqlite_master WHERE name LIKE 'items__rebuild%'").fetchall() == []
+    assert items_db.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_items_shout'").fetchone()
+
+
+def test_rebuild_mirrors_writes_made_while_copying(items_db):
+    rebuild = items_rebuild(chunk_size=4)
+    items_db.execute("BEGIN IMMEDIATE")
+    first = rebuild._copy_chunk(items_db, rebuild._start(items_db)) # First chunk only: rows 1-4
+    items_db.commit()
+    assert first == (4, 4)
+
+    # An app process writes to the old table between chunks, on both sides of the checkpoint
+    items_db.execute("UPDATE items SET name = 'renamed' WHERE id IN (2, 8)")
+    items_db.execute("DELETE FROM items WHERE id IN (3, 9)")
+    items_db.execute("INSERT INTO items (id, name) VALUES (11, 'late')")
+    items_db.execute("UPDATE items SET id = 12 WHERE id = 1") # Key change
+
+    finish(items_db, rebuild)
+    expected = {2: "renamed", 4: "item 4", 5: "item 5", 6: "item 6", 7: "item 7", 8: "renamed", 10: "item 10",
+                11: "late", 12: "item 1"}
+    assert items_db.execute("SELECT id, name, shout FROM items ORDER BY id").fetchall() == [
+        (key, name, name.upper()) for key, name in sorted(expected.items())]
+
+
+def test_rebuild_skipped_when_not_needed(items_db):
+    rebuild = items_rebuild(chunk_size=4)
+    finish(items_db, rebuild)
+    migrated = items_db.execute("SELECT sql FROM sqlite_master WHERE name = 'items'").fetchone()
+    rebuild.prepare(items_db, 1)
+    finish(items_db, rebuild)
+    assert items_db.execute("SELECT sql FROM sqlite_master WHERE name = 'items'").fetchone() == migrated
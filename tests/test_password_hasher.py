@@ -0,0 +1,66 @@
+# tests/test_password_hasher.py
+import threading
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from password_hasher import HasherBusy, PasswordHasher
+
+METHOD = "pbkdf2:sha256:1000" # Cheap, so the tests only measure the pool
+
+
+def test_hash_and_verify_in_the_pool():
+    hasher = PasswordHasher(METHOD, workers=1)
+    password_hash = hasher.hash("secret")
+    assert hasher.verify(password_hash, "secret")
+    assert not hasher.verify(password_hash, "wrong")
+    assert hasher.stats() == {"hashes": 1, "verifications": 2, "rejected": 0, "in_flight": 0}
+
+
+def test_full_queue_fails_fast():
+    hasher = PasswordHasher(METHOD, workers=1, max_queue=0)
+    hasher.hash("warm up") # Starts the pool process outside the timed part
+    busy = threading.Thread(target=hasher._run, args=(time.sleep, 1.0))
+    busy.start()
+    try:
+        deadline = time.monotonic() + 5
+        while hasher.stats()["in_flight"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        started = time.monotonic()
+        with pytest.raises(HasherBusy):
+            hasher.hash("secret")
+        assert time.monotonic() - started < 0.5 # Rejected, not queued behind the running hash
+        assert hasher.stats()["rejected"] == 1
+    finally:
+        busy.join()
+    assert hasher.verify(hasher.hash("secret"), "secret") # A slot is free again
+
+
+def test_slow_hash_times_out():
+    hasher = PasswordHasher(METHOD, workers=1)
+    hasher.hash("warm up")
+    hasher.timeout = 0.1
+    with pytest.raises(HasherBusy):
+        hasher._run(time.sleep, 1.0)
+    assert hasher.stats()["rejected"] == 1
+
+
+@pytest.mark.parametrize("method, stale", [
+    (METHOD, False),
+    ("pbkdf2:sha256:2000", True), # Other cost
+    ("scrypt", True),             # Other method
+])
+def test_needs_rehash(method, stale):
+    hasher = PasswordHasher(METHOD, workers=0)
+    assert hasher.needs_rehash(generate_password_hash("secret", method)) is stale
+
+
+def test_needs_rehash_fills_in_defaults():
+    assert not PasswordHasher("scrypt", workers=0).needs_rehash(generate_password_hash("secret", "scrypt:32768:8:1"))
+    assert not PasswordHasher("pbkdf2", workers=0).needs_rehash(generate_password_hash("secret", "pbkdf2:sha256"))
+
+
+@pytest.mark.parametrize("password_hash", ["md5$abc$def", "not a hash", ""])
+def test_needs_rehash_unknown_formats(password_hash):
+    assert PasswordHasher(METHOD, workers=0).needs_rehash(password_hash)
@@ -0,0 +1,59 @@
+# tests/test_query_counts.py
+# Pins how many SQL statements each hot route runs, as counted by metrics.QueryStats (the same
+# numbers /metrics reports). BEGIN is counted; the sqlite3 module's commit() is not a statement.
+import pytest
+
+
+@pytest.fixture
+def query_counts(app_module, monkeypatch):
+    """Records (endpoint, queries) for every request, from the app's own after_request hook."""
+    seen = []
+    observe = app_module.request_metrics.observe
+
+    def recording_observe(endpoint, status, seconds, query_stats=None):
+        seen.append((endpoint, query_stats.queries))
+        return observe(endpoint, status, seconds, query_stats)
+
+    monkeypatch.setattr(app_module.request_metrics, "observe", recording_observe)
+
+    def count(client, url):
+        seen.clear()
+        response = client.get(url)
+        assert response.status_code == 200
+        assert len(seen) == 1
+        return seen[0][1]
+    return count
+
+
+def test_dashboard(app_module, signup, query_counts):
+    client, email = signup()
+    # BEGIN, the users row and the completed lesson ids, in one snapshot
+    assert query_counts(client, "/dashboard?lang=French") == 3
+    assert query_counts(client, "/dashboard?lang=French") == 3
+
+
+def test_dashboard_first_view_of_the_day(app_module, signup, query_counts):
+    client, email = signup()
+    conn = app_module.db_pool.acquire()
+    conn.execute("UPDATE users SET last_daily_reset = '2020-01-01', streak = 3, last_streak_update = '2020-01-01' WHERE email = ?",
+                 (email,))
+    conn.commit()
+    app_module.db_pool.release(conn)
+    app_module.invalidate_user_rows(email)
+    # Daily reset and streak decay go back in one combined UPDATE...
+    assert query_counts(client, "/dashboard?lang=French") == 4
+    # ...and only once
+    assert query_counts(client, "/dashboard?lang=French") == 3
+
+
+def test_lesson_page(app_module, signup, query_counts):
+    client, email = signup()
+    assert query_counts(client, "/lesson/1?lang=French") == 3
+    assert query_counts(client, "/lesson/1?lang=French") == 3
+
+
+def test_get_hearts(app_module, signup, query_counts):
+    client, email = signup()
+    app_module.invalidate_user_rows(email)
+    assert query_counts(client, "/get_hearts") == 1 # The users row
+    assert query_counts(client, "/get_hearts") == 0 # Polled: served from the user cache
@@ -0,0 +1,128 @@
+# tests/test_user_cache.py
+# No stale gems or hearts are served after a write, whether this process or another one made it.
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import user_cache
+from conftest import complete_lesson
+from user_cache import UserCache, UserChangeFeed
+
+
+@pytest.fixture
+def poll_every_lookup(app_module, monkeypatch):
+    """The app's change feed without its rate limit: other processes' writes show up at once."""
+    monkeypatch.setattr(app_module.user_changes, "min_interval", 0)
+
+
+def database_state(app_module, email):
+    """(gems, hearts) straight from the database, bypassing every cache."""
+    conn = sqlite3.connect(app_module.DATABASE)
+    try:
+        row = conn.execute("SELECT gems, hearts, heart_anchor FROM users WHERE email = ?", (email,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return row[0], app_module.compute_hearts(row[1], row[2], int(time.time()))[0]
+
+
+def served_state(app_module, client, email):
+    """(gems, hearts) as the app serves them: gems from the cached row, hearts from /get_hearts."""
+    with app_module.app.test_request_context():
+        row = app_module.get_user_data(email, app_module.get_db_connection())
+        gems = row["gems"] if row is not None else None
+    response = client.get("/get_hearts")
+    if response.status_code == 404:
+        return None if gems is None else (gems, None)
+    return gems, response.get_json()["hearts"]
+
+
+def write_elsewhere(app_module, sql, params):
+    """A write by another worker process: its own connection, and no invalidate() in this one."""
+    conn = sqlite3.connect(app_module.DATABASE)
+    try:
+        with conn:
+            conn.execute(sql, params)
+    finally:
+        conn.close()
+
+
+def test_no_stale_state_after_app_writes(app_module, signup):
+    client, email = signup()
+    write_elsewhere(app_module, "UPDATE users SET gems = 100000 WHERE email = ?", (email,))
+
+    # Readers keep the cache warm (and racing the writes) the whole time
+    stop = threading.Event()
+    def read_continuously():
+        reader = app_module.app.test_client()
+        with reader.session_transaction() as session:
+            session["user"] = email
+        while not stop.is_set():
+            reader.get("/get_hearts")
+            reader.get("/profile")
+    readers = [threading.Thread(target=read_continuously) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+
+    stale = []
+    try:
+        for i in range(30):
+            if i % 3 == 0:
+                assert client.post("/lose_heart").status_code == 200
+            elif i % 3 == 1:
+                assert client.post("/shop/buy_hearts").status_code == 200 # Refills the heart just lost
+            else:
+                assert complete_lesson(app_module, client, 1 + i % 5, "German").status_code == 200
+            expected = database_state(app_module, email)
+            served = served_state(app_module, client, email)
+            if served != expected:
+                stale.append((i, served, expected))
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    assert stale == []
+    assert app_module.user_cache.stats()["hits"] > 0
+
+
+def test_writes_from_another_process_are_seen(app_module, signup, poll_every_lookup):
+    client, email = signup()
+    served_state(app_module, client, email)
+    assert served_state(app_module, client, email) == database_state(app_module, email) # Now cached
+
+    write_elsewhere(app_module, "UPDATE users SET gems = gems + 7, hearts = 1, heart_anchor = ? WHERE email = ?",
+                    (int(time.time()), email))
+    assert served_state(app_module, client, email) == database_state(app_module, email)
+    assert served_state(app_module, client, email)[1] == 1
+
+
+def test_deletion_from_another_process_is_seen(app_module, signup, poll_every_lookup):
+    client, email = signup()
+    assert served_state(app_module, client, email) is not None # Cached
+
+    write_elsewhere(app_module, "DELETE FROM users WHERE email = ?", (email,))
+    assert served_state(app_module, client, email) is None
+
+
+def test_polls_are_rate_limited(app_module, signup, monkeypatch):
+    _, email = signup()
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(user_cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    cache = UserCache()
+    feed = UserChangeFeed(app_module.DATABASE, cache, min_interval=0.5)
+    feed.poll() # First poll in the process: resync
+    cache.put(email, {"gems": 0}, cache.token())
+
+    write_elsewhere(app_module, "UPDATE users SET gems = gems + 1 WHERE email = ?", (email,))
+    clock.now += 0.25
+    feed.poll()
+    assert cache.get(email) == {"gems": 0} # Within the interval: not polled, served stale
+    clock.now += 0.25
+    feed.poll()
+    assert cache.get(email) is None
+    assert feed.resyncs == 1
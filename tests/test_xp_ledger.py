@@ -0,0 +1,54 @@
+# tests/test_xp_ledger.py
+import time
+from datetime import datetime
+
+from xp_ledger import period_keys, prune_period_totals, record_xp_event, windowed_leaderboard, windowed_rank
+
+PAST_WEEK = datetime(2001, 6, 13, 12).timestamp() # Periods no other test writes to
+
+
+def add_period_xp(app_module, email, amount, timestamp):
+    conn = app_module.db_pool.acquire()
+    try:
+        record_xp_event(conn.cursor(), email, amount, "test", timestamp)
+        conn.commit()
+    finally:
+        app_module.db_pool.release(conn)
+
+
+def test_windowed_ranks_follow_rank_semantics_on_ties(app_module, signup):
+    emails = {}
+    for name, xp in (("Ada", 50), ("Bo", 30), ("Cy", 30), ("Di", 10)):
+        _, emails[name] = signup(name)
+        add_period_xp(app_module, emails[name], xp, PAST_WEEK)
+    _, idle = signup("Ed")
+
+    conn = app_module.db_pool.acquire()
+    try:
+        for period in ("week", "month"):
+            board = windowed_leaderboard(conn, period, 10, PAST_WEEK)
+            assert [(row["fullname"], row["rank"]) for row in board] == [("Ada", 1), ("Bo", 2), ("Cy", 2), ("Di", 4)]
+            for row in board:
+                assert windowed_rank(conn, period, row["email"], PAST_WEEK)["rank"] == row["rank"]
+            assert windowed_rank(conn, period, idle, PAST_WEEK) is None
+        # Cut inside the tie: the tied user left out doesn't shift anyone's rank
+        assert [row["rank"] for row in windowed_leaderboard(conn, "week", 2, PAST_WEEK)] == [1, 2]
+    finally:
+        app_module.db_pool.release(conn)
+
+
+def test_prune_keeps_only_recent_periods(app_module, signup):
+    _, email = signup()
+    now = time.time()
+    for days_ago in (800, 500, 10, 0):
+        add_period_xp(app_module, email, 5, now - days_ago * 86400)
+
+    conn = app_module.db_pool.acquire()
+    try:
+        assert prune_period_totals(conn, retention_days=400) > 0
+        kept = {row["period"] for row in conn.execute("SELECT period FROM xp_period_totals WHERE user_email = ?", (email,))}
+        assert prune_period_totals(conn, retention_days=400) == 0
+    finally:
+        app_module.db_pool.release(conn)
+    expected = set(period_keys(now - 10 * 86400).values()) | set(period_keys(now).values())
+    assert kept == expected
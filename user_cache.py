@@ -0,0 +1,171 @@
+# user_cache.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import create_connection
+
+
+class UserCache:
+    """
+    Bounded in-process cache of `users` rows keyed by email, shared across requests.
+
+    Entries expire after a TTL and the least recently used ones are evicted past `max_entries`.
+    Every code path that writes a users row calls `invalidate(email)` once its transaction has
+    committed. Readers take a `token()` before querying and hand it to `put()`: a row read before
+    a write that was invalidated in the meantime is not stored, so it can't come back after it.
+
+    Each worker process keeps its own cache; other processes' writes (and offline scripts') reach
+    it through a UserChangeFeed, so the TTL only bounds how long an idle row stays in memory.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=5):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()     # email -> (expires_at, row), least recently used first
+        self._invalidated = OrderedDict() # email -> sequence number of its latest invalidation
+        self._sequence = 0                # Invalidations so far
+        self._floor = 0                   # Newest sequence number dropped from _invalidated
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def token(self):
+        """Take before reading a row from the database; pass to put()."""
+        with self._lock:
+            return self._sequence
+
+    def get(self, email):
+        """Cached row for `email`, or None if missing or expired (counted as a hit/miss)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[email]
+            self.misses += 1
+            return None
+
+    def put(self, email, row, token):
+        """Stores `row` unless `email` was invalidated after `token` was taken."""
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            # Invalidations forgotten to keep _invalidated bounded count against every email
+            if max(self._invalidated.get(email, 0), self._floor) > token:
+                return
+            self._entries[email] = (expires_at, row)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *emails):
+        """Drops the rows of `emails`; call after committing any write to them."""
+        with self._lock:
+            for email in emails:
+                self._sequence += 1
+                self._invalidated[email] = self._sequence
+                self._invalidated.move_to_end(email)
+                if self._entries.pop(email, None) is not None:
+                    self.invalidations += 1
+            while len(self._invalidated) > self.max_entries:
+                _, sequence = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, sequence)
+
+    def clear(self):
+        """Drops every row; rows read before this call are not stored afterwards either."""
+        with self._lock:
+            self._sequence += 1
+            self._floor = self._sequence
+            self._invalidated.clear()
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UserChangeFeed:
+    """
+    Applies every process's writes to this process's UserCache.
+
+    Triggers log each updated or deleted users row in user_row_changes (migration 7). poll() reads
+    PRAGMA data_version on a connection of its own, which moves whenever any other connection
+    commits, and only then fetches the entries logged since its last poll and invalidates them.
+    Call it before trusting the cache. Polls run at most every `min_interval` seconds; calls in
+    between return at once, without the lock, so another process's write can be served stale for
+    up to that long (this process's own writes invalidate directly). With `min_interval=0` a write
+    committed before the call is never served stale after it. A process that fell further behind
+    than the log keeps, or can't read it, drops its whole cache instead.
+    """
+
+    def __init__(self, database, cache, min_interval=0):
+        self.database = database
+        self.cache = cache
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._last_seq = None
+        self._last_poll = None # time.monotonic() of the last poll that ran
+        self.resyncs = 0 # Whole-cache drops (first poll in a process, fell behind, read errors)
+
+    def poll(self):
+        if self._polled_recently(time.monotonic()):
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._polled_recently(now): # Another thread polled while we waited
+                return
+            self._last_poll = now
+            try:
+                if self._pid != os.getpid(): # Connections can't be shared across a fork; the inherited cache can't be trusted
+                    self._conn = create_connection(self.database)
+                    self._pid = os.getpid()
+                    self._data_version = None
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version == self._data_version:
+                    return
+                if self._data_version is None:
+                    self._resync()
+                else:
+                    changes = self._conn.execute("SELECT seq, email FROM user_row_changes WHERE seq > ? ORDER BY seq",
+                                                 (self._last_seq,)).fetchall()
+                    if changes and changes[0][0] != self._last_seq + 1: # Entries we never saw were pruned
+                        self._resync()
+                    elif changes:
+                        self.cache.invalidate(*{email for _, email in changes})
+                        self._last_seq = changes[-1][0]
+                self._data_version = data_version
+            except sqlite3.Error:
+                self._data_version = None # Resync on the next poll
+                self.cache.clear()
+
+    def _polled_recently(self, now):
+        return (self._last_poll is not None and now - self._last_poll < self.min_interval
+                and self._pid == os.getpid())
+
+    def _resync(self):
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM user_row_changes").fetchone()[0]
+        self.cache.clear()
+        self.resyncs += 1
@@ -0,0 +1,56 @@
+# user_stats.py
+# Denormalized lesson-completion counters, so profile and achievement checks are
+# single-row lookups instead of scans over a user's progress history.
+
+
+def increment_lesson_counts(cursor, user_email, language):
+    """
+    Bumps the total and per-language completed-lesson counters for a *first* completion.
+    Runs on the caller's cursor (same transaction as the progress insert).
+    Returns (total_lessons_completed, language_lessons_completed) after the increment.
+    """
+    total = cursor.execute(
+        """INSERT INTO user_stats (user_email, lessons_completed) VALUES (?, 1)
+           ON CONFLICT(user_email) DO UPDATE SET lessons_completed = lessons_completed + 1
+           RETURNING lessons_completed""",
+        (user_email,)
+    ).fetchone()[0]
+    language_total = cursor.execute(
+        """INSERT INTO user_language_stats (user_email, language, lessons_completed) VALUES (?, ?, 1)
+           ON CONFLICT(user_email, language) DO UPDATE SET lessons_completed = lessons_completed + 1
+           RETURNING lessons_completed""",
+        (user_email, language)
+    ).fetchone()[0]
+    return total, language_total
+
+
+def get_lessons_completed(conn, user_email):
+    """Total lessons completed across all languages (0 if none)."""
+    row = conn.execute("SELECT lessons_completed FROM user_stats WHERE user_email = ?", (user_email,)).fetchone()
+    return row[0] if row else 0
+
+
+def repair_user_stats(conn):
+    """
+    Recomputes every counter from the progress table, set-wise, in one transaction.
+    Safe to run at any time; the result is exactly what the incremental updates maintain.
+    """
+    with conn: # Commits on success, rolls back on error
+        conn.execute("DELETE FROM user_stats")
+        conn.execute("""INSERT INTO user_stats (user_email, lessons_completed)
+                        SELECT user_email, COUNT(*) FROM progress WHERE completed = 1 GROUP BY user_email""")
+        conn.execute("DELETE FROM user_language_stats")
+        conn.execute("""INSERT INTO user_language_stats (user_email, language, lessons_completed)
+                        SELECT user_email, language, COUNT(*) FROM progress WHERE completed = 1 GROUP BY user_email, language""")
+    return conn.execute("SELECT COUNT(*) FROM user_stats").fetchone()[0]
+
+
+if __name__ == "__main__":
+    # Repair command: python user_stats.py
+    from database import DATABASE
+    from db_pool import create_connection
+
+    connection = create_connection(DATABASE)
+    repaired_users = repair_user_stats(connection)
+    connection.close()
+    print(f"✅ Recomputed lesson counters for {repaired_users} users.")
@@ -0,0 +1,132 @@
+# write_behind.py
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app_logging import log_event
+
+
+class WriteBehindQueue:
+    """
+    Coalescing write-behind queue for derived, non-economic `users` columns (daily progress resets,
+    streak decay). Changes are merged per user in memory and written by a background thread in
+    one transaction every `flush_interval` seconds, or as soon as `max_pending` users are waiting.
+
+    Every queued change carries guards: the values of the columns it was derived from, as they
+    were read. The UPDATE only applies while those still match, so a synchronous write that got
+    there first (a lesson completion, say, possibly in another worker process) is never
+    overwritten. A skipped or failed change is harmless: the values are a function of the row and
+    the date, so the next read derives and queues them again.
+
+    Gems/XP and anything else that must be durable before the response goes out are written
+    directly, never through this queue. Pending changes are flushed at interpreter exit.
+    `on_flush(emails)` is called after each committed flush (e.g. to drop cached rows).
+    """
+
+    def __init__(self, pool, flush_interval=0.25, max_pending=500, on_flush=None):
+        self.pool = pool
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One flush at a time (background thread or shutdown)
+        self._pending = {}                  # email -> (changes, guards)
+        self._wake = threading.Event()
+        self._worker_pid = None
+        # --- Metrics ---
+        self.enqueued = 0
+        self.coalesced = 0     # Enqueues merged into a change already pending for the user
+        self.rows_written = 0
+        self.rows_skipped = 0  # Guard no longer matched
+        self.flushes = 0
+        self.flush_failures = 0
+        atexit.register(self.flush) # Pending changes are written before the process exits
+
+    def enqueue(self, email, changes, guards):
+        """Queues `changes` (column -> value) for a user, applied only while `guards` (column -> value read) hold."""
+        self.ensure_started()
+        with self._lock:
+            self.enqueued += 1
+            pending = self._pending.get(email)
+            if pending is not None:
+                self.coalesced += 1
+                # The latest read is the best guess of what the row holds now
+                changes = {**pending[0], **changes}
+                guards = {**pending[1], **guards}
+            self._pending[email] = (changes, guards)
+            if len(self._pending) >= self.max_pending:
+                self._wake.set()
+
+    def ensure_started(self):
+        """Starts the flush thread in this process (threads don't survive a fork, so this is re-checked per process)."""
+        if self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name="write-behind-flusher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes everything pending in one transaction. Returns the number of rows updated."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            # One executemany per statement shape
+            statements = {}
+            for email, (changes, guards) in batch.items():
+                columns, guard_columns = tuple(sorted(changes)), tuple(sorted(guards))
+                params = [changes[column] for column in columns] + [email] + [guards[column] for column in guard_columns]
+                statements.setdefault((columns, guard_columns), []).append(params)
+
+            conn = self.pool.acquire()
+            try:
+                started = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                written = 0
+                for (columns, guard_columns), rows in statements.items():
+                    assignments = ", ".join(f"{column} = ?" for column in columns)
+                    conditions = "".join(f" AND {column} IS ?" for column in guard_columns)
+                    written += conn.executemany(f"UPDATE users SET {assignments} WHERE email = ?{conditions}", rows).rowcount
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                self.flush_failures += 1
+                with self._lock: # Retry with the next flush, unless newer changes were queued meanwhile
+                    for email, pending in batch.items():
+                        self._pending.setdefault(email, pending)
+                log_event("write_behind_flush_failed", logging.WARNING, users=len(batch), error=e)
+                return 0
+            finally:
+                self.pool.release(conn)
+
+            if self.on_flush is not None:
+                self.on_flush(list(batch))
+            self.flushes += 1
+            self.rows_written += written
+            self.rows_skipped += len(batch) - written
+            log_event("write_behind_flush", logging.DEBUG, users=len(batch), written=written,
+                      ms=round((time.perf_counter() - started) * 1000, 2))
+            return written
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "rows_written": self.rows_written,
+            "rows_skipped": self.rows_skipped,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+        }
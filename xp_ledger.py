@@ -0,0 +1,134 @@
+# xp_ledger.py
+import sys
+import time
+from datetime import datetime
+
+XP_EVENT_RETENTION_DAYS = 90  # Older raw events are deleted; their XP already lives in xp_period_totals
+XP_PERIOD_RETENTION_DAYS = 400 # Week/month totals of periods that ended before this are deleted
+COMPACTION_CHUNK_SIZE = 5000   # Rows deleted per transaction, keeps write-lock hold times short
+PERIODS = ("week", "month")
+
+
+def period_keys(timestamp):
+    """Rollup keys for an epoch timestamp (server local time), e.g. {'week': '2026-W42', 'month': '2026-10'}."""
+    moment = datetime.fromtimestamp(timestamp)
+    iso_year, iso_week, _ = moment.isocalendar()
+    return {"week": f"{iso_year}-W{iso_week:02d}", "month": moment.strftime("%Y-%m")}
+
+
+def record_xp_event(cursor, user_email, amount, source, timestamp=None):
+    """
+    Appends an XP event and bumps the user's weekly and monthly totals.
+    Runs on the caller's cursor so it commits (or rolls back) with the XP change itself.
+    """
+    if amount == 0:
+        return
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    cursor.execute("INSERT INTO xp_events (user_email, amount, source, created_at) VALUES (?, ?, ?, ?)",
+                   (user_email, amount, source, timestamp))
+    for period_key in period_keys(timestamp).values():
+        cursor.execute(
+            """INSERT INTO xp_period_totals (period, user_email, xp) VALUES (?, ?, ?)
+               ON CONFLICT(period, user_email) DO UPDATE SET xp = xp + excluded.xp""",
+            (period_key, user_email, amount)
+        )
+
+
+def last_xp_event_id(conn):
+    """
+    Highest xp_events id handed out so far (AUTOINCREMENT, so compaction never lowers it). Read in
+    a write transaction, it versions that transaction's XP; read in a snapshot, everything at or
+    below it is included there.
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'xp_events'").fetchone()
+    return row[0] if row else 0
+
+
+def windowed_leaderboard(conn, period, limit, timestamp=None):
+    """
+    Top `limit` users by XP earned in the current week/month.
+    An index range read on xp_period_totals(period, xp); ranks follow RANK() semantics.
+    Returns a list of dicts (email, fullname, xp, rank).
+    """
+    period_key = period_keys(timestamp if timestamp is not None else time.time())[period]
+    rows = conn.execute(
+        """SELECT t.user_email AS email, u.fullname, t.xp
+           FROM xp_period_totals t JOIN users u ON u.email = t.user_email
+           WHERE t.period = ? AND t.xp > 0
+           ORDER BY t.xp DESC
+           LIMIT ?""",
+        (period_key, limit)
+    ).fetchall()
+
+    ranked = []
+    for position, row in enumerate(sorted(rows, key=lambda r: (-r["xp"], r["fullname"] or "")), start=1):
+        rank = ranked[-1]["rank"] if ranked and ranked[-1]["xp"] == row["xp"] else position
+        ranked.append({**dict(row), "rank": rank})
+    return ranked
+
+
+def windowed_rank(conn, period, user_email, timestamp=None):
+    """A user's RANK() in the current week/month, or None if they earned no XP in it."""
+    period_key = period_keys(timestamp if timestamp is not None else time.time())[period]
+    row = conn.execute("SELECT xp FROM xp_period_totals WHERE period = ? AND user_email = ?",
+                       (period_key, user_email)).fetchone()
+    if not row or row["xp"] <= 0:
+        return None
+    ahead = conn.execute("SELECT COUNT(*) AS count FROM xp_period_totals WHERE period = ? AND xp > ?",
+                         (period_key, row["xp"])).fetchone()["count"]
+    return {"email": user_email, "xp": row["xp"], "rank": ahead + 1}
+
+
+def _delete_in_chunks(conn, table, where, params, chunk_size):
+    """Deletes the rows of `table` matching `where`, `chunk_size` per transaction. Returns the count."""
+    deleted = 0
+    while True:
+        cursor = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+            (*params, chunk_size)
+        )
+        conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < chunk_size:
+            return deleted
+
+
+def compact_xp_events(conn, retention_days=XP_EVENT_RETENTION_DAYS, chunk_size=COMPACTION_CHUNK_SIZE):
+    """
+    Deletes raw events older than `retention_days` in chunks (one short transaction each).
+    Period totals are maintained at write time, so the rollups already contain these events.
+    Returns the number of events deleted.
+    """
+    cutoff = int(time.time()) - retention_days * 86400
+    return _delete_in_chunks(conn, "xp_events", "created_at < ?", (cutoff,), chunk_size)
+
+
+def prune_period_totals(conn, retention_days=XP_PERIOD_RETENTION_DAYS, chunk_size=COMPACTION_CHUNK_SIZE):
+    """
+    Deletes the week and month totals of periods older than `retention_days` (the period that
+    contains the cutoff is kept), in chunks. Leaderboards only rank the current periods; past ones
+    stay around for the retention window only, for reporting.
+    Returns the number of rows deleted.
+    """
+    cutoff = period_keys(time.time() - retention_days * 86400)
+    deleted = 0
+    # Keys of one kind sort chronologically as text; the GLOB keeps weeks ('2026-W42') and months ('2026-10') apart
+    for period, pattern in (("week", "????-W??"), ("month", "????-??")):
+        deleted += _delete_in_chunks(conn, "xp_period_totals", "period GLOB ? AND period < ?",
+                                     (pattern, cutoff[period]), chunk_size)
+    return deleted
+
+
+if __name__ == "__main__":
+    # Intended for a daily cron: python xp_ledger.py [retention_days] [period_retention_days]
+    from database import DATABASE
+    from db_pool import create_connection
+
+    retention = int(sys.argv[1]) if len(sys.argv) > 1 else XP_EVENT_RETENTION_DAYS
+    period_retention = int(sys.argv[2]) if len(sys.argv) > 2 else XP_PERIOD_RETENTION_DAYS
+    connection = create_connection(DATABASE)
+    removed = compact_xp_events(connection, retention)
+    pruned = prune_period_totals(connection, period_retention)
+    connection.close()
+    print(f"✅ Compacted {removed} XP events older than {retention} days.")
+    print(f"✅ Pruned {pruned} week/month totals older than {period_retention} days.")